@@ -0,0 +1,129 @@
+# app/archives.py
+"""Stream a camera's day of recordings as one TAR or ZIP, built on the fly.
+
+Nothing is staged on disk and memory use is one read buffer. A TAR's layout
+follows from the file names and sizes alone, so its length is known up front
+and Range requests can resume a broken download at any byte. A ZIP (stored,
+no compression) has to checksum each file as it goes, so it can only be
+streamed from the start.
+"""
+import os
+import tarfile
+import time
+import zipfile
+
+CHUNK_SIZE = 1024 * 1024
+BLOCK_SIZE = tarfile.BLOCKSIZE
+
+def list_day(root, date_str, camera):
+    """(archive name, full path, size, mtime) of each segment in YYYY-MM-DD/<camera>/"""
+    folder = os.path.join(root, date_str, camera)
+    entries = []
+    with os.scandir(folder) as scan:
+        for entry in scan:
+            if entry.name.endswith('.flv') and entry.is_file():
+                stat = entry.stat()
+                entries.append((f"{date_str}/{camera}/{entry.name}", entry.path, stat.st_size, int(stat.st_mtime)))
+    return sorted(entries)
+
+def read_file(path, size, start=0):
+    """Yield exactly `size - start` bytes of a file from `start`, zero-padded if it shrank"""
+    remaining = size - start
+    try:
+        with open(path, 'rb') as f:
+            f.seek(start)
+            while remaining > 0:
+                chunk = f.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+    except FileNotFoundError:
+        # Deleted (e.g. by retention) after the listing; the promised length still holds
+        pass
+    while remaining > 0:
+        padding = min(CHUNK_SIZE, remaining)
+        remaining -= padding
+        yield bytes(padding)
+
+class TarStream:
+    """A TAR of `entries` as a byte range, without building it"""
+    def __init__(self, entries):
+        self.parts = []
+        offset = 0
+        for name, path, size, mtime in entries:
+            info = tarfile.TarInfo(name)
+            info.size = size
+            info.mtime = mtime
+            info.mode = 0o644
+            header = info.tobuf(format=tarfile.GNU_FORMAT)
+            self.parts.append((offset, 'bytes', header, len(header)))
+            offset += len(header)
+            self.parts.append((offset, 'file', path, size))
+            offset += size
+            padding = -size % BLOCK_SIZE
+            if padding:
+                self.parts.append((offset, 'bytes', bytes(padding), padding))
+                offset += padding
+        # End of archive: two zero blocks
+        self.parts.append((offset, 'bytes', bytes(2 * BLOCK_SIZE), 2 * BLOCK_SIZE))
+        self.size = offset + 2 * BLOCK_SIZE
+
+    def iter_range(self, start=0, end=None):
+        """Yield bytes start..end (inclusive) of the archive"""
+        end = self.size - 1 if end is None else min(end, self.size - 1)
+        for offset, kind, value, length in self.parts:
+            if offset + length <= start:
+                continue
+            if offset > end:
+                return
+            skip = max(start - offset, 0)
+            take = min(length, end - offset + 1)
+            if kind == 'bytes':
+                yield value[skip:take]
+            else:
+                # Read only up to `take` bytes of the file
+                yield from read_file(value, take, skip)
+
+class _Buffer:
+    """Write target for ZipFile that hands back what was written since the last drain"""
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+def iter_zip(entries):
+    """Yield a stored (uncompressed) ZIP64 archive of `entries` as it is written"""
+    buffer = _Buffer()
+    # A non-seekable target makes zipfile write data descriptors after each file
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+        for name, path, size, mtime in entries:
+            info = zipfile.ZipInfo(name, date_time=_zip_date_time(mtime))
+            info.compress_type = zipfile.ZIP_STORED
+            info.file_size = size
+            with archive.open(info, 'w', force_zip64=True) as member:
+                for chunk in read_file(path, size):
+                    member.write(chunk)
+                    data = buffer.drain()
+                    if data:
+                        yield data
+            yield buffer.drain()
+    yield buffer.drain()
+
+def _zip_date_time(mtime):
+    return time.localtime(max(mtime, 315532800))[:6]  # ZIP can't store dates before 1980
@@ -0,0 +1,283 @@
+# app/async_web.py
+"""aiohttp server for the dashboard's polling API, run on app.main's event loop.
+
+In the same process as the StreamManager, /stream_status reports live ingest
+state directly instead of going through the status file. Concurrent dashboard
+polls no longer queue behind each other in Flask's threads. Anything that
+blocks (SQLite, file reads, ffmpeg) runs on a bounded thread pool, so the
+stream supervisor stays responsive.
+
+The routes here are shared with the Flask app (app.web), which still serves
+the pages and everything else. nginx sends these paths here first and falls
+back to Flask when this server isn't running (see nginx.conf).
+"""
+import asyncio
+import functools
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+from aiohttp import web
+from flask_login import current_user
+
+from app import status_events
+from app import thumbnails
+from app import web as flask_web
+from app.camera_registry import registry as camera_registry
+from app.stream_manager import read_status_file, get_env_int, SNAPSHOT_INTERVAL, WATCHDOG_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+# 0 disables the async web tier; nginx then sends everything to Flask
+ASYNC_WEB_PORT = get_env_int('ASYNC_WEB_PORT', 5002)
+ASYNC_WEB_HOST = os.environ.get('ASYNC_WEB_HOST', '0.0.0.0')
+# Threads for blocking work (database queries, file reads, ffmpeg); requests beyond this queue
+ASYNC_WEB_WORKERS = get_env_int('ASYNC_WEB_WORKERS', 8)
+
+STREAM_MANAGER = web.AppKey('stream_manager', object)
+EXECUTOR = web.AppKey('executor', ThreadPoolExecutor)
+THUMBNAIL_SLOTS = web.AppKey('thumbnail_slots', asyncio.Semaphore)
+STATUS_FEED = web.AppKey('status_feed', status_events.StatusFeed)
+STATUS_WATCH = web.AppKey('status_watch', object)
+
+def is_authenticated(path, cookie):
+    """Check the Flask login session cookie with Flask-Login itself"""
+    if flask_web.app.config.get('LOGIN_DISABLED'):
+        return True
+    if not cookie:
+        return False
+    with flask_web.app.test_request_context(path, headers={'Cookie': cookie}):
+        return current_user.is_authenticated
+
+def login_required(handler):
+    @functools.wraps(handler)
+    async def wrapper(request):
+        # Building a Flask request context and loading the session is blocking work too
+        if not await run_blocking(request, is_authenticated, request.path, request.headers.get('Cookie')):
+            raise web.HTTPFound(f"/login?next={quote(request.path_qs)}")
+        return await handler(request)
+    return wrapper
+
+async def run_blocking(request, func, *args):
+    return await asyncio.get_running_loop().run_in_executor(request.app[EXECUTOR], func, *args)
+
+async def stream_status(request):
+    stream_manager = request.app[STREAM_MANAGER]
+    if stream_manager is not None:
+        ingest = stream_manager.get_camera_status()
+    else:
+        ingest = (await run_blocking(request, read_status_file) or {}).get('cameras')
+    cameras = await run_blocking(request, camera_registry.all)
+    return web.json_response(await run_blocking(request, flask_web.get_stream_status, cameras, ingest))
+
+@login_required
+async def stream_status_events(request):
+    """Per-camera state changes as Server-Sent Events (see app/status_events.py)"""
+    feed = request.app[STATUS_FEED]
+    subscriber = feed.subscribe(asyncio.Queue(maxsize=status_events.STATUS_EVENTS_MAX_QUEUED))
+    response = web.StreamResponse(headers={
+        'Content-Type': 'text/event-stream',
+        'Cache-Control': 'no-store',
+        # Don't let a reverse proxy hold events back
+        'X-Accel-Buffering': 'no'
+    })
+    try:
+        await response.prepare(request)
+        await response.write(status_events.RETRY)
+        while True:
+            try:
+                event = await asyncio.wait_for(subscriber.get(), status_events.STATUS_EVENTS_KEEPALIVE)
+            except asyncio.TimeoutError:
+                event = status_events.KEEPALIVE
+            if event is None:
+                break
+            await response.write(event)
+    except ConnectionResetError:
+        pass
+    finally:
+        feed.unsubscribe(subscriber)
+    return response
+
+async def conditional_json(request, query):
+    """JSON from one of app.web's (etag, build) queries, or 304 if the client's copy is current"""
+    try:
+        etag, build = await run_blocking(request, query, request.query)
+    except ValueError as e:
+        return web.json_response({'error': str(e)}, status=400)
+    headers = {'ETag': etag, 'Cache-Control': 'private, no-cache'}
+    if etag in request.headers.get('If-None-Match', ''):
+        return web.Response(status=304, headers=headers)
+    return web.json_response(await run_blocking(request, build), headers=headers)
+
+@login_required
+async def api_recordings_list(request):
+    return await conditional_json(request, flask_web.recordings_list_query)
+
+@login_required
+async def api_recordings_summary(request):
+    return await conditional_json(request, flask_web.recordings_summary_query)
+
+@login_required
+async def api_calendar_data(request):
+    return await conditional_json(request, flask_web.calendar_query)
+
+@login_required
+async def api_camera_snapshot(request):
+    camera = await run_blocking(request, camera_registry.get, int(request.match_info['camera_id']))
+    if not camera:
+        return web.json_response({'error': 'Camera not found'}, status=404)
+
+    snapshot = await run_blocking(request, flask_web.get_snapshot, camera.name)
+    if snapshot is None:
+        return web.json_response({'error': 'No snapshot available yet'}, status=404)
+    data, etag = snapshot
+
+    headers = {
+        'ETag': etag,
+        # Nothing newer can exist until the pipeline writes the next one
+        'Cache-Control': f'private, max-age={max(SNAPSHOT_INTERVAL - 1, 0)}'
+    }
+    if etag in request.headers.get('If-None-Match', ''):
+        return web.Response(status=304, headers=headers)
+    return web.Response(body=data, content_type='image/jpeg', headers=headers)
+
+@login_required
+async def api_camera_playlist(request):
+    try:
+        start_ts, end_ts = flask_web.parse_playlist_range(request.query)
+    except ValueError as e:
+        return web.json_response({'error': str(e)}, status=400)
+
+    playlist, fingerprint = await run_blocking(
+        request, flask_web.get_camera_playlist, request.match_info['camera_name'], start_ts, end_ts
+    )
+    etag = f'"{fingerprint}"'
+    headers = {'ETag': etag, 'Cache-Control': 'private, no-cache'}
+    if etag in request.headers.get('If-None-Match', ''):
+        return web.Response(status=304, headers=headers)
+    return web.Response(text=playlist, content_type='application/vnd.apple.mpegurl', headers=headers)
+
+def locate_thumbnail(file_path):
+    """(rel_path, cache key, cache path) of a recording's thumbnail; None if access is denied"""
+    rel_path = flask_web.get_recording_rel_path(file_path)
+    if rel_path is None:
+        return None
+    return (rel_path, *thumbnails.lookup(flask_web.get_recordings_root(), rel_path))
+
+@login_required
+async def serve_thumbnail(request):
+    try:
+        located = await run_blocking(request, locate_thumbnail, request.match_info['file_path'])
+    except FileNotFoundError:
+        return web.json_response({'error': 'Recording not found'}, status=404)
+    if located is None:
+        return web.Response(text="Access denied", status=403)
+    rel_path, key, path = located
+
+    etag = f'"{key}"'
+    headers = {
+        'ETag': etag,
+        # A changed segment gets a new ETag, so browsers only need to revalidate now and then
+        'Cache-Control': 'private, max-age=3600'
+    }
+    if etag in request.headers.get('If-None-Match', ''):
+        return web.Response(status=304, headers=headers)
+
+    if not await run_blocking(request, os.path.exists, path):
+        slots = request.app[THUMBNAIL_SLOTS]
+        try:
+            await asyncio.wait_for(slots.acquire(), thumbnails.THUMBNAIL_TIMEOUT)
+        except asyncio.TimeoutError:
+            return web.json_response({'error': 'Thumbnail generation busy'}, status=503,
+                                     headers={'Retry-After': '5'})
+        try:
+            path = await run_blocking(request, thumbnails.generate, flask_web.get_recordings_root(), rel_path)
+        finally:
+            slots.release()
+        if path is None:
+            return web.json_response({'error': 'Failed to generate thumbnail'}, status=500)
+    await run_blocking(request, thumbnails.touch, path)
+    return web.FileResponse(path, headers={**headers, 'Content-Type': 'image/jpeg'})
+
+async def watch_status(app):
+    """Publish pipeline state to the status feed whenever the stream manager reports a change"""
+    feed = app[STATUS_FEED]
+    stream_manager = app[STREAM_MANAGER]
+    if stream_manager is None:
+        app[STATUS_WATCH] = asyncio.create_task(poll_status_file(app))
+        return
+    loop = asyncio.get_running_loop()
+    scheduled = False
+
+    def publish():
+        nonlocal scheduled
+        scheduled = False
+        feed.publish(stream_manager.get_camera_status())
+
+    def on_change():
+        # Several changes in one loop iteration are published once
+        nonlocal scheduled
+        if not scheduled:
+            scheduled = True
+            loop.call_soon(publish)
+
+    stream_manager.status_listeners.append(on_change)
+    app[STATUS_WATCH] = on_change
+    publish()
+
+async def poll_status_file(app):
+    """Without a stream manager in this process, follow the status file it writes"""
+    while True:
+        status = await asyncio.get_running_loop().run_in_executor(app[EXECUTOR], read_status_file)
+        app[STATUS_FEED].publish((status or {}).get('cameras'))
+        await asyncio.sleep(WATCHDOG_INTERVAL)
+
+async def end_status_events(app):
+    """Finish open event streams so shutdown doesn't wait for them"""
+    watch = app.get(STATUS_WATCH)
+    if isinstance(watch, asyncio.Task):
+        watch.cancel()
+    elif watch is not None:
+        app[STREAM_MANAGER].status_listeners.remove(watch)
+    feed = app[STATUS_FEED]
+    for subscriber in list(feed.subscribers):
+        feed.end(subscriber)
+
+async def shutdown_executor(app):
+    app[EXECUTOR].shutdown(wait=False, cancel_futures=True)
+
+def create_app(stream_manager=None, workers=None):
+    """The aiohttp application; without a stream manager, ingest state comes from the status file"""
+    app = web.Application()
+    app[STREAM_MANAGER] = stream_manager
+    app[EXECUTOR] = ThreadPoolExecutor(max_workers=workers or ASYNC_WEB_WORKERS, thread_name_prefix='web')
+    app[THUMBNAIL_SLOTS] = asyncio.Semaphore(thumbnails.THUMBNAIL_WORKERS)
+    app[STATUS_FEED] = status_events.StatusFeed()
+    app.on_startup.append(watch_status)
+    app.on_shutdown.append(end_status_events)
+    app.on_cleanup.append(shutdown_executor)
+    app.router.add_get('/stream_status', stream_status)
+    app.router.add_get('/stream_status/events', stream_status_events)
+    app.router.add_get('/api/recordings', api_recordings_list)
+    app.router.add_get('/api/recordings/summary', api_recordings_summary)
+    app.router.add_get('/api/calendar', api_calendar_data)
+    app.router.add_get(r'/api/camera/{camera_id:\d+}/snapshot', api_camera_snapshot)
+    app.router.add_get('/api/camera/{camera_name}/playlist.m3u8', api_camera_playlist)
+    app.router.add_get('/thumbnail/{file_path:.+}', serve_thumbnail)
+    return app
+
+async def start(stream_manager, host=None, port=None):
+    """Serve the API on the running event loop; returns the runner to clean up on shutdown"""
+    runner = web.AppRunner(create_app(stream_manager), access_log=None)
+    await runner.setup()
+    host = host or ASYNC_WEB_HOST
+    port = port or ASYNC_WEB_PORT
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Async web API listening on {host}:{port}")
+    return runner
+
+if __name__ == '__main__':
+    # Standalone, for development and benchmarking without the stream supervisor
+    logging.basicConfig(level=logging.INFO)
+    web.run_app(create_app(), host=ASYNC_WEB_HOST, port=ASYNC_WEB_PORT, access_log=None)
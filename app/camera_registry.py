@@ -0,0 +1,80 @@
+# app/camera_registry.py
+"""In-memory copy of the camera table for the web app's read paths.
+
+Every page lists the cameras (base.html's navigation), so reading them from
+SQLite per render adds up. The registry loads them once and serves read-only
+copies. Any flush that touches a Camera in this process drops the copy.
+Changes made by other processes (app.manage) are picked up after
+CAMERA_REGISTRY_TTL seconds.
+"""
+import threading
+import time
+from types import SimpleNamespace
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.database import Camera, get_session_factory
+from app.env import get_env_float
+
+CAMERA_REGISTRY_TTL = get_env_float('CAMERA_REGISTRY_TTL', 30)
+
+COLUMNS = [column.name for column in Camera.__table__.columns]
+
+class CameraRegistry:
+    def __init__(self, session_factory=None, ttl=None):
+        self.session_factory = session_factory
+        self.ttl = CAMERA_REGISTRY_TTL if ttl is None else ttl
+        self.lock = threading.Lock()
+        self.cameras = None
+        self.loaded_at = 0
+        # Bumped by invalidate(), so a load that raced with a write isn't kept
+        self.generation = 0
+
+    def invalidate(self):
+        with self.lock:
+            self.cameras = None
+            self.generation += 1
+
+    def all(self):
+        """Read-only copies of every camera, ordered by id"""
+        with self.lock:
+            if self.cameras is not None and time.monotonic() - self.loaded_at < self.ttl:
+                return self.cameras
+            generation = self.generation
+        session = (self.session_factory or get_session_factory())()
+        try:
+            cameras = [
+                SimpleNamespace(**{name: getattr(camera, name) for name in COLUMNS})
+                for camera in session.query(Camera).order_by(Camera.id)
+            ]
+        finally:
+            session.close()
+        with self.lock:
+            if generation == self.generation:
+                self.cameras = cameras
+                self.loaded_at = time.monotonic()
+        return cameras
+
+    def get(self, camera_id):
+        return next((camera for camera in self.all() if camera.id == camera_id), None)
+
+    def by_name(self, name):
+        return next((camera for camera in self.all() if camera.name == name), None)
+
+registry = CameraRegistry()
+
+@event.listens_for(Session, 'after_flush')
+def _note_camera_write(session, flush_context):
+    if any(isinstance(instance, Camera) for instance in (*session.new, *session.dirty, *session.deleted)):
+        session.info['cameras_changed'] = True
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_on_camera_write(session):
+    # Only once committed: a reload before then would cache the old rows again
+    if session.info.pop('cameras_changed', False):
+        registry.invalidate()
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_camera_write(session):
+    session.info.pop('cameras_changed', None)
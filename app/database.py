@@ -1,7 +1,13 @@
-from sqlalchemy import create_engine, Column, Integer, String
+import os
+import threading
+from sqlalchemy import create_engine, event, Column, Integer, BigInteger, Float, String, Index, inspect, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
+DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:////data/cameras.db')
+# Seconds to wait for another process's write lock instead of failing
+DATABASE_BUSY_TIMEOUT = 15
+
 Base = declarative_base()
 
 class Camera(Base):
@@ -12,8 +18,128 @@ class Camera(Base):
     stream_url = Column(String, nullable=False)
     username = Column(String)
     password = Column(String)
+    # Optional low-resolution stream for the live grid; the main stream is still recorded
+    sub_stream_url = Column(String)
+
+class Recording(Base):
+    """One recorded segment, so the web UI never has to scan the recordings tree"""
+    __tablename__ = 'recordings'
+
+    id = Column(Integer, primary_key=True)
+    camera = Column(String, nullable=False)
+    start_ts = Column(Integer, nullable=False)
+    # End is the file's last write, which is when the segment closed
+    end_ts = Column(Integer)
+    duration = Column(Float)
+    size = Column(BigInteger, nullable=False, default=0)
+    # Relative to the recordings folder, e.g. 2024-05-01/front/front-1714521600.flv
+    path = Column(String, unique=True, nullable=False)
+
+    __table_args__ = (
+        Index('ix_recordings_camera_start', 'camera', 'start_ts'),
+        Index('ix_recordings_start', 'start_ts'),
+    )
+
+class RecordingDay(Base):
+    """Segment count and size per camera per local day, kept in step with recordings by triggers.
+
+    generation goes up with every change to that day's rows (including moves),
+    so it can validate cached listings. Rows are kept when they drop to zero
+    segments, which keeps generations from ever repeating.
+    """
+    __tablename__ = 'recording_days'
+
+    camera = Column(String, primary_key=True)
+    # YYYY-MM-DD in local time, like the calendar
+    day = Column(String, primary_key=True)
+    segments = Column(Integer, nullable=False, default=0)
+    bytes = Column(BigInteger, nullable=False, default=0)
+    generation = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        Index('ix_recording_days_day', 'day'),
+    )
+
+class RecordingDir(Base):
+    """Directory mtimes from the last reconciliation; unchanged directories aren't re-listed"""
+    __tablename__ = 'recording_dirs'
+
+    path = Column(String, primary_key=True)
+    mtime_ns = Column(BigInteger, nullable=False)
+
+RECORDING_DAY = "date({row}.start_ts, 'unixepoch', 'localtime')"
+ADD_TO_DAY = """
+    INSERT INTO recording_days (camera, day, segments, bytes, generation)
+    VALUES (NEW.camera, {day}, 1, NEW.size, 1)
+    ON CONFLICT (camera, day) DO UPDATE SET
+        segments = segments + 1, bytes = bytes + excluded.bytes, generation = generation + 1;
+""".format(day=RECORDING_DAY.format(row='NEW'))
+REMOVE_FROM_DAY = """
+    UPDATE recording_days SET segments = segments - 1, bytes = bytes - OLD.size, generation = generation + 1
+    WHERE camera = OLD.camera AND day = {day};
+""".format(day=RECORDING_DAY.format(row='OLD'))
+# Triggers rather than application code, since the recordings table is also changed by bulk deletes
+RECORDING_DAY_TRIGGERS = {
+    'recordings_day_insert': f"AFTER INSERT ON recordings BEGIN {ADD_TO_DAY} END",
+    'recordings_day_delete': f"AFTER DELETE ON recordings BEGIN {REMOVE_FROM_DAY} END",
+    'recordings_day_update': f"AFTER UPDATE ON recordings BEGIN {REMOVE_FROM_DAY} {ADD_TO_DAY} END"
+}
+
+def migrate(engine):
+    """Add columns introduced after a database was created (create_all only creates tables)"""
+    columns = {column['name'] for column in inspect(engine).get_columns('cameras')}
+    with engine.begin() as connection:
+        if 'sub_stream_url' not in columns:
+            connection.execute(text('ALTER TABLE cameras ADD COLUMN sub_stream_url VARCHAR'))
+        if engine.dialect.name == 'sqlite':
+            triggers = {name for (name,) in connection.execute(text("SELECT name FROM sqlite_master WHERE type = 'trigger'"))}
+            if not set(RECORDING_DAY_TRIGGERS) <= triggers:
+                for name, body in RECORDING_DAY_TRIGGERS.items():
+                    connection.execute(text(f"CREATE TRIGGER IF NOT EXISTS {name} {body}"))
+                # Summarise recordings indexed before the triggers existed
+                connection.execute(text('DELETE FROM recording_days'))
+                connection.execute(text(f"""
+                    INSERT INTO recording_days (camera, day, segments, bytes, generation)
+                    SELECT camera, {RECORDING_DAY.format(row='recordings')}, COUNT(*), SUM(size), 1
+                    FROM recordings GROUP BY 1, 2
+                """))
+
+def _configure_sqlite(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    # WAL lets readers (the web app) carry on while the file mover or stream manager writes
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.close()
+
+_engine = None
+_session_factory = None
+_engine_lock = threading.Lock()
+
+def get_engine():
+    """The process-wide engine, created (with the schema checked) on first use"""
+    global _engine, _session_factory
+    with _engine_lock:
+        if _engine is None:
+            # The web app, stream manager and file mover all write here; wait for locks instead of failing
+            engine = create_engine(
+                DATABASE_URL,
+                connect_args={'timeout': DATABASE_BUSY_TIMEOUT, 'check_same_thread': False},
+                pool_size=5,
+                max_overflow=10,
+                pool_pre_ping=True
+            )
+            if engine.dialect.name == 'sqlite':
+                event.listen(engine, 'connect', _configure_sqlite)
+            Base.metadata.create_all(engine)
+            migrate(engine)
+            _session_factory = sessionmaker(bind=engine)
+            _engine = engine
+        return _engine
+
+def get_session_factory():
+    get_engine()
+    return _session_factory
 
 def init_db():
-    engine = create_engine('sqlite:////data/cameras.db')
-    Base.metadata.create_all(engine)
-    return sessionmaker(bind=engine)()
\ No newline at end of file
+    """A new session on the shared engine; the caller closes it"""
+    return get_session_factory()()
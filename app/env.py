@@ -0,0 +1,27 @@
+# app/env.py
+"""Numeric settings from the environment, shared by every process.
+
+A mistyped value logs a warning and falls back to the default instead of
+failing at import time. This module imports nothing from the app, so
+file_mover (which stream_manager itself imports) can use it too.
+"""
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+def get_env_int(name, default):
+    """Read an integer setting from the environment, falling back to default"""
+    try:
+        return int(os.environ.get(name, default))
+    except (ValueError, TypeError):
+        logger.warning(f"Invalid {name} value, using default of {default}")
+        return default
+
+def get_env_float(name, default):
+    """Read a float setting from the environment, falling back to default"""
+    try:
+        return float(os.environ.get(name, default))
+    except (ValueError, TypeError):
+        logger.warning(f"Invalid {name} value, using default of {default}")
+        return default
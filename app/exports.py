@@ -0,0 +1,172 @@
+# app/exports.py
+"""Background clip export: one MP4 for a camera and time range, across segments.
+
+ffmpeg's concat demuxer stream-copies the overlapping part of each segment
+(inpoint/outpoint, so cuts land on the nearest earlier keyframe) into one
+MP4. Jobs run on a small worker pool, never in a request thread, and report
+progress from ffmpeg's -progress output. Finished clips are kept in
+EXPORT_FOLDER for EXPORT_TTL seconds.
+"""
+import logging
+import os
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from app.database import Recording
+from app.env import get_env_int
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FOLDER = os.getenv('EXPORT_FOLDER', '/mnt/data/.exports')
+# Exports running at once, and how many may wait behind them
+EXPORT_WORKERS = get_env_int('EXPORT_WORKERS', 1)
+EXPORT_MAX_PENDING = get_env_int('EXPORT_MAX_PENDING', 20)
+# Longest clip accepted, and how long a finished one is kept
+EXPORT_MAX_SECONDS = get_env_int('EXPORT_MAX_SECONDS', 4 * 3600)
+EXPORT_TTL = get_env_int('EXPORT_TTL', 24 * 3600)
+# How much of ffmpeg's error output a failed job reports
+EXPORT_ERROR_CHARS = 2000
+
+class ExportError(Exception):
+    """An export request that can't be queued"""
+
+class ExportJob:
+    def __init__(self, camera, start_ts, end_ts, segments, root):
+        self.id = uuid.uuid4().hex
+        self.camera = camera
+        self.start_ts = start_ts
+        self.end_ts = end_ts
+        # (path relative to root, segment start) in time order
+        self.segments = segments
+        self.root = root
+        self.status = 'queued'
+        self.progress = 0.0
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        self.path = os.path.join(EXPORT_FOLDER, f"{self.id}.mp4")
+
+    @property
+    def filename(self):
+        started = time.strftime('%Y%m%d_%H%M%S', time.localtime(self.start_ts))
+        return f"{self.camera}_{started}_{self.end_ts - self.start_ts}s.mp4"
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'camera': self.camera,
+            'start': self.start_ts,
+            'end': self.end_ts,
+            'status': self.status,
+            'progress': round(self.progress, 3),
+            'error': self.error,
+            'filename': self.filename,
+            'size': os.path.getsize(self.path) if self.status == 'done' and os.path.exists(self.path) else None
+        }
+
+    def concat_list(self):
+        """ffmpeg concat demuxer script trimming each segment to the requested range"""
+        lines = ['ffconcat version 1.0']
+        for rel_path, segment_start in self.segments:
+            escaped = os.path.join(self.root, rel_path).replace("'", "'\\''")
+            lines.append(f"file '{escaped}'")
+            if self.start_ts > segment_start:
+                lines.append(f"inpoint {self.start_ts - segment_start}")
+            lines.append(f"outpoint {self.end_ts - segment_start}")
+        return '\n'.join(lines) + '\n'
+
+    def run(self):
+        self.status = 'running'
+        os.makedirs(EXPORT_FOLDER, exist_ok=True)
+        list_path = f"{self.path}.txt"
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(list_path, 'w') as f:
+                f.write(self.concat_list())
+            cmd = [
+                'ffmpeg', '-v', 'error', '-y', '-nostats', '-progress', 'pipe:1',
+                '-f', 'concat', '-safe', '0', '-i', list_path,
+                '-map', '0:v:0', '-map', '0:a?', '-c', 'copy',
+                '-movflags', '+faststart', '-f', 'mp4', tmp_path
+            ]
+            total = self.end_ts - self.start_ts
+            # stderr goes to a file: a second pipe could fill up while we read progress, stalling ffmpeg
+            with tempfile.TemporaryFile(mode='w+', errors='replace') as errors:
+                process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=errors, text=True)
+                for line in process.stdout:
+                    key, _, value = line.strip().partition('=')
+                    if key == 'out_time_us' and value.isdigit():
+                        self.progress = min(int(value) / 1e6 / total, 0.99)
+                if process.wait() != 0:
+                    errors.seek(0)
+                    message = errors.read().strip()[-EXPORT_ERROR_CHARS:]
+                    raise RuntimeError(message or f"ffmpeg exited with {process.returncode}")
+            os.replace(tmp_path, self.path)
+            self.progress = 1.0
+            self.status = 'done'
+            logger.info(f"Exported {self.filename} ({os.path.getsize(self.path)} bytes)")
+        except Exception as e:
+            logger.error(f"Export {self.id} failed: {e}")
+            self.status = 'failed'
+            self.error = str(e)
+        finally:
+            self.finished = time.time()
+            for path in (list_path, tmp_path):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+_executor = ThreadPoolExecutor(max_workers=EXPORT_WORKERS, thread_name_prefix='export')
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+def expire_jobs():
+    """Forget exports older than EXPORT_TTL and delete their files"""
+    cutoff = time.time() - EXPORT_TTL
+    with _jobs_lock:
+        expired = [job for job in _jobs.values() if job.finished and job.finished < cutoff]
+        for job in expired:
+            del _jobs[job.id]
+    for job in expired:
+        try:
+            os.remove(job.path)
+        except FileNotFoundError:
+            pass
+
+def submit(session, root, camera, start_ts, end_ts):
+    """Queue an export of camera's recordings in [start_ts, end_ts); returns the job"""
+    if end_ts <= start_ts:
+        raise ExportError("end must be after start")
+    if end_ts - start_ts > EXPORT_MAX_SECONDS:
+        raise ExportError(f"clips are limited to {EXPORT_MAX_SECONDS} seconds")
+    expire_jobs()
+
+    # Segments are at most a day long, so this bounds the index range scan
+    rows = session.query(Recording.path, Recording.start_ts, Recording.end_ts).filter(
+        Recording.camera == camera,
+        Recording.start_ts >= start_ts - 86400,
+        Recording.start_ts < end_ts,
+        # Only closed segments the file mover has filed away
+        Recording.path.contains('/')
+    ).order_by(Recording.start_ts).all()
+    segments = [(row.path, row.start_ts) for row in rows if row.end_ts is not None and row.end_ts > start_ts]
+    if not segments:
+        raise ExportError("no recordings in that range")
+
+    job = ExportJob(camera, start_ts, end_ts, segments, root)
+    with _jobs_lock:
+        pending = sum(1 for other in _jobs.values() if other.status in ('queued', 'running'))
+        if pending >= EXPORT_MAX_PENDING:
+            raise ExportError("too many exports in progress, try again later")
+        _jobs[job.id] = job
+    _executor.submit(job.run)
+    return job
+
+def get_job(job_id):
+    with _jobs_lock:
+        return _jobs.get(job_id)
@@ -1,8 +1,18 @@
 import os
-import shutil
+import sys
+import json
+import signal
 import time
 import logging
-from datetime import datetime, timedelta
+import threading
+from datetime import datetime
+from sqlalchemy.orm import sessionmaker
+from app import recordings_index
+from app.database import init_db
+from app.env import get_env_float
+from app.retention import RetentionEngine
+from app import thumbnails
+from app.fswatch import open_watch, IN_CLOSE_WRITE, IN_MOVED_TO, IN_Q_OVERFLOW, IN_ISDIR
 
 # Configure logging
 logging.basicConfig(
@@ -14,155 +24,297 @@ logger = logging.getLogger(__name__)
 # Source directory for recordings
 RECORDINGS_FOLDER = "/mnt/data"
 
-def get_retention_days():
-    """Get retention days from environment or use default value of 7"""
+# Where direct-to-disk recording writes segments that are still open. Files only
+# appear in RECORDINGS_FOLDER once they are closed and renamed.
+STAGING_FOLDER = os.path.join(RECORDINGS_FOLDER, ".staging")
+
+# Cumulative throughput counters, read by the web process for /metrics
+FILE_MOVER_STATS_FILE = os.environ.get('FILE_MOVER_STATS_FILE', '/tmp/file_mover_stats.json')
+
+# A segment nobody has written to for this long is treated as closed when we can't
+# be told (startup catch-up and the polling fallback)
+FILE_SETTLE_SECONDS = get_env_float('FILE_SETTLE_SECONDS', 60)
+# Daemon: gather closed segments for this long and move them as one batch
+MOVE_BATCH_SECONDS = get_env_float('MOVE_BATCH_SECONDS', 1)
+# Daemon without inotify: how often to look for settled segments
+MOVE_POLL_INTERVAL = get_env_float('MOVE_POLL_INTERVAL', 30)
+# Daemon: how often to sweep for missed segments and reconcile the recordings index
+CLEANUP_INTERVAL = get_env_float('CLEANUP_INTERVAL', 3600)
+# Daemon: how often the background retention thread checks quotas and free space
+RETENTION_INTERVAL = get_env_float('RETENTION_INTERVAL', 60)
+
+def segment_filename(camera_name, timestamp):
+    """Name of a recording segment as organize_video_files expects it: CameraName-timestamp.flv"""
+    return f"{camera_name}-{int(timestamp)}.flv"
+
+def read_stats(path=None):
+    """Cumulative file_mover counters, or zeros if it has not run yet"""
+    stats = {
+        'runs': 0,
+        'files_moved': 0,
+        'bytes_moved': 0,
+        'files_deleted': 0,
+        'bytes_deleted': 0,
+        'last_run': None
+    }
     try:
-        return int(os.environ.get('RETENTION_DAYS', 7))
-    except (ValueError, TypeError):
-        logger.warning("Invalid RETENTION_DAYS value, using default of 7 days")
-        return 7
-
-def organize_video_files():
-    """Organize video files into date-based folders by camera name"""
-    now = datetime.now()
-    threshold_time = now - timedelta(minutes=11)  # Files older than 11 minutes
-    
-    # Create directory if it doesn't exist
-    if not os.path.exists(RECORDINGS_FOLDER):
-        os.makedirs(RECORDINGS_FOLDER, exist_ok=True)
-        logger.info(f"Created recordings folder: {RECORDINGS_FOLDER}")
-    
-    for filename in os.listdir(RECORDINGS_FOLDER):
-        if filename.endswith('.flv'):
+        with open(path or FILE_MOVER_STATS_FILE, 'r') as f:
+            stats.update(json.load(f))
+    except (OSError, ValueError):
+        pass
+    return stats
+
+# The daemon's mover loop and retention thread both record stats
+_stats_lock = threading.Lock()
+
+def record_stats(moved, deleted, duration, path=None):
+    """Add one run's (files, bytes) totals to the persisted counters"""
+    with _stats_lock:
+        return _record_stats(moved, deleted, duration, path or FILE_MOVER_STATS_FILE)
+
+def _record_stats(moved, deleted, duration, path):
+    stats = read_stats(path)
+    stats['runs'] += 1
+    stats['files_moved'] += moved[0]
+    stats['bytes_moved'] += moved[1]
+    stats['files_deleted'] += deleted[0]
+    stats['bytes_deleted'] += deleted[1]
+    stats['last_run'] = {
+        'timestamp': time.time(),
+        'duration': round(duration, 3),
+        'files_moved': moved[0],
+        'bytes_moved': moved[1],
+        'files_deleted': deleted[0],
+        'bytes_deleted': deleted[1]
+    }
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(stats, f)
+    os.replace(tmp_path, path)
+    return stats
+
+def settled_segments(settle_seconds=None):
+    """Segment files in the recordings folder that nothing has written to for a while.
+
+    With inotify we hear about each segment as it closes; this is for catching up
+    at startup and for polling, where an open file has to be told apart by its mtime.
+    """
+    if settle_seconds is None:
+        settle_seconds = FILE_SETTLE_SECONDS
+    threshold = time.time() - settle_seconds
+    filenames = []
+    with os.scandir(RECORDINGS_FOLDER) as entries:
+        for entry in entries:
+            if not entry.name.endswith('.flv') or not entry.is_file():
+                continue
             try:
-                # Format appears to be "CameraName-timestamp.flv"
-                if '-' not in filename:
-                    logger.warning(f"Skipping file due to unexpected format (no hyphen): {filename}")
-                    continue
-                
-                # Split by hyphen to separate camera name and timestamp
-                parts = filename.split('-', 1)
-                if len(parts) != 2:
-                    logger.warning(f"Skipping file due to unexpected format: {filename}")
-                    continue
-                
-                camera_name = parts[0]
-                timestamp_str = parts[1].replace('.flv', '')
-                
-                logger.debug(f"Processing file: {filename}, Camera: {camera_name}, Timestamp: {timestamp_str}")
-                
-                # Convert timestamp to datetime
-                try:
-                    # Unix timestamp format
-                    timestamp = int(timestamp_str)
-                    file_datetime = datetime.fromtimestamp(timestamp)
-                except ValueError:
-                    logger.warning(f"Could not parse timestamp from filename: {filename}")
-                    continue
-                
-                # Format the date as YYYY-MM-DD for folder structure
-                date_str = file_datetime.strftime("%Y-%m-%d")
-                
-                # Only move files older than threshold
-                if file_datetime < threshold_time:
-                    # Create date folder if it doesn't exist
-                    date_folder = os.path.join(RECORDINGS_FOLDER, date_str)
-                    os.makedirs(date_folder, exist_ok=True)
-                    
-                    # Create camera folder inside date folder
-                    camera_folder = os.path.join(date_folder, camera_name)
-                    os.makedirs(camera_folder, exist_ok=True)
-                    
-                    # Move the file
-                    src_path = os.path.join(RECORDINGS_FOLDER, filename)
-                    dest_path = os.path.join(camera_folder, filename)
-                    shutil.move(src_path, dest_path)
-                    logger.info(f"Moved: {filename} -> {dest_path}")
-            except Exception as e:
-                logger.error(f"Error processing file {filename}: {e}", exc_info=True)
-
-def cleanup_old_recordings():
-    """Delete recordings older than the specified retention period"""
-    retention_days = get_retention_days()
-    logger.info(f"Cleaning up recordings older than {retention_days} days")
-    
-    # Get current time and calculate threshold (X days ago)
-    now = datetime.now()
-    threshold_date = now - timedelta(days=retention_days)
-    threshold_timestamp = threshold_date.timestamp()
-    
-    logger.info(f"Current time: {now}, Threshold date: {threshold_date}")
-    
-    # Clean up files in the root recordings directory
-    for filename in os.listdir(RECORDINGS_FOLDER):
-        file_path = os.path.join(RECORDINGS_FOLDER, filename)
-        
-        # Skip directories (they'll be handled separately)
-        if os.path.isdir(file_path):
+                if entry.stat().st_mtime < threshold:
+                    filenames.append(entry.name)
+            except FileNotFoundError:
+                continue
+    return filenames
+
+# Date/camera folders known to exist, so a batch doesn't call makedirs per file
+_created_folders = set()
+
+def move_segments(filenames, session=None, on_moved=None):
+    """Move closed segments from the recordings folder into YYYY-MM-DD/<camera>/.
+
+    Each move is a rename within one filesystem, so readers never see a partial
+    file. Index updates for the whole batch are committed together.
+    on_moved, if given, is called with each segment's new relative path.
+    Returns (files moved, bytes moved).
+    """
+    files_moved = 0
+    bytes_moved = 0
+    for filename in filenames:
+        parsed = recordings_index.parse_segment_filename(filename)
+        if parsed is None:
+            logger.warning(f"Skipping file due to unexpected format: {filename}")
             continue
-            
-        # Check if the file is a video file
-        if filename.endswith('.flv'):
+        camera_name, timestamp = parsed
+        date_str = datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d")
+        camera_folder = os.path.join(RECORDINGS_FOLDER, date_str, camera_name)
+        src_path = os.path.join(RECORDINGS_FOLDER, filename)
+        dest_path = os.path.join(camera_folder, filename)
+        try:
+            size = os.path.getsize(src_path)
+            if camera_folder not in _created_folders:
+                os.makedirs(camera_folder, exist_ok=True)
+                _created_folders.add(camera_folder)
             try:
-                file_age_days = 0
-                file_create_time = None
-                delete_file = False
-                
-                # Use creation/modification time for age calculation
-                file_mtime = datetime.fromtimestamp(os.path.getmtime(file_path))
-                file_age_days = (now - file_mtime).days
-                
-                # Log detailed info about the file for debugging
-                logger.info(f"File: {filename}, Modification time: {file_mtime}, Age: {file_age_days} days")
-                
-                # Only delete if older than retention period
-                if file_age_days >= retention_days:
-                    logger.info(f"Deleting file {filename} - {file_age_days} days old (> {retention_days} days retention)")
-                    os.remove(file_path)
-                else:
-                    logger.info(f"Keeping file {filename} - {file_age_days} days old (< {retention_days} days retention)")
-                
-            except Exception as e:
-                logger.error(f"Error processing file {filename}: {e}", exc_info=True)
-    
-    # Clean up date directories older than retention period
-    for date_dir in os.listdir(RECORDINGS_FOLDER):
-        dir_path = os.path.join(RECORDINGS_FOLDER, date_dir)
-        
-        # Skip files and process only directories
-        if not os.path.isdir(dir_path):
+                os.rename(src_path, dest_path)
+            except FileNotFoundError:
+                if not os.path.exists(src_path):
+                    raise
+                # The folder was removed (e.g. by retention) since we created it
+                os.makedirs(camera_folder, exist_ok=True)
+                os.rename(src_path, dest_path)
+        except FileNotFoundError:
+            # Already moved, e.g. by a duplicate event
             continue
-            
+        except Exception as e:
+            logger.error(f"Error processing file {filename}: {e}", exc_info=True)
+            continue
+        files_moved += 1
+        bytes_moved += size
+        logger.info(f"Moved: {filename} -> {dest_path}")
+        rel_path = f"{date_str}/{camera_name}/{filename}"
+        if session is not None:
+            recordings_index.move_recording(session, RECORDINGS_FOLDER, filename, rel_path, camera_name)
+        if on_moved is not None:
+            on_moved(rel_path)
+    if session is not None and files_moved:
+        session.commit()
+    return files_moved, bytes_moved
+
+def organize_video_files(session=None):
+    """Organize video files into date-based folders by camera name.
+
+    Moves are applied to the recordings index when a session is given.
+    Returns (files moved, bytes moved).
+    """
+    # Create directory if it doesn't exist
+    if not os.path.exists(RECORDINGS_FOLDER):
+        os.makedirs(RECORDINGS_FOLDER, exist_ok=True)
+        logger.info(f"Created recordings folder: {RECORDINGS_FOLDER}")
+    return move_segments(settled_segments(), session)
+
+def cleanup_old_recordings(session=None):
+    """Apply the retention policy once (see app.retention), without rate limiting.
+
+    Candidates come from the recordings index, so it is reconciled first.
+    Returns (files deleted, bytes deleted).
+    """
+    if session is None:
+        session = init_db()
         try:
-            # First try to determine directory age from its name (if it's in YYYY-MM-DD format)
-            dir_age_days = 0
-            try:
-                # Try to parse date from directory name (format: YYYY-MM-DD)
-                date_obj = datetime.strptime(date_dir, "%Y-%m-%d")
-                dir_age_days = (now - date_obj).days
-                logger.info(f"Directory: {date_dir}, Date from name: {date_obj}, Age: {dir_age_days} days")
-            except ValueError:
-                # If directory name is not a date, use modification time
-                dir_mtime = datetime.fromtimestamp(os.path.getmtime(dir_path))
-                dir_age_days = (now - dir_mtime).days
-                logger.info(f"Directory: {date_dir}, Modification time: {dir_mtime}, Age: {dir_age_days} days")
-            
-            # Only delete if older than retention period
-            if dir_age_days >= retention_days:
-                logger.info(f"Deleting directory {date_dir} - {dir_age_days} days old (> {retention_days} days retention)")
-                shutil.rmtree(dir_path)
+            return cleanup_old_recordings(session)
+        finally:
+            session.close()
+    recordings_index.reconcile(session, RECORDINGS_FOLDER)
+    engine = RetentionEngine(RECORDINGS_FOLDER, sessionmaker(bind=session.get_bind()))
+    return engine.run_pass(paced=False)
+
+def record_retention_stats(deleted, duration):
+    if not deleted[0]:
+        return
+    try:
+        record_stats((0, 0), deleted, duration)
+    except OSError as e:
+        logger.warning(f"Could not record file_mover stats: {e}")
+
+def run_daemon():
+    """Organize segments as they close, instead of rescanning the folder every minute.
+
+    With inotify, the cost per segment is one event plus one rename, however
+    many files are in the folder. Without it, the folder is polled every
+    MOVE_POLL_INTERVAL seconds. Retention runs in a background thread every
+    RETENTION_INTERVAL seconds, and each moved segment is queued for a thumbnail.
+    """
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+    signal.signal(signal.SIGINT, lambda signum, frame: stopping.append(signum))
+
+    os.makedirs(RECORDINGS_FOLDER, exist_ok=True)
+    session = init_db()
+    retention = RetentionEngine(RECORDINGS_FOLDER, sessionmaker(bind=session.get_bind()))
+    thumbnail_worker = thumbnails.ThumbnailWorker(RECORDINGS_FOLDER)
+    watch = open_watch(RECORDINGS_FOLDER, IN_CLOSE_WRITE | IN_MOVED_TO)
+    logger.info(f"File mover daemon watching {RECORDINGS_FOLDER} "
+                f"({'inotify' if watch else f'polling every {MOVE_POLL_INTERVAL}s'})")
+
+    # Catch up on segments that closed while we weren't running
+    pending = set(settled_segments())
+    batch_started = time.monotonic()
+    next_cleanup = time.monotonic()
+    next_poll = time.monotonic() + MOVE_POLL_INTERVAL
+    retention_thread = None
+    try:
+        while not stopping:
+            now = time.monotonic()
+            # Wake up for the end of the batch window, the next cleanup, or at least
+            # every few seconds to notice a shutdown request
+            if pending:
+                timeout = max(batch_started + MOVE_BATCH_SECONDS - now, 0)
             else:
-                logger.info(f"Keeping directory {date_dir} - {dir_age_days} days old (< {retention_days} days retention)")
-                
-        except Exception as e:
-            logger.error(f"Error processing directory {date_dir}: {e}", exc_info=True)
+                timeout = min(max(next_cleanup - now, 0), 5)
+            if watch is not None:
+                for mask, name in watch.read(timeout):
+                    if not pending:
+                        batch_started = time.monotonic()
+                    if mask & IN_Q_OVERFLOW:
+                        logger.warning("inotify queue overflowed, rescanning")
+                        pending.update(settled_segments())
+                    elif not mask & IN_ISDIR and name.endswith('.flv'):
+                        pending.add(name)
+            else:
+                time.sleep(min(timeout, max(next_poll - now, 0)))
+                if time.monotonic() >= next_poll:
+                    if not pending:
+                        batch_started = time.monotonic()
+                    pending.update(settled_segments())
+                    next_poll = time.monotonic() + MOVE_POLL_INTERVAL
+
+            if pending and time.monotonic() - batch_started >= MOVE_BATCH_SECONDS:
+                started = time.monotonic()
+                moved = move_segments(sorted(pending), session, thumbnail_worker.submit)
+                pending.clear()
+                try:
+                    record_stats(moved, (0, 0), time.monotonic() - started)
+                except OSError as e:
+                    logger.warning(f"Could not record file_mover stats: {e}")
+
+            if time.monotonic() >= next_cleanup:
+                started = time.monotonic()
+                # Safety sweep for segments whose events we missed (e.g. a queue overflow)
+                moved = move_segments(settled_segments(), session, thumbnail_worker.submit)
+                recordings_index.reconcile(session, RECORDINGS_FOLDER)
+                try:
+                    thumbnails.trim_cache()
+                except OSError as e:
+                    logger.warning(f"Could not trim thumbnail cache: {e}")
+                try:
+                    record_stats(moved, (0, 0), time.monotonic() - started)
+                except OSError as e:
+                    logger.warning(f"Could not record file_mover stats: {e}")
+                next_cleanup = time.monotonic() + CLEANUP_INTERVAL
+                if retention_thread is None:
+                    # Start once the index has been reconciled, since retention works from it
+                    retention_thread = retention.start(RETENTION_INTERVAL, on_pass=record_retention_stats)
+    finally:
+        retention.stop()
+        thumbnail_worker.shutdown()
+        if retention_thread is not None:
+            retention_thread.join(timeout=10)
+        if watch is not None:
+            watch.close()
+        session.close()
+    logger.info("File mover daemon stopped")
 
 def main():
     """Main function to organize and clean up recordings"""
     logger.info("Starting file organization and cleanup")
-    organize_video_files()
-    cleanup_old_recordings()
+    started = time.monotonic()
+    session = init_db()
+    try:
+        moved = organize_video_files(session)
+        # Reconciles the index first, picking up anything the incremental updates
+        # missed (e.g. new nginx-rtmp recordings)
+        deleted = cleanup_old_recordings(session)
+    finally:
+        session.close()
+    duration = time.monotonic() - started
+    try:
+        record_stats(moved, deleted, duration)
+    except OSError as e:
+        logger.warning(f"Could not record file_mover stats: {e}")
+    logger.info(f"METRIC file_mover files_moved={moved[0]} bytes_moved={moved[1]} "
+                f"files_deleted={deleted[0]} bytes_deleted={deleted[1]} duration={duration:.3f}s")
     logger.info("Completed file organization and cleanup")
 
 if __name__ == "__main__":
-    main()
+    if '--daemon' in sys.argv[1:]:
+        run_daemon()
+    else:
+        main()
@@ -0,0 +1,64 @@
+# app/fswatch.py
+"""Minimal inotify binding (via ctypes, no extra dependency) for watching one folder"""
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+
+logger = logging.getLogger(__name__)
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+
+_EVENT_HEADER = struct.Struct('iIII')
+
+class Inotify:
+    """Watch a single directory; read() returns (mask, name) pairs"""
+    def __init__(self, path, mask):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, f"inotify_init1: {os.strerror(error)}")
+        if libc.inotify_add_watch(self.fd, os.fsencode(path), mask) < 0:
+            error = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(error, f"inotify_add_watch {path}: {os.strerror(error)}")
+
+    def read(self, timeout):
+        """Wait up to `timeout` seconds for events"""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(data):
+            _, mask, _, name_length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = data[offset:offset + name_length].rstrip(b'\0')
+            offset += name_length
+            events.append((mask, os.fsdecode(name)))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+def open_watch(path, mask):
+    """An Inotify for `path`, or None if inotify isn't available (callers poll instead)"""
+    try:
+        return Inotify(path, mask)
+    except (OSError, AttributeError) as e:
+        # AttributeError: no inotify in this libc. ENOSPC: out of watches. Either way, poll.
+        if isinstance(e, OSError) and e.errno == errno.ENOSPC:
+            logger.warning("inotify watch limit reached (fs.inotify.max_user_watches)")
+        logger.warning(f"inotify not available, falling back to polling: {e}")
+        return None
@@ -0,0 +1,187 @@
+# app/live_relay.py
+"""Relay each camera's low-latency fMP4 feed to browsers.
+
+With LIVE_FMP4 enabled, every main-stream pipeline also muxes the camera into
+fragmented MP4 on a local tcpserversink (see StreamManager.create_live_branch).
+The web app keeps one upstream connection per camera while anyone is watching,
+splits the byte stream into MP4 boxes and fans each fragment out to all viewers.
+Every viewer gets the init segment (ftyp + moov) first, then live fragments,
+which the page appends to a Media Source Extensions buffer.
+"""
+import logging
+import queue
+import socket
+import struct
+import threading
+import time
+
+from app.env import get_env_int, get_env_float
+
+logger = logging.getLogger(__name__)
+
+# How long a viewer waits for the init segment before giving up
+LIVE_INIT_TIMEOUT = get_env_float('LIVE_INIT_TIMEOUT', 10)
+# Drop the upstream connection once nobody has watched for this long
+LIVE_IDLE_TIMEOUT = get_env_float('LIVE_IDLE_TIMEOUT', 30)
+# A viewer this many fragments behind is disconnected rather than served stale video
+LIVE_MAX_QUEUED_FRAGMENTS = get_env_int('LIVE_MAX_QUEUED_FRAGMENTS', 25)
+
+# Boxes that only make up the init segment
+INIT_BOXES = (b'ftyp', b'moov')
+# Sanity limit so a desynchronised stream is detected instead of allocating garbage sizes
+MAX_BOX_SIZE = 64 * 1024 * 1024
+
+def read_exact(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("feed closed")
+        data += chunk
+    return bytes(data)
+
+def read_box(sock):
+    """Read one top-level MP4 box; returns (type, bytes including the header)"""
+    header = read_exact(sock, 8)
+    size, box_type = struct.unpack('>I4s', header)
+    if size == 1:
+        large = read_exact(sock, 8)
+        header += large
+        size = struct.unpack('>Q', large)[0]
+    if size < len(header) or size > MAX_BOX_SIZE or not box_type.isalnum():
+        raise ValueError(f"bad MP4 box {box_type!r} of size {size}")
+    return box_type, header + read_exact(sock, size - len(header))
+
+def codec_mime_type(init_segment):
+    """MSE mime type for an init segment, e.g. video/mp4; codecs="avc1.64001f" """
+    index = init_segment.find(b'avcC')
+    if index < 0 or len(init_segment) < index + 8:
+        return 'video/mp4; codecs="avc1.42e01e"'
+    # avcC: configurationVersion, then profile, profile compatibility and level
+    profile = init_segment[index + 5:index + 8].hex()
+    return f'video/mp4; codecs="avc1.{profile}"'
+
+class LiveFeed:
+    """One camera's fMP4 feed, shared by all of its viewers"""
+    def __init__(self, name, port):
+        self.name = name
+        self.port = port
+        self.init_segment = None
+        self.mime_type = None
+        self.subscribers = set()
+        self.condition = threading.Condition()
+        self.thread = None
+        self.last_viewer_at = time.monotonic()
+
+    def subscribe(self):
+        subscriber = queue.Queue(maxsize=LIVE_MAX_QUEUED_FRAGMENTS)
+        with self.condition:
+            self.subscribers.add(subscriber)
+            self.last_viewer_at = time.monotonic()
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name=f"live-{self.name}", daemon=True)
+                self.thread.start()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.condition:
+            self.subscribers.discard(subscriber)
+            self.last_viewer_at = time.monotonic()
+
+    def wait_for_init(self, timeout=LIVE_INIT_TIMEOUT):
+        """Wait for the init segment; returns None if the feed didn't produce one in time"""
+        with self.condition:
+            self.condition.wait_for(lambda: self.init_segment is not None, timeout=timeout)
+            return self.init_segment
+
+    def _idle(self):
+        with self.condition:
+            return not self.subscribers and time.monotonic() - self.last_viewer_at > LIVE_IDLE_TIMEOUT
+
+    def _stop_if_idle(self):
+        with self.condition:
+            if not self._idle():
+                return False
+            # Cleared with the decision to exit, so a new viewer starts a new thread
+            self.thread = None
+            return True
+
+    def _run(self):
+        logger.info(f"Connecting live feed for {self.name} on port {self.port}")
+        while not self._stop_if_idle():
+            try:
+                with socket.create_connection(('127.0.0.1', self.port), timeout=5) as sock:
+                    self._relay(sock)
+            except (OSError, ValueError) as e:
+                logger.debug(f"Live feed {self.name}: {e}")
+            # The pipeline is restarting (or not up yet); its next header may differ
+            self._reset()
+            time.sleep(0.5)
+        logger.info(f"Closing idle live feed for {self.name}")
+
+    def _relay(self, sock):
+        init_parts = []
+        fragment_parts = []
+        while not self._idle():
+            box_type, box = read_box(sock)
+            if box_type in INIT_BOXES:
+                init_parts.append(box)
+                if box_type == b'moov':
+                    init_segment = b''.join(init_parts)
+                    init_parts = []
+                    with self.condition:
+                        self.init_segment = init_segment
+                        self.mime_type = codec_mime_type(init_segment)
+                        self.condition.notify_all()
+            elif self.init_segment is None:
+                # Joined mid-stream without a header; nothing we send would be playable
+                raise ValueError("fragment before init segment")
+            else:
+                fragment_parts.append(box)
+                # A fragment is complete once its media data has arrived
+                if box_type == b'mdat':
+                    self._publish(b''.join(fragment_parts))
+                    fragment_parts = []
+
+    def _publish(self, fragment):
+        with self.condition:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(fragment)
+            except queue.Full:
+                logger.warning(f"Live viewer of {self.name} fell behind, disconnecting")
+                self._end(subscriber)
+
+    def _end(self, subscriber):
+        """Tell a viewer's response to finish; the page reconnects from the live edge"""
+        with self.condition:
+            self.subscribers.discard(subscriber)
+        while True:
+            try:
+                subscriber.get_nowait()
+            except queue.Empty:
+                break
+        subscriber.put_nowait(None)
+
+    def _reset(self):
+        with self.condition:
+            had_init = self.init_segment is not None
+            self.init_segment = None
+            self.mime_type = None
+            subscribers = list(self.subscribers)
+        # Viewers have to re-initialise their decoder with the new header
+        if had_init:
+            for subscriber in subscribers:
+                self._end(subscriber)
+
+_feeds = {}
+_feeds_lock = threading.Lock()
+
+def get_feed(name, port):
+    """The shared feed for a pipeline, following it if its port changed"""
+    with _feeds_lock:
+        feed = _feeds.get(name)
+        if feed is None or feed.port != port:
+            feed = _feeds[name] = LiveFeed(name, port)
+        return feed
@@ -3,8 +3,11 @@
 import asyncio
 import signal
 import logging
+from sqlalchemy.orm import sessionmaker
 from app.database import init_db, Camera
-from app.stream_manager import StreamManager
+from app.stream_manager import StreamManager, install_child_watcher, get_env_float
+from app import async_web
+from app.camera_registry import registry as camera_registry
 
 # Set up logging
 logging.basicConfig(
@@ -13,69 +16,133 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# How often to log the RSS/CPU footprint of the ingest processes (0 disables)
+FOOTPRINT_LOG_INTERVAL = get_env_float('FOOTPRINT_LOG_INTERVAL', 300)
+
+# How often to check the camera table for changes made by the web app
+CAMERA_POLL_INTERVAL = get_env_float('CAMERA_POLL_INTERVAL', 1)
+
+def load_cameras(Session):
+    """Read the camera table in a short-lived session, so we never hold a stale snapshot"""
+    session = Session()
+    try:
+        return session.query(Camera).all()
+    finally:
+        # Closing detaches the objects but keeps their loaded attributes
+        session.close()
+
+def read_data_version(connection):
+    return connection.exec_driver_sql('PRAGMA data_version').scalar()
+
+def camera_rows(cameras):
+    """Everything stored about the cameras, to tell camera edits from other writes"""
+    columns = [column.name for column in Camera.__table__.columns]
+    return frozenset(tuple(getattr(camera, name) for name in columns) for camera in cameras)
+
+async def watch_cameras(stream_manager, engine):
+    """Apply camera additions, edits and deletions without restarting anything else.
+
+    SQLite's data_version only changes on a connection when another connection
+    commits to the database, so polling it is cheap and needs no extra table.
+    Any commit changes it, including the file mover's index writes, so the
+    camera rows are compared before anything is applied. The queries run in a
+    thread: this loop also supervises the pipelines and serves the async API.
+    """
+    Session = sessionmaker(bind=engine)
+    loop = asyncio.get_running_loop()
+    with engine.connect() as connection:
+        data_version = await loop.run_in_executor(None, read_data_version, connection)
+        cameras = await loop.run_in_executor(None, load_cameras, Session)
+        rows = camera_rows(cameras)
+        # Catch anything that changed while the cameras were starting up
+        await stream_manager.apply_cameras(cameras)
+        while True:
+            await asyncio.sleep(CAMERA_POLL_INTERVAL)
+            try:
+                version = await loop.run_in_executor(None, read_data_version, connection)
+                if version == data_version:
+                    continue
+                data_version = version
+                cameras = await loop.run_in_executor(None, load_cameras, Session)
+                if camera_rows(cameras) == rows:
+                    continue
+                rows = camera_rows(cameras)
+                # Edits come from the web process, so the async API's copy only drops here (or after its TTL)
+                camera_registry.invalidate()
+                await stream_manager.apply_cameras(cameras)
+            except Exception as e:
+                logger.error(f"Error applying camera changes: {e}", exc_info=True)
+
+async def log_footprint_periodically(stream_manager):
+    """Log per-camera RSS/CPU so the per-camera and sharded modes can be compared"""
+    while True:
+        await asyncio.sleep(FOOTPRINT_LOG_INTERVAL)
+        try:
+            stream_manager.log_footprint()
+        except Exception as e:
+            logger.error(f"Error logging footprint: {e}", exc_info=True)
+
 async def main():
     try:
         # Initialize database
         logger.info("Initializing database connection...")
         session = init_db()
-        
+
+        engine = session.get_bind()
+        session.close()
+
         # Create stream manager
         logger.info("Creating stream manager...")
-        stream_manager = StreamManager()
-        
+        install_child_watcher()
+        stream_manager = StreamManager(session_factory=sessionmaker(bind=engine))
+
         # Get all cameras from database
         logger.info("Fetching cameras from database...")
-        cameras = session.query(Camera).all()
+        cameras = load_cameras(sessionmaker(bind=engine))
         logger.info(f"Found {len(cameras)} cameras in database: {[camera.name for camera in cameras]}")
-        
-        # Start streams for all cameras
-        for camera in cameras:
-            try:
-                logger.info(f"Starting processing for camera: {camera.name}")
-                
-                # Log the details of the camera
-                logger.info(f"Camera details: Name={camera.name}, URL={camera.stream_url}")
-                
-                # Start the stream
-                logger.info(f"Attempting to start stream for camera: {camera.name}")
-                await stream_manager.start_stream(camera)
-                
-                # Confirm the stream was started successfully
-                logger.info(f"Successfully started stream for camera: {camera.name}")
-                
-                # Add a delay between starting streams
-                await asyncio.sleep(2)
-            except Exception as e:
-                logger.error(f"Error processing camera {camera.name}: {e}", exc_info=True)
-                continue
 
-        logger.info("Finished processing all cameras.")
-        
         # Setup signal handlers
-        def signal_handler(sig, frame):
+        shutdown_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+
+        def signal_handler():
             logger.info("Received shutdown signal")
-            asyncio.create_task(cleanup(stream_manager))
-        
-        signal.signal(signal.SIGINT, signal_handler)
-        signal.signal(signal.SIGTERM, signal_handler)
-        
-        # Keep the program running and monitor streams
-        while True:
-            # Log status of all streams
-            for camera in cameras:
-                if camera.name in stream_manager.processes:
-                    process = stream_manager.processes[camera.name]
-                    if process.poll() is not None:
-                        logger.error(f"Stream {camera.name} has stopped with code {process.returncode}")
-                        # Attempt to restart the stream
-                        logger.info(f"Attempting to restart stream {camera.name}")
-                        await stream_manager.start_stream(camera)
-                else:
-                    logger.warning(f"No process found for {camera.name}, attempting to start")
-                    await stream_manager.start_stream(camera)
-            
-            await asyncio.sleep(10)  # Check every 10 seconds
-            
+            shutdown_event.set()
+
+        loop.add_signal_handler(signal.SIGINT, signal_handler)
+        loop.add_signal_handler(signal.SIGTERM, signal_handler)
+
+        # Start streams for all cameras in parallel. From here on StreamManager restarts
+        # any pipeline that exits, with exponential backoff, so there is nothing to poll.
+        await stream_manager.start_all_streams(cameras)
+        logger.info("Finished processing all cameras.")
+
+        # Restart pipelines that stay alive but stop delivering frames
+        stream_manager.start_watchdog()
+
+        # Pick up cameras added, edited or deleted in the web app
+        camera_watch_task = asyncio.create_task(watch_cameras(stream_manager, engine))
+
+        footprint_task = None
+        if FOOTPRINT_LOG_INTERVAL > 0:
+            footprint_task = asyncio.create_task(log_footprint_periodically(stream_manager))
+
+        # Serve the dashboard's polling API from this loop, next to the live stream state
+        web_runner = None
+        if async_web.ASYNC_WEB_PORT > 0:
+            try:
+                web_runner = await async_web.start(stream_manager)
+            except OSError as e:
+                logger.error(f"Could not start the async web API, Flask will serve it: {e}")
+
+        await shutdown_event.wait()
+        camera_watch_task.cancel()
+        if footprint_task is not None:
+            footprint_task.cancel()
+        if web_runner is not None:
+            await web_runner.cleanup()
+        await cleanup(stream_manager)
+
     except Exception as e:
         logger.error(f"Error in main loop: {str(e)}", exc_info=True)
         raise
@@ -85,7 +152,6 @@ async def cleanup(stream_manager):
     logger.info("Starting cleanup...")
     await stream_manager.stop_all_streams()
     logger.info("Cleanup completed")
-    exit(0)
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
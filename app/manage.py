@@ -1,7 +1,7 @@
 # app/manage.py
 from .database import init_db, Camera
 
-def add_camera(name, stream_url, username=None, password=None):
+def add_camera(name, stream_url, username=None, password=None, sub_stream_url=None):
     session = init_db()
     
     # Create new camera
@@ -9,7 +9,8 @@ def add_camera(name, stream_url, username=None, password=None):
         name=name,
         stream_url=stream_url,
         username=username,
-        password=password
+        password=password,
+        sub_stream_url=sub_stream_url
     )
     
     # Add to database
@@ -30,6 +31,8 @@ def list_cameras():
     for camera in cameras:
         print(f"Name: {camera.name}")
         print(f"Stream URL: {camera.stream_url}")
+        if camera.sub_stream_url:
+            print(f"Sub Stream URL: {camera.sub_stream_url}")
         if camera.username:
             print(f"Username: {camera.username}")
         print("-" * 50)
@@ -39,7 +42,7 @@ if __name__ == "__main__":
     
     if len(sys.argv) < 2:
         print("Usage:")
-        print("  Add camera: python manage.py add <name> <stream_url> [username] [password]")
+        print("  Add camera: python manage.py add <name> <stream_url> [username] [password] [sub_stream_url]")
         print("  List cameras: python manage.py list")
         sys.exit(1)
     
@@ -55,7 +58,8 @@ if __name__ == "__main__":
         stream_url = sys.argv[3]
         username = sys.argv[4] if len(sys.argv) > 4 else None
         password = sys.argv[5] if len(sys.argv) > 5 else None
-        add_camera(name, stream_url, username, password)
+        sub_stream_url = sys.argv[6] if len(sys.argv) > 6 else None
+        add_camera(name, stream_url, username, password, sub_stream_url)
     else:
         print(f"Unknown command: {command}")
         sys.exit(1)
\ No newline at end of file
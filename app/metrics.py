@@ -0,0 +1,77 @@
+# app/metrics.py
+import threading
+import xml.etree.ElementTree as ET
+
+# Latency buckets in seconds, from fast JSON APIs up to thumbnail generation
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+def format_labels(labels):
+    """Render a label dict in Prometheus text format, e.g. {camera="front"}"""
+    if not labels:
+        return ''
+    parts = []
+    for key, value in sorted(labels.items()):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{key}="{value}"')
+    return '{' + ','.join(parts) + '}'
+
+def render_metric(name, metric_type, help_text, samples):
+    """Render one metric family; samples is a list of (labels, value) pairs"""
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}"]
+    for labels, value in samples:
+        if value is None:
+            continue
+        lines.append(f"{name}{format_labels(labels)} {value}")
+    return lines
+
+class Histogram:
+    """A minimal thread-safe Prometheus histogram"""
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['counts'][index] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                labels = dict(key)
+                for bound, count in zip(self.buckets, series['counts']):
+                    lines.append(f"{self.name}_bucket{format_labels({**labels, 'le': bound})} {count}")
+                lines.append(f"{self.name}_bucket{format_labels({**labels, 'le': '+Inf'})} {series['count']}")
+                lines.append(f"{self.name}_sum{format_labels(labels)} {series['sum']:.6f}")
+                lines.append(f"{self.name}_count{format_labels(labels)} {series['count']}")
+        return lines
+
+def parse_rtmp_stat(xml_text):
+    """Parse nginx-rtmp's /stat XML into {application: {stream: stats}}"""
+    root = ET.fromstring(xml_text)
+    applications = {}
+    for application in root.iter('application'):
+        app_name = application.findtext('name', '')
+        streams = {}
+        for stream in application.iter('stream'):
+            streams[stream.findtext('name', '')] = {
+                'bytes_in': int(stream.findtext('bytes_in', '0') or 0),
+                'bytes_out': int(stream.findtext('bytes_out', '0') or 0),
+                'bw_in': int(stream.findtext('bw_in', '0') or 0),
+                'bw_out': int(stream.findtext('bw_out', '0') or 0),
+                'clients': int(stream.findtext('nclients', '0') or 0),
+                'uptime_ms': int(stream.findtext('time', '0') or 0),
+            }
+        applications[app_name] = streams
+    return applications
@@ -0,0 +1,169 @@
+# app/recordings_index.py
+"""Keep the Recording table in step with the segments under the recordings folder.
+
+Segments are added as they close (StreamManager.finalize_segment) and moved or
+deleted by file_mover, so the table is normally updated incrementally.
+reconcile() catches anything changed behind our back, such as nginx-rtmp
+recordings or files deleted by hand. It only re-lists directories whose mtime
+changed since the last pass, so a pass over a quiet tree is one stat per
+directory.
+
+Paths in the table are relative to the recordings folder.
+"""
+import logging
+import os
+import re
+from datetime import datetime
+
+from app.database import Recording, RecordingDir
+
+logger = logging.getLogger(__name__)
+
+# CameraName-<unix timestamp>.flv, as written by direct recording and expected by file_mover
+SEGMENT_NAME = re.compile(r'^(?P<camera>.+)-(?P<timestamp>\d+)\.flv$')
+# CameraName_YYYYmmdd_HHMMSS.flv, nginx-rtmp's record_suffix naming
+RTMP_SEGMENT_NAME = re.compile(r'^(?P<camera>.+)_(?P<date>\d{8})_(?P<time>\d{6})\.flv$')
+DATE_DIR = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+# Longest plausible segment; anything longer means the mtime isn't the end time
+MAX_SEGMENT_SECONDS = 24 * 3600
+
+def parse_segment_filename(filename):
+    """Return (camera, start timestamp) for a segment file name, or None"""
+    match = SEGMENT_NAME.match(filename)
+    if match:
+        timestamp = int(match.group('timestamp'))
+        if timestamp > 253402300799:  # Year 9999 in seconds, so this is milliseconds
+            timestamp //= 1000
+        return match.group('camera'), timestamp
+    match = RTMP_SEGMENT_NAME.match(filename)
+    if match:
+        started = datetime.strptime(match.group('date') + match.group('time'), '%Y%m%d%H%M%S')
+        return match.group('camera'), int(started.timestamp())
+    return None
+
+def _segment_fields(root, rel_path, camera=None):
+    """Column values for a segment file, or None if it isn't one of ours"""
+    filename = os.path.basename(rel_path)
+    stat = os.stat(os.path.join(root, rel_path))
+    parsed = parse_segment_filename(filename)
+    if parsed:
+        parsed_camera, start_ts = parsed
+    elif filename.endswith('.flv') and camera:
+        # Unrecognised name inside a camera folder: fall back to the modification time
+        parsed_camera, start_ts = camera, int(stat.st_mtime)
+    else:
+        return None
+    end_ts = int(stat.st_mtime)
+    duration = end_ts - start_ts
+    if not 0 <= duration <= MAX_SEGMENT_SECONDS:
+        end_ts, duration = None, None
+    return {
+        'camera': camera or parsed_camera,
+        'start_ts': start_ts,
+        'end_ts': end_ts,
+        'duration': duration,
+        'size': stat.st_size,
+        'path': rel_path
+    }
+
+def add_recording(session, root, rel_path, camera=None):
+    """Index (or re-index) one segment file; the caller commits"""
+    try:
+        fields = _segment_fields(root, rel_path, camera)
+    except FileNotFoundError:
+        return None
+    if fields is None:
+        return None
+    recording = session.query(Recording).filter_by(path=rel_path).first()
+    if recording is None:
+        recording = Recording(**fields)
+        session.add(recording)
+    else:
+        for key, value in fields.items():
+            setattr(recording, key, value)
+    return recording
+
+def move_recording(session, root, old_rel_path, new_rel_path, camera=None):
+    """Point an indexed segment at its new location; the caller commits"""
+    recording = session.query(Recording).filter_by(path=old_rel_path).first()
+    if recording is not None:
+        recording.path = new_rel_path
+    # Refresh size and end time too: a file indexed while still being recorded has grown since
+    return add_recording(session, root, new_rel_path, camera)
+
+def _under(prefix):
+    """Filter for rows whose path is inside the directory `prefix`, using the path index"""
+    # '0' sorts right after '/', so this is a range scan over "<prefix>/..."
+    return (Recording.path > prefix + '/') & (Recording.path < prefix + '0')
+
+def remove_recordings(session, rel_path):
+    """Drop a deleted file, or everything under a deleted directory; the caller commits"""
+    removed = session.query(Recording).filter(Recording.path == rel_path).delete(synchronize_session=False)
+    removed += session.query(Recording).filter(_under(rel_path)).delete(synchronize_session=False)
+    session.query(RecordingDir).filter(
+        (RecordingDir.path == rel_path) | ((RecordingDir.path > rel_path + '/') & (RecordingDir.path < rel_path + '0'))
+    ).delete(synchronize_session=False)
+    return removed
+
+def _segment_dirs(root):
+    """Yield (relative path, camera) for the root and every date/camera folder"""
+    yield '', None
+    for date_dir in os.listdir(root):
+        if not DATE_DIR.match(date_dir) or not os.path.isdir(os.path.join(root, date_dir)):
+            continue
+        for camera in os.listdir(os.path.join(root, date_dir)):
+            if os.path.isdir(os.path.join(root, date_dir, camera)):
+                yield f"{date_dir}/{camera}", camera
+
+def _sync_dir(session, root, rel_dir, camera):
+    """Make the rows for one directory match its .flv files; returns (added, removed)"""
+    full_dir = os.path.join(root, rel_dir)
+    on_disk = {
+        (f"{rel_dir}/{filename}" if rel_dir else filename)
+        for filename in os.listdir(full_dir)
+        if filename.endswith('.flv') and os.path.isfile(os.path.join(full_dir, filename))
+    }
+    query = session.query(Recording.path)
+    query = query.filter(_under(rel_dir)) if rel_dir else query.filter(~Recording.path.contains('/'))
+    indexed = {path for (path,) in query}
+
+    added = 0
+    for rel_path in on_disk - indexed:
+        if add_recording(session, root, rel_path, camera) is not None:
+            added += 1
+    stale = indexed - on_disk
+    if stale:
+        session.query(Recording).filter(Recording.path.in_(stale)).delete(synchronize_session=False)
+    return added, len(stale)
+
+def reconcile(session, root):
+    """Bring the index in line with the filesystem; returns (added, removed) and commits"""
+    if not os.path.isdir(root):
+        return 0, 0
+    known = {row.path: row for row in session.query(RecordingDir)}
+    seen = set()
+    added = removed = 0
+    for rel_dir, camera in _segment_dirs(root):
+        seen.add(rel_dir)
+        try:
+            mtime_ns = os.stat(os.path.join(root, rel_dir)).st_mtime_ns
+        except FileNotFoundError:
+            continue
+        row = known.get(rel_dir)
+        if row is not None and row.mtime_ns == mtime_ns:
+            continue
+        dir_added, dir_removed = _sync_dir(session, root, rel_dir, camera)
+        added += dir_added
+        removed += dir_removed
+        if row is None:
+            session.add(RecordingDir(path=rel_dir, mtime_ns=mtime_ns))
+        else:
+            row.mtime_ns = mtime_ns
+
+    # Directories that disappeared (e.g. deleted by hand)
+    for rel_dir in set(known) - seen:
+        removed += remove_recordings(session, rel_dir)
+    session.commit()
+    if added or removed:
+        logger.info(f"Recordings index reconciled: added={added} removed={removed}")
+    return added, removed
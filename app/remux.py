@@ -0,0 +1,150 @@
+# app/remux.py
+"""Stream-copy FLV recordings to fragmented MP4 (or MPEG-TS) so browsers can play them.
+
+ffmpeg copies the H.264 stream into fragmented MP4 (no transcode), writing into
+the remux cache. Viewers follow the growing file, so playback starts as soon
+as the first fragment is out. Concurrent requests for the same segment share
+one job. Finished files stay in the cache, keyed like thumbnails on path,
+mtime and size, and are trimmed least recently used first past
+REMUX_CACHE_MAX_BYTES.
+
+The MPEG-TS variant feeds the continuous-timeline HLS playlists (see
+app/vod.py). It can shift timestamps by a given offset, so consecutive
+segments line up on one timeline.
+"""
+import logging
+import os
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app import thumbnails
+from app.env import get_env_int
+from app.retention import get_env_size
+
+logger = logging.getLogger(__name__)
+
+REMUX_FOLDER = os.getenv('REMUX_FOLDER', '/mnt/data/.remux')
+# A size such as 2G
+REMUX_CACHE_MAX_BYTES = get_env_size('REMUX_CACHE_MAX_BYTES', 2 * 1024 * 1024 * 1024)
+# Remuxes running at once; further requests queue (or join a running job)
+REMUX_WORKERS = get_env_int('REMUX_WORKERS', 2)
+REMUX_TIMEOUT = 300
+
+# How often a viewer checks a running job for more output
+FOLLOW_INTERVAL = 0.1
+CHUNK_SIZE = 256 * 1024
+
+# ffmpeg output options per format
+FORMATS = {
+    # empty_moov puts the init segment first, so the file plays while it grows
+    'mp4': ['-movflags', 'frag_keyframe+empty_moov+default_base_moof', '-f', 'mp4'],
+    'ts': ['-f', 'mpegts']
+}
+MIME_TYPES = {'mp4': 'video/mp4', 'ts': 'video/mp2t'}
+
+class RemuxJob:
+    """One ffmpeg run producing `path`; readers follow `tmp_path` while it runs"""
+    def __init__(self, key, source, path, folder, format='mp4', ts_offset=None):
+        self.key = key
+        self.source = source
+        self.path = path
+        self.folder = folder
+        self.format = format
+        self.ts_offset = ts_offset
+        self.tmp_path = f"{path}.tmp"
+        self.done = threading.Event()
+        self.failed = False
+        self.started = threading.Event()
+
+    def run(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        cmd = ['ffmpeg', '-v', 'error', '-y', '-i', self.source,
+               '-map', '0:v:0', '-map', '0:a?', '-c', 'copy']
+        if self.ts_offset is not None:
+            cmd += ['-output_ts_offset', str(self.ts_offset)]
+        cmd += FORMATS[self.format] + [self.tmp_path]
+        try:
+            # Created up front so followers can open it as soon as the job starts
+            open(self.tmp_path, 'wb').close()
+            self.started.set()
+            subprocess.run(cmd, capture_output=True, check=True, timeout=REMUX_TIMEOUT)
+            os.replace(self.tmp_path, self.path)
+            logger.info(f"Remuxed {self.source} ({os.path.getsize(self.path)} bytes)")
+        except (subprocess.SubprocessError, OSError) as e:
+            stderr = getattr(e, 'stderr', None) or b''
+            logger.warning(f"Could not remux {self.source}: {e} {stderr.decode(errors='replace').strip()}")
+            self.failed = True
+            try:
+                os.remove(self.tmp_path)
+            except FileNotFoundError:
+                pass
+        finally:
+            self.started.set()
+            self.done.set()
+            with _jobs_lock:
+                _jobs.pop(self.key, None)
+        try:
+            thumbnails.trim_cache(REMUX_CACHE_MAX_BYTES, self.folder)
+        except OSError as e:
+            logger.warning(f"Could not trim remux cache: {e}")
+
+    def follow(self, start=0, end=None):
+        """Yield the output from byte `start` (to `end`, inclusive) as it is written.
+
+        The file is opened once, so a reader keeps going even after the job
+        renames it into place.
+        """
+        self.started.wait()
+        try:
+            f = open(self.tmp_path, 'rb')
+        except FileNotFoundError:
+            # Finished (or failed) before we got here
+            if self.failed:
+                return
+            f = open(self.path, 'rb')
+        with f:
+            f.seek(start)
+            position = start
+            while end is None or position <= end:
+                size = CHUNK_SIZE if end is None else min(CHUNK_SIZE, end - position + 1)
+                chunk = f.read(size)
+                if chunk:
+                    position += len(chunk)
+                    yield chunk
+                elif self.done.is_set():
+                    # Whatever was written before completion has been read once the
+                    # next read still comes back empty
+                    chunk = f.read(size)
+                    if not chunk:
+                        return
+                    position += len(chunk)
+                    yield chunk
+                else:
+                    time.sleep(FOLLOW_INTERVAL)
+
+_executor = ThreadPoolExecutor(max_workers=REMUX_WORKERS, thread_name_prefix='remux')
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+def get_remux(root, rel_path, folder=None, format='mp4', ts_offset=None):
+    """The cached remux of a segment if it is ready, else the (possibly shared) running job.
+
+    Returns (key, path, job); job is None when the cached file can be served
+    as it is. Raises FileNotFoundError if the segment is gone.
+    """
+    folder = folder or REMUX_FOLDER
+    suffix = f".{format}" if ts_offset is None else f".{int(ts_offset)}.{format}"
+    key, path = thumbnails.lookup(root, rel_path, folder, suffix)
+    # The same segment can be cached in several formats
+    key = f"{key}{suffix}"
+    if os.path.exists(path):
+        thumbnails.touch(path)
+        return key, path, None
+    with _jobs_lock:
+        job = _jobs.get(key)
+        if job is None:
+            job = _jobs[key] = RemuxJob(key, os.path.join(root, rel_path), path, folder, format, ts_offset)
+            _executor.submit(job.run)
+    return key, path, job
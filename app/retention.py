@@ -0,0 +1,238 @@
+# app/retention.py
+"""Delete recordings by age, byte quota and free disk space, oldest first.
+
+Rules, applied in this order on every pass:
+
+- RETENTION_DAYS: segments older than this are deleted
+- RETENTION_CAMERA_MAX_BYTES / RETENTION_CAMERA_QUOTAS: per-camera byte quotas
+- RETENTION_MAX_BYTES: a quota for all cameras together
+- RETENTION_FREE_LOW / RETENTION_FREE_HIGH: when free space drops below the low
+  watermark, delete until it is back above the high one (off unless set, since
+  other data on a shared disk would otherwise cost recordings)
+
+Candidates come from the recordings index in start_ts order (see the
+ix_recordings_start and ix_recordings_camera_start indexes), so no pass walks
+the recordings tree. Deletion is paced to RETENTION_DELETE_BYTES_PER_SEC and
+RETENTION_DELETE_FILES_PER_SEC so it never starves the recorders.
+"""
+import logging
+import os
+import re
+import threading
+import time
+
+from sqlalchemy import func
+
+from app.database import Recording
+from app.env import get_env_float
+
+logger = logging.getLogger(__name__)
+
+SIZE_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+SIZE_VALUE = re.compile(r'^\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?\s*$', re.IGNORECASE)
+
+# Segments written to this recently may still be open (nginx-rtmp writes in place)
+OPEN_SEGMENT_SECONDS = 60
+# Candidates fetched from the index per query
+BATCH_SIZE = 200
+
+def parse_size(value):
+    """Parse "500M", "1.5T" or a plain byte count; empty or invalid means 0 (no limit)"""
+    match = SIZE_VALUE.match(str(value or ''))
+    if not match:
+        if value:
+            logger.warning(f"Invalid size {value!r}, ignoring")
+        return 0
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2).upper()])
+
+def get_env_size(name, default):
+    """A byte size setting such as "200M"; default if it is unset or invalid"""
+    value = os.environ.get(name, '')
+    if not value.strip():
+        return default
+    if not SIZE_VALUE.match(value):
+        logger.warning(f"Invalid {name} value, using default of {default}")
+        return default
+    return parse_size(value)
+
+def parse_free_space(value, total_bytes):
+    """A watermark as a byte count: "10%" of the disk, or a size such as "50G" """
+    value = str(value or '').strip()
+    if value.endswith('%'):
+        try:
+            return int(total_bytes * float(value[:-1]) / 100)
+        except ValueError:
+            logger.warning(f"Invalid free space watermark {value!r}, ignoring")
+            return 0
+    return parse_size(value)
+
+def parse_camera_quotas(value):
+    """Parse "front=50G,back=20G" into {camera: bytes}"""
+    quotas = {}
+    for item in (value or '').split(','):
+        if '=' not in item:
+            continue
+        camera, size = item.split('=', 1)
+        quotas[camera.strip()] = parse_size(size)
+    return quotas
+
+class RetentionPolicy:
+    """The retention rules, read from the environment"""
+    def __init__(self, environ=None):
+        environ = os.environ if environ is None else environ
+        try:
+            self.days = int(environ.get('RETENTION_DAYS', 7))
+        except (ValueError, TypeError):
+            logger.warning("Invalid RETENTION_DAYS value, using default of 7 days")
+            self.days = 7
+        self.max_bytes = parse_size(environ.get('RETENTION_MAX_BYTES'))
+        self.camera_max_bytes = parse_size(environ.get('RETENTION_CAMERA_MAX_BYTES'))
+        self.camera_quotas = parse_camera_quotas(environ.get('RETENTION_CAMERA_QUOTAS'))
+        self.free_low = environ.get('RETENTION_FREE_LOW')
+        self.free_high = environ.get('RETENTION_FREE_HIGH')
+
+    def camera_quota(self, camera):
+        return self.camera_quotas.get(camera, self.camera_max_bytes)
+
+class RetentionEngine:
+    """Applies a RetentionPolicy to the recordings under `root`"""
+    def __init__(self, root, session_factory, policy=None, bytes_per_sec=None, files_per_sec=None):
+        self.root = root
+        self.session_factory = session_factory
+        self.policy = policy or RetentionPolicy()
+        # A size such as "200M"; 0 means unpaced
+        self.bytes_per_sec = get_env_size('RETENTION_DELETE_BYTES_PER_SEC', 200 * 1024 ** 2) \
+            if bytes_per_sec is None else bytes_per_sec
+        self.files_per_sec = get_env_float('RETENTION_DELETE_FILES_PER_SEC', 20) \
+            if files_per_sec is None else files_per_sec
+        self.stop_event = threading.Event()
+
+    def run_pass(self, paced=True):
+        """Apply every rule once; returns (files deleted, bytes deleted)"""
+        session = self.session_factory()
+        self._deleted = [0, 0]
+        self._paced = paced
+        try:
+            now = time.time()
+            if self.policy.days > 0:
+                cutoff = now - self.policy.days * 86400
+                self._evict(session, [Recording.start_ts < cutoff], None, 'age')
+
+            usage = dict(session.query(Recording.camera, func.sum(Recording.size)).group_by(Recording.camera))
+            for camera, used in usage.items():
+                quota = self.policy.camera_quota(camera)
+                if quota and used > quota:
+                    self._evict(session, [Recording.camera == camera], used - quota, f'quota:{camera}')
+
+            if self.policy.max_bytes:
+                used = session.query(func.coalesce(func.sum(Recording.size), 0)).scalar()
+                if used > self.policy.max_bytes:
+                    self._evict(session, [], used - self.policy.max_bytes, 'quota')
+
+            needed = self.free_space_needed()
+            if needed:
+                self._evict(session, [], needed, 'free-space')
+        finally:
+            session.close()
+        files, size = self._deleted
+        if files:
+            logger.info(f"METRIC retention files_deleted={files} bytes_deleted={size}")
+        return files, size
+
+    def free_space_needed(self):
+        """Bytes to delete to get back above the high watermark, or 0 while above the low one"""
+        if not self.policy.free_low:
+            return 0
+        stat = os.statvfs(self.root)
+        total = stat.f_blocks * stat.f_frsize
+        free = stat.f_bavail * stat.f_frsize
+        low = parse_free_space(self.policy.free_low, total)
+        high = max(parse_free_space(self.policy.free_high, total), low)
+        if free >= low:
+            return 0
+        return high - free
+
+    def _evict(self, session, conditions, bytes_needed, reason):
+        """Delete the oldest matching segments until bytes_needed is freed (or all, if None)"""
+        freed = 0
+        open_cutoff = time.time() - OPEN_SEGMENT_SECONDS
+        skipped = set()
+        while bytes_needed is None or freed < bytes_needed:
+            if self.stop_event.is_set():
+                return
+            query = session.query(Recording).filter(*conditions)
+            if skipped:
+                query = query.filter(Recording.id.notin_(skipped))
+            batch = query.order_by(Recording.start_ts).limit(BATCH_SIZE).all()
+            if not batch:
+                if bytes_needed is not None:
+                    logger.warning(f"Retention ({reason}): nothing left to delete, {bytes_needed - freed} bytes short")
+                return
+            for recording in batch:
+                path = os.path.join(self.root, recording.path)
+                try:
+                    if os.path.getmtime(path) > open_cutoff:
+                        # Possibly still being written; never delete the live segment
+                        skipped.add(recording.id)
+                        continue
+                    os.remove(path)
+                    self._deleted[0] += 1
+                    self._deleted[1] += recording.size
+                    logger.debug(f"Retention ({reason}): deleted {recording.path}")
+                except FileNotFoundError:
+                    # Moved or deleted since it was indexed; reconcile() will catch up
+                    skipped.add(recording.id)
+                    continue
+                except OSError as e:
+                    logger.error(f"Retention ({reason}): could not delete {recording.path}: {e}")
+                    skipped.add(recording.id)
+                    continue
+                freed += recording.size
+                session.delete(recording)
+                self._remove_empty_parents(path)
+                self._pace(recording.size)
+                if bytes_needed is not None and freed >= bytes_needed:
+                    break
+            session.commit()
+
+    def _remove_empty_parents(self, path):
+        """Remove the camera and date folders once their last segment is gone"""
+        folder = os.path.dirname(path)
+        while os.path.abspath(folder) != os.path.abspath(self.root):
+            try:
+                os.rmdir(folder)
+            except OSError:
+                return
+            folder = os.path.dirname(folder)
+
+    def _pace(self, size):
+        if not self._paced:
+            return
+        delay = 0.0
+        if self.bytes_per_sec > 0:
+            delay = size / self.bytes_per_sec
+        if self.files_per_sec > 0:
+            delay = max(delay, 1 / self.files_per_sec)
+        if delay:
+            self.stop_event.wait(delay)
+
+    def run_forever(self, interval, on_pass=None):
+        """Run passes every `interval` seconds until stop() is called"""
+        while not self.stop_event.is_set():
+            started = time.monotonic()
+            try:
+                deleted = self.run_pass()
+                if on_pass is not None:
+                    on_pass(deleted, time.monotonic() - started)
+            except Exception as e:
+                logger.error(f"Error applying retention: {e}", exc_info=True)
+            self.stop_event.wait(interval)
+
+    def start(self, interval, on_pass=None):
+        """Run in a background thread"""
+        thread = threading.Thread(target=self.run_forever, args=(interval, on_pass), name='retention', daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self.stop_event.set()
@@ -0,0 +1,279 @@
+# app/shard_worker.py
+"""Run several camera pipelines as branches of one GStreamer process.
+
+StreamManager starts this with `python3 -m app.shard_worker` when SHARD_SIZE > 1.
+Commands arrive on stdin as JSON lines:
+
+    {"op": "add", "name": "<camera>", "pipeline": [<gst-launch tokens>]}
+    {"op": "remove", "name": "<camera>"}
+    {"op": "restart", "name": "<camera>"}
+
+Branch state is reported on stdout as JSON lines, e.g.
+{"branch": "<camera>", "state": "READY"}. An error inside one branch only tears
+down and restarts that branch; the other cameras keep running.
+"""
+import json
+import logging
+import signal
+import sys
+import threading
+import time
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import GLib, Gst
+
+from app.stream_manager import RESTART_STABLE_SECONDS, restart_delay
+
+# Logs go to stderr, which StreamManager drains; stdout is reserved for branch events
+logging.basicConfig(
+    level=logging.INFO,
+    stream=sys.stderr,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# Characters that are safe unquoted in a gst-launch property value
+SAFE_VALUE_CHARS = set('abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_-./:')
+
+_stdout_lock = threading.Lock()
+
+# How often each branch's frame/byte counters are reported
+STATS_INTERVAL_MS = 1000
+
+def report(name, state, detail=None, **fields):
+    """Write a branch event for StreamManager (safe to call from streaming threads)"""
+    event = {'branch': name, 'state': state}
+    if detail:
+        event['detail'] = detail
+    event.update(fields)
+    with _stdout_lock:
+        sys.stdout.write(json.dumps(event) + "\n")
+        sys.stdout.flush()
+
+def tokens_to_description(tokens):
+    """Join gst-launch tokens into a parse_launch string, quoting values as needed"""
+    parts = []
+    for token in tokens:
+        # Caps filters such as video/x-raw,width=640 are passed through as they are
+        if '=' in token and '/' not in token.split('=', 1)[0]:
+            key, value = token.split('=', 1)
+            if not set(value) <= SAFE_VALUE_CHARS:
+                value = '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
+            token = f"{key}={value}"
+        parts.append(token)
+    return ' '.join(parts)
+
+class Branch:
+    """One camera's elements, held in their own bin inside the shared pipeline"""
+    def __init__(self, name, tokens):
+        self.name = name
+        self.tokens = tokens
+        self.bin = None
+        self.attempts = 0
+        self.started_at = None
+        self.ready = False
+        # Written from the streaming thread by the pad probe
+        self.last_buffer = None
+        self.frames = 0
+        self.bytes = 0
+        self.restart_source = None
+        # Counters at the previous stats report, for the fps figure
+        self.reported_frames = 0
+        self.reported_at = None
+
+class ShardWorker:
+    def __init__(self):
+        self.pipeline = Gst.Pipeline.new('shard')
+        self.branches = {}
+        self.loop = GLib.MainLoop()
+
+        bus = self.pipeline.get_bus()
+        bus.add_signal_watch()
+        bus.connect('message::error', self._on_error)
+        bus.connect('message::warning', self._on_warning)
+        bus.connect('message::element', self._on_element)
+
+    def run(self):
+        self.pipeline.set_state(Gst.State.PLAYING)
+        reader = threading.Thread(target=self._read_commands, daemon=True)
+        reader.start()
+        GLib.timeout_add(STATS_INTERVAL_MS, self._report_stats)
+        GLib.unix_signal_add(GLib.PRIORITY_DEFAULT, signal.SIGTERM, self.quit)
+        GLib.unix_signal_add(GLib.PRIORITY_DEFAULT, signal.SIGINT, self.quit)
+        self.loop.run()
+
+    def quit(self):
+        logger.info("Shutting down shard")
+        self.pipeline.set_state(Gst.State.NULL)
+        self.loop.quit()
+        return GLib.SOURCE_REMOVE
+
+    def _read_commands(self):
+        """Read commands on a thread and hand them to the main loop"""
+        for line in sys.stdin:
+            GLib.idle_add(self._handle_command, line)
+        # StreamManager went away; don't leave orphaned pipelines behind
+        logger.info("stdin closed")
+        GLib.idle_add(self.quit)
+
+    def _handle_command(self, line):
+        try:
+            command = json.loads(line)
+        except ValueError:
+            logger.warning(f"Ignoring invalid command: {line.strip()}")
+            return GLib.SOURCE_REMOVE
+
+        if command.get('op') == 'add':
+            self.add_branch(command['name'], command['pipeline'])
+        elif command.get('op') == 'remove':
+            self.remove_branch(command['name'])
+        elif command.get('op') == 'restart':
+            # StreamManager's watchdog saw this branch stop producing frames
+            branch = self.branches.get(command['name'])
+            if branch is not None and branch.bin is not None:
+                self._fail_branch(branch, 'stalled: no frames')
+        else:
+            logger.warning(f"Unknown command: {command}")
+        return GLib.SOURCE_REMOVE
+
+    def add_branch(self, name, tokens):
+        if name in self.branches:
+            # Same camera with new settings: rebuild its branch
+            self.remove_branch(name)
+        branch = Branch(name, tokens)
+        self.branches[name] = branch
+        self._start_branch(branch)
+
+    def remove_branch(self, name):
+        branch = self.branches.pop(name, None)
+        if branch is None:
+            return
+        if branch.restart_source is not None:
+            GLib.source_remove(branch.restart_source)
+            branch.restart_source = None
+        self._teardown_branch(branch)
+        report(name, 'REMOVED')
+
+    def _start_branch(self, branch):
+        branch.restart_source = None
+        branch.ready = False
+        branch.last_buffer = None
+        branch.frames = 0
+        branch.bytes = 0
+        branch.reported_frames = 0
+        branch.reported_at = None
+        branch.started_at = time.monotonic()
+        report(branch.name, 'STARTING')
+        try:
+            branch.bin = Gst.parse_bin_from_description(tokens_to_description(branch.tokens), False)
+        except GLib.Error as e:
+            self._fail_branch(branch, f"Could not build pipeline: {e.message}")
+            return GLib.SOURCE_REMOVE
+
+        branch.bin.set_name(f"branch-{branch.name}")
+        parser = branch.bin.get_by_name('parse')
+        if parser is not None:
+            parser.get_static_pad('src').add_probe(Gst.PadProbeType.BUFFER, self._on_buffer, branch)
+
+        self.pipeline.add(branch.bin)
+        branch.bin.sync_state_with_parent()
+        return GLib.SOURCE_REMOVE
+
+    def _on_buffer(self, pad, info, branch):
+        branch.last_buffer = time.monotonic()
+        branch.frames += 1
+        branch.bytes += info.get_buffer().get_size()
+        if not branch.ready:
+            branch.ready = True
+            report(branch.name, 'READY')
+        return Gst.PadProbeReturn.OK
+
+    def _report_stats(self):
+        """Report cumulative frames/bytes for every running branch"""
+        now = time.monotonic()
+        for branch in list(self.branches.values()):
+            if branch.bin is None:
+                continue
+            frames = branch.frames
+            fps = 0.0
+            if branch.reported_at is not None and now > branch.reported_at:
+                fps = (frames - branch.reported_frames) / (now - branch.reported_at)
+            branch.reported_frames = frames
+            branch.reported_at = now
+            report(branch.name, 'STATS', frames=frames, bytes=branch.bytes, fps=round(fps, 2))
+        return GLib.SOURCE_CONTINUE
+
+    def _teardown_branch(self, branch):
+        if branch.bin is None:
+            return
+        branch.bin.set_state(Gst.State.NULL)
+        self.pipeline.remove(branch.bin)
+        branch.bin = None
+
+    def _fail_branch(self, branch, detail):
+        """Tear down a failed branch and schedule its restart with backoff"""
+        report(branch.name, 'FAILED', detail)
+        self._teardown_branch(branch)
+        if branch.started_at is not None and time.monotonic() - branch.started_at >= RESTART_STABLE_SECONDS:
+            branch.attempts = 0
+        delay = restart_delay(branch.attempts)
+        branch.attempts += 1
+        logger.info(f"Restarting branch {branch.name} in {delay:.1f}s (attempt {branch.attempts})")
+        branch.restart_source = GLib.timeout_add(int(delay * 1000), self._restart_branch, branch)
+
+    def _restart_branch(self, branch):
+        if self.branches.get(branch.name) is not branch:
+            return GLib.SOURCE_REMOVE
+        report(branch.name, 'RESTARTING')
+        return self._start_branch(branch)
+
+    def _branch_for(self, element):
+        """Find the branch an element belongs to by walking up to the pipeline"""
+        while element is not None:
+            parent = element.get_parent()
+            if parent == self.pipeline:
+                for branch in self.branches.values():
+                    if branch.bin == element:
+                        return branch
+                return None
+            element = parent
+        return None
+
+    def _on_error(self, bus, message):
+        error, debug = message.parse_error()
+        branch = self._branch_for(message.src)
+        if branch is None:
+            # Usually a late message from a branch that was already torn down
+            logger.warning(f"WARNING: error from element outside active branches: {error.message}")
+            return
+        if branch.bin is None or branch.restart_source is not None:
+            return
+        logger.error(f"ERROR in {branch.name}: {error.message}")
+        self._fail_branch(branch, error.message)
+
+    def _on_warning(self, bus, message):
+        warning, debug = message.parse_warning()
+        branch = self._branch_for(message.src)
+        name = branch.name if branch else 'shard'
+        logger.warning(f"WARNING in {name}: {warning.message}")
+
+    def _on_element(self, bus, message):
+        # splitmuxsink announces each recording segment it opens and closes
+        structure = message.get_structure()
+        if structure is None:
+            return
+        state = {
+            'splitmuxsink-fragment-opened': 'SEGMENT_OPENED',
+            'splitmuxsink-fragment-closed': 'SEGMENT_CLOSED',
+        }.get(structure.get_name())
+        branch = self._branch_for(message.src)
+        if state and branch is not None:
+            report(branch.name, state, structure.get_string('location'))
+
+def main():
+    Gst.init(None)
+    ShardWorker().run()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+# app/status_events.py
+"""Push per-camera stream status to dashboards as Server-Sent Events.
+
+A StatusFeed keeps the last state it published for every pipeline, plus its
+subscribers' queues. publish() takes the stream manager's full status and
+works out once what changed. Only that diff is queued for every subscriber,
+so an open dashboard costs a queue put per change and nothing per poll. A new
+subscriber first gets the whole state as a "snapshot" event. After that it
+gets "status" events holding only the changed fields of the changed
+pipelines, with null for pipelines that went away.
+
+The async web tier feeds it straight from the StreamManager (see
+app/async_web.py). The Flask fallback has one thread that follows the status
+file for all of its clients.
+"""
+import asyncio
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+from app.stream_manager import read_status_file, get_env_int, get_env_float, STATUS_FILE, WATCHDOG_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+# What a dashboard is told about each pipeline
+PUSHED_FIELDS = ('camera', 'stream', 'state', 'fps', 'bitrate', 'restarts', 'stalls', 'last_exit_code', 'live_port')
+# fps and bitrate move a little with every sample; smaller relative changes aren't pushed
+STATUS_EVENTS_MIN_CHANGE = get_env_float('STATUS_EVENTS_MIN_CHANGE', 0.05)
+# A client this many events behind is disconnected; it reconnects and gets a fresh snapshot
+STATUS_EVENTS_MAX_QUEUED = get_env_int('STATUS_EVENTS_MAX_QUEUED', 50)
+# Comment lines keep idle connections open through proxies and notice clients that left
+STATUS_EVENTS_KEEPALIVE = 15
+
+KEEPALIVE = b': keepalive\n\n'
+# Browsers wait this long (ms) before reconnecting
+RETRY = b'retry: 2000\n\n'
+
+def summarize(entry):
+    return {field: entry.get(field) for field in PUSHED_FIELDS}
+
+def is_changed(old, new):
+    numbers = (int, float)
+    if isinstance(old, numbers) and isinstance(new, numbers) and not isinstance(old, bool):
+        return abs(new - old) > STATUS_EVENTS_MIN_CHANGE * max(abs(old), abs(new))
+    return old != new
+
+def diff(previous, current):
+    """Changed fields of each pipeline in `current`; None for pipelines no longer there"""
+    changes = {}
+    for name, entry in current.items():
+        before = previous.get(name)
+        if before is None:
+            changes[name] = entry
+            continue
+        fields = {field: value for field, value in entry.items() if is_changed(before.get(field), value)}
+        if fields:
+            changes[name] = fields
+    for name in previous:
+        if name not in current:
+            changes[name] = None
+    return changes
+
+def format_event(event, data, event_id):
+    return f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n".encode()
+
+class StatusFeed:
+    """The latest pipeline states and everyone listening for changes to them"""
+    def __init__(self):
+        self.state = {}
+        self.event_id = 0
+        self.subscribers = set()
+        self.lock = threading.Lock()
+
+    def subscribe(self, subscriber):
+        """Add a queue (queue.Queue or asyncio.Queue) and put the current snapshot in it"""
+        with self.lock:
+            subscriber.put_nowait(format_event('snapshot', self.state, self.event_id))
+            self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+
+    def publish(self, cameras):
+        """Queue what changed in `cameras` (pipeline name -> status) for every subscriber"""
+        current = {name: summarize(entry) for name, entry in (cameras or {}).items()}
+        with self.lock:
+            changes = diff(self.state, current)
+            if not changes:
+                return
+            # Small changes aren't pushed, so they're measured from the last value that was
+            for name, fields in changes.items():
+                if fields is None:
+                    del self.state[name]
+                else:
+                    self.state.setdefault(name, {}).update(fields)
+            self.event_id += 1
+            event = format_event('status', changes, self.event_id)
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(event)
+            except (queue.Full, asyncio.QueueFull):
+                logger.warning("Status event client fell behind, disconnecting")
+                self.end(subscriber)
+
+    def end(self, subscriber):
+        """Tell a client's response to finish"""
+        self.unsubscribe(subscriber)
+        while not subscriber.empty():
+            subscriber.get_nowait()
+        subscriber.put_nowait(None)
+
+class FileStatusFeed(StatusFeed):
+    """A StatusFeed following the stream manager's status file, for the Flask fallback.
+
+    One thread reads the file when it changes, for all clients, and exits once
+    nobody has listened for a while.
+    """
+    def __init__(self, path=None, interval=None):
+        super().__init__()
+        self.path = path or STATUS_FILE
+        self.interval = WATCHDOG_INTERVAL if interval is None else interval
+        self.thread = None
+        self.idle_since = time.monotonic()
+
+    def subscribe(self, subscriber):
+        # Added before the thread starts, so it can't see no subscribers and exit straight away
+        with self.lock:
+            subscriber.put_nowait(format_event('snapshot', self.state, self.event_id))
+            self.subscribers.add(subscriber)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='status-events', daemon=True)
+                self.thread.start()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+            if not self.subscribers:
+                self.idle_since = time.monotonic()
+
+    def _stop_if_idle(self):
+        with self.lock:
+            if self.subscribers or time.monotonic() - self.idle_since < STATUS_EVENTS_KEEPALIVE:
+                return False
+            # Cleared under the lock, so a new subscriber starts a new thread
+            self.thread = None
+            return True
+
+    def _run(self):
+        mtime = None
+        while not self._stop_if_idle():
+            try:
+                modified = os.stat(self.path).st_mtime_ns
+            except OSError:
+                modified = None
+            if modified != mtime:
+                mtime = modified
+                self.publish((read_status_file(self.path) or {}).get('cameras'))
+            time.sleep(self.interval)
+
+_file_feed = None
+_file_feed_lock = threading.Lock()
+
+def get_file_feed():
+    global _file_feed
+    with _file_feed_lock:
+        if _file_feed is None:
+            _file_feed = FileStatusFeed()
+        return _file_feed
@@ -1,43 +1,434 @@
 # app/stream_manager.py
 import asyncio
+import json
 import logging
-from subprocess import Popen, PIPE
+import os
+import random
+import re
+import sys
+import time
+import xml.etree.ElementTree as ET
+
+import aiohttp
+
+from app import recordings_index
+# Re-exported: app.main and app.async_web read their settings with these too
+from app.env import get_env_int, get_env_float
+from app.file_mover import RECORDINGS_FOLDER, STAGING_FOLDER, segment_filename
+from app.metrics import parse_rtmp_stat
 
 # Note: We don't call basicConfig here as it's already set in main.py
 logger = logging.getLogger(__name__)
 
+# Kernel clock ticks and page size, used to turn /proc/<pid>/stat into CPU seconds and bytes
+CLK_TCK = os.sysconf('SC_CLK_TCK')
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+# gst-launch output lines we want to surface in the log
+IMPORTANT_MARKERS = ("ERROR", "WARNING", "Could not")
+
+# Every pipeline tees its parsed H.264 into an fpsdisplaysink named "meter". With -v,
+# gst-launch prints its last-message about once a second, which gives us frame counts
+# without a line per frame. The first report with frames counts as "recording".
+METER_MESSAGE = re.compile(r'meter: last-message = rendered: (\d+), dropped: \d+, current: ([\d.]+)')
+
+# How many pipelines may be starting up at the same time
+START_CONCURRENCY = get_env_int('STREAM_START_CONCURRENCY', 8)
+# How long a starting pipeline may hold a concurrency slot before the next one goes
+START_TIMEOUT = get_env_float('STREAM_START_TIMEOUT', 20)
+# Restart backoff: base * 2^attempt seconds, capped, with jitter
+RESTART_BACKOFF_BASE = get_env_float('RESTART_BACKOFF_BASE', 1)
+RESTART_BACKOFF_MAX = get_env_float('RESTART_BACKOFF_MAX', 60)
+# A pipeline that ran at least this long resets the backoff
+RESTART_STABLE_SECONDS = get_env_float('RESTART_STABLE_SECONDS', 60)
+# Cameras per GStreamer process; 0 or 1 keeps one gst-launch process per camera
+SHARD_SIZE = get_env_int('SHARD_SIZE', 0)
+
+# "rtmp" pushes to nginx-rtmp, which records and serves HLS. "direct" writes
+# segments to disk from the pipeline itself, so recording doesn't depend on nginx.
+RECORDING_MODE = os.environ.get('RECORDING_MODE', 'rtmp').lower()
+# Segment length for direct recording; segments only ever break on keyframes
+SEGMENT_INTERVAL = get_env_int('SEGMENT_INTERVAL', 600)
+# In direct mode, also write live HLS straight to the HLS folder
+LIVE_HLS = os.environ.get('LIVE_HLS', '1').lower() not in ('0', 'false', 'no', 'off')
+HLS_FOLDER = '/var/www/hls'
+# Live HLS for sub streams, which is what the camera grid plays
+SUB_HLS_FOLDER = os.path.join(HLS_FOLDER, 'sub')
+# Pipelines for a camera's sub stream are named <camera><SUB_STREAM_SUFFIX>
+SUB_STREAM_SUFFIX = '@sub'
+# Low-latency live view: each main stream also muxes fragmented MP4 onto a local
+# TCP port, which the web app relays to the browser (see app/live_relay.py)
+LIVE_FMP4 = os.environ.get('LIVE_FMP4', '0').lower() in ('1', 'true', 'yes', 'on')
+LIVE_FMP4_PORT_BASE = get_env_int('LIVE_FMP4_PORT_BASE', 9100)
+# Duration of each MP4 fragment; the browser can't play a frame before its fragment is complete
+LIVE_FMP4_FRAGMENT_MS = get_env_int('LIVE_FMP4_FRAGMENT_MS', 200)
+# Latest-frame snapshots: a downscaled JPEG of a recent keyframe per camera, kept
+# in shared memory and rewritten at most every SNAPSHOT_INTERVAL seconds (0 disables)
+SNAPSHOT_FOLDER = os.environ.get('SNAPSHOT_FOLDER', '/dev/shm/nvr-snapshots')
+SNAPSHOT_INTERVAL = get_env_int('SNAPSHOT_INTERVAL', 5)
+SNAPSHOT_WIDTH = get_env_int('SNAPSHOT_WIDTH', 640)
+
+# Frozen-stream watchdog: how often to check, and how long a running pipeline may go
+# without a new frame before it is restarted
+WATCHDOG_INTERVAL = get_env_float('WATCHDOG_INTERVAL', 2)
+STALL_TIMEOUT = get_env_float('STALL_TIMEOUT', 10)
+# nginx-rtmp statistics, used for per-camera byte counts in rtmp mode
+RTMP_STAT_URL = os.environ.get('RTMP_STAT_URL', 'http://127.0.0.1/stat')
+# Snapshot of per-camera state, rewritten every watchdog tick for the web process
+STATUS_FILE = os.environ.get('STATUS_FILE', '/tmp/nvr_status.json')
+
+# splitmuxsink reports opened/closed fragments as element messages (printed with gst-launch -m)
+SEGMENT_MESSAGE = re.compile(r'splitmuxsink-fragment-(opened|closed), location=\(string\)"?([^",;]+)"?')
+
+def install_child_watcher():
+    """Use a pidfd child watcher when available.
+
+    Before Python 3.12 the default watcher starts one waitpid() thread per child,
+    which adds up with 100+ gst-launch processes. The pidfd watcher lets the
+    event loop itself wait for all of them.
+    """
+    if sys.version_info >= (3, 12) or not hasattr(asyncio, 'PidfdChildWatcher'):
+        return
+    try:
+        # Probe that the kernel actually supports pidfd_open (Linux 5.3+)
+        os.close(os.pidfd_open(os.getpid()))
+        watcher = asyncio.PidfdChildWatcher()
+        watcher.attach_loop(asyncio.get_running_loop())
+        asyncio.set_child_watcher(watcher)
+        logger.info("Using pidfd child watcher for stream processes")
+    except (AttributeError, OSError) as e:
+        logger.info(f"pidfd child watcher not available, using default: {e}")
+
+def read_proc_stat(pid):
+    """Return (cpu_seconds, rss_bytes) for a pid from /proc, or None if it is gone"""
+    try:
+        with open(f'/proc/{pid}/stat', 'r') as f:
+            data = f.read()
+    except (FileNotFoundError, ProcessLookupError, PermissionError):
+        return None
+    # The command name is in parentheses and may contain spaces, so split after it
+    fields = data[data.rfind(')') + 2:].split()
+    # utime and stime are fields 14 and 15, rss is field 24 (1-based, see proc(5))
+    utime = int(fields[11])
+    stime = int(fields[12])
+    rss_pages = int(fields[21])
+    return (utime + stime) / CLK_TCK, rss_pages * PAGE_SIZE
+
+_status_cache = {'mtime': None, 'data': None}
+
+def read_status_file(path=None):
+    """Read the supervisor's status snapshot, re-parsing only when the file changed"""
+    path = path or STATUS_FILE
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    if _status_cache['mtime'] != mtime:
+        try:
+            with open(path, 'r') as f:
+                _status_cache['data'] = json.load(f)
+            _status_cache['mtime'] = mtime
+        except (OSError, ValueError):
+            # Mid-replace or unreadable; keep serving the previous snapshot
+            pass
+    return _status_cache['data']
+
+def estimate_segment_start(location):
+    """Estimate when a staged segment started from its <pipeline start>-<index>.flv name"""
+    filename = os.path.basename(location)
+    try:
+        pipeline_start, index = filename.rsplit('.', 1)[0].split('-', 1)
+        return int(pipeline_start) + int(index) * SEGMENT_INTERVAL
+    except ValueError:
+        # Not one of ours; fall back to the modification time minus one segment
+        return os.path.getmtime(location) - SEGMENT_INTERVAL
+
+def sub_stream_name(camera_name):
+    return f"{camera_name}{SUB_STREAM_SUFFIX}"
+
+def split_stream_name(name):
+    """Return (camera name, "main" or "sub") for a pipeline name"""
+    if name.endswith(SUB_STREAM_SUFFIX):
+        return name[:-len(SUB_STREAM_SUFFIX)], 'sub'
+    return name, 'main'
+
+class SubStream:
+    """A camera's secondary, low-resolution stream, supervised as its own pipeline.
+
+    It only feeds the live HLS the camera grid plays. Recording and the
+    single-camera view stay on the main stream.
+    """
+    role = 'sub'
+
+    def __init__(self, camera):
+        self.id = camera.id
+        self.camera_name = camera.name
+        self.name = sub_stream_name(camera.name)
+        self.stream_url = camera.sub_stream_url
+        self.username = camera.username
+        self.password = camera.password
+
+def camera_pipelines(camera):
+    """The pipelines to run for a camera: its main stream, plus its sub stream if it has one"""
+    pipelines = [camera]
+    # Direct mode without live HLS has nothing for a sub stream to feed
+    if getattr(camera, 'sub_stream_url', None) and (RECORDING_MODE != 'direct' or LIVE_HLS):
+        pipelines.append(SubStream(camera))
+    return pipelines
+
+def snapshot_path(camera_name):
+    return os.path.join(SNAPSHOT_FOLDER, f"{camera_name}.jpg")
+
+def pipeline_signature(pipeline):
+    """The settings a pipeline is built from; a change means it has to be restarted"""
+    return (pipeline.stream_url, pipeline.username, pipeline.password)
+
+def restart_delay(attempt):
+    """Exponential backoff with jitter for the given restart attempt (0-based)"""
+    delay = min(RESTART_BACKOFF_MAX, RESTART_BACKOFF_BASE * (2 ** attempt))
+    # Jitter spreads restarts out so cameras behind the same failed switch don't reconnect in lockstep
+    return delay * random.uniform(0.5, 1.0)
+
 class StreamManager:
-    def __init__(self):
+    """Supervises the GStreamer ingest for every camera.
+
+    By default each camera runs in its own gst-launch-1.0 process. With
+    SHARD_SIZE > 1, cameras are grouped into shards and each shard runs as one
+    app.shard_worker process holding one pipeline branch per camera.
+
+    `processes` is keyed by process key: the camera name in per-camera mode,
+    or "shard:<n>" in sharded mode. A camera with a sub stream has a second
+    pipeline named "<camera>@sub", which is supervised like any other camera.
+    """
+    def __init__(self, shard_size=None, session_factory=None):
+        self.shard_size = SHARD_SIZE if shard_size is None else shard_size
+        # Database sessions for the recordings index; without one, segments aren't indexed
+        self.session_factory = session_factory
         self.processes = {}
+        self.monitors = {}
+        self.process_started_at = {}
+        self._cpu_samples = {}
+        # Cameras under supervision; they are restarted when their pipeline exits
+        self.cameras = {}
+        # Shard process key -> camera names, and camera name -> shard process key
+        self.shards = {}
+        self.camera_shard = {}
+        # Per-camera pipeline state
+        self.started_at = {}
+        self.ready = {}
+        self.restart_counts = {}
+        self.exited_at = {}
+        self.last_exit_code = {}
+        # Per-process restart state
+        self.restart_attempts = {}
+        self.restart_tasks = {}
+        # Direct recording: staged segment path -> wall-clock time it was opened
+        self.segment_opened = {}
+        # Data flow per camera (frames, bytes, last frame time) and stall history
+        self.flow = {}
+        self.stalls = {}
+        self.watchdog_task = None
+        # Pipeline name -> local port of its low-latency fMP4 feed
+        self.live_ports = {}
+        # Called (on the event loop) whenever a pipeline's state or flow may have changed
+        self.status_listeners = []
+
+    def _status_changed(self):
+        """Tell status listeners (e.g. the dashboard's event stream) to take a fresh look"""
+        for listener in self.status_listeners:
+            try:
+                listener()
+            except Exception as e:
+                logger.error(f"Error in status listener: {e}", exc_info=True)
+
+    def create_pipeline_description(self, camera):
+        """Return the pipeline for one camera as gst-launch style tokens"""
+        # Construct the RTSP URL
+        if camera.username and camera.password:
+            rtsp_url = f"rtsp://{camera.username}:{camera.password}@{camera.stream_url}"
+        else:
+            rtsp_url = f"rtsp://{camera.stream_url}"
+
+        # Log the constructed RTSP URL
+        logger.info(f"RTSP URL for {camera.name}: {rtsp_url}")
+
+        tokens = [
+            'rtspsrc', f'location={rtsp_url}', 'do-rtsp-keep-alive=true', 'protocols=tcp',
+            'retry=10', 'latency=100', 'timeout=50000000',
+            '!', 'rtph264depay',
+            '!', 'h264parse', 'name=parse',
+            '!', 'tee', 'name=t',
+        ]
+        tokens += self.create_meter_branch()
+        # Snapshots come from the cheapest stream: the sub stream if there is one
+        if SNAPSHOT_INTERVAL > 0 and camera_pipelines(camera)[-1] is camera:
+            tokens += self.create_snapshot_branch(getattr(camera, 'camera_name', camera.name))
+        if getattr(camera, 'role', 'main') == 'sub':
+            return tokens + self.create_sub_stream_branches(camera)
+        if LIVE_FMP4:
+            tokens += self.create_live_branch(camera)
+        if RECORDING_MODE == 'direct':
+            return tokens + self.create_direct_recording_branches(camera)
+        return tokens + [
+            't.', '!', 'queue',
+            '!', 'flvmux',
+            '!', 'rtmpsink', 'sync=false', f'location=rtmp://127.0.0.1/live/{camera.name}',
+        ]
+
+    def create_meter_branch(self):
+        """A tee branch that only counts frames, reported once a second (see METER_MESSAGE)"""
+        return [
+            't.', '!', 'queue', 'leaky=downstream', 'max-size-buffers=100',
+            '!', 'fpsdisplaysink', 'name=meter', 'text-overlay=false', 'video-sink=fakesink',
+            'sync=false', 'fps-update-interval=1000',
+        ]
+
+    def create_snapshot_branch(self, camera_name):
+        """A tee branch decoding only keyframes into a small JPEG, see snapshot_path.
+
+        Dropping delta frames before the decoder keeps this to a fraction of a
+        full decode. multifilesink rewrites the file in place, so readers check
+        for a complete JPEG before using it.
+        """
+        os.makedirs(SNAPSHOT_FOLDER, exist_ok=True)
+        return [
+            't.', '!', 'queue', 'leaky=downstream', 'max-size-buffers=2',
+            '!', 'identity', 'drop-buffer-flags=delta-unit',
+            '!', 'avdec_h264', 'max-threads=1',
+            '!', 'videorate', 'drop-only=true',
+            '!', f'video/x-raw,framerate=1/{SNAPSHOT_INTERVAL}',
+            '!', 'videoscale',
+            '!', f'video/x-raw,width={SNAPSHOT_WIDTH},pixel-aspect-ratio=1/1',
+            '!', 'jpegenc', 'quality=75',
+            '!', 'multifilesink', f'location={snapshot_path(camera_name)}', 'sync=false',
+        ]
+
+    def get_live_port(self, name):
+        """The fMP4 feed port for a pipeline; it keeps its port across restarts"""
+        port = self.live_ports.get(name)
+        if port is None:
+            used = set(self.live_ports.values())
+            port = LIVE_FMP4_PORT_BASE
+            while port in used:
+                port += 1
+            self.live_ports[name] = port
+        return port
+
+    def create_live_branch(self, camera):
+        """A tee branch serving the camera as fragmented MP4 on a local TCP port.
+
+        tcpserversink sends mp4mux's header (ftyp + moov) to every new client
+        before the live fragments, so the web app can connect at any time.
+        """
+        return [
+            't.', '!', 'queue', 'leaky=downstream', 'max-size-time=1000000000',
+            '!', 'h264parse',
+            '!', 'mp4mux', f'fragment-duration={LIVE_FMP4_FRAGMENT_MS}', 'streamable=true',
+            '!', 'tcpserversink', 'host=127.0.0.1', f'port={self.get_live_port(camera.name)}',
+            'sync=false', 'sync-method=latest-keyframe',
+        ]
+
+    def create_direct_recording_branches(self, camera):
+        """Tee branches feeding the parsed H.264 into a segmented FLV recorder and, optionally, live HLS.
+
+        splitmuxsink starts a new file on the first keyframe after SEGMENT_INTERVAL.
+        Open segments live in the staging folder and are renamed to
+        CameraName-<start timestamp>.flv when they close (see finalize_segment).
+        """
+        staging = os.path.join(STAGING_FOLDER, camera.name)
+        os.makedirs(staging, exist_ok=True)
+        # Prefix with the pipeline start time so a restarted pipeline never reuses a name
+        location = os.path.join(staging, f"{int(time.time())}-%05d.flv")
+
+        tokens = [
+            't.', '!', 'queue',
+            '!', 'splitmuxsink', 'muxer-factory=flvmux',
+            f'max-size-time={SEGMENT_INTERVAL * 1000000000}', f'location={location}',
+        ]
+        if LIVE_HLS:
+            tokens += self.create_hls_branch(HLS_FOLDER, camera.name)
+        return tokens
+
+    def create_hls_branch(self, folder, name):
+        """A tee branch writing live HLS as <folder>/<name>.m3u8"""
+        os.makedirs(folder, exist_ok=True)
+        # A leaky queue means a slow HLS writer drops live frames instead of stalling the recorder.
+        # The second h264parse converts to byte-stream for mpegtsmux, while the tee stays avc for flvmux.
+        return [
+            't.', '!', 'queue', 'leaky=downstream', 'max-size-time=2000000000',
+            '!', 'h264parse',
+            '!', 'hlssink2', 'target-duration=2', 'playlist-length=2', 'max-files=6',
+            f'location={os.path.join(folder, name)}-%05d.ts',
+            f'playlist-location={os.path.join(folder, name)}.m3u8',
+        ]
+
+    def create_sub_stream_branches(self, sub_stream):
+        """Sub streams are never recorded; they only become live HLS under SUB_HLS_FOLDER"""
+        if RECORDING_MODE == 'direct':
+            return self.create_hls_branch(SUB_HLS_FOLDER, sub_stream.camera_name)
+        # nginx-rtmp's "sub" application writes HLS without recording
+        return [
+            't.', '!', 'queue',
+            '!', 'flvmux',
+            '!', 'rtmpsink', 'sync=false', f'location=rtmp://127.0.0.1/sub/{sub_stream.camera_name}',
+        ]
 
     def create_gst_command(self, camera):
         try:
             # Log that command creation is starting
             logger.info(f"Creating GStreamer command for camera: {camera.name}")
-            
-            # Construct the RTSP URL
-            if camera.username and camera.password:
-                rtsp_url = f"rtsp://{camera.username}:{camera.password}@{camera.stream_url}"
-            else:
-                rtsp_url = f"rtsp://{camera.stream_url}"
-            
-            # Log the constructed RTSP URL
-            logger.info(f"RTSP URL for {camera.name}: {rtsp_url}")
-            
-            # Construct the full GStreamer command
-            command = f'gst-launch-1.0 -v rtspsrc location="{rtsp_url}" do-rtsp-keep-alive=true protocols=tcp retry=10 latency=100 timeout=50000000 ! rtph264depay ! h264parse ! flvmux ! rtmpsink sync=false location="rtmp://127.0.0.1/live/{camera.name}"'
-            
+
+            # Construct the full GStreamer command as an argument list, so no shell is involved.
+            # gst-launch escapes each argument itself, so the location may contain any characters.
+            # -m prints bus messages, which is how splitmuxsink reports closed segments
+            flags = ['-v', '-m'] if RECORDING_MODE == 'direct' else ['-v']
+            command = ['gst-launch-1.0'] + flags + self.create_pipeline_description(camera)
+
             # Log the generated command
-            logger.info(f"Generated GStreamer command for {camera.name}: {command}")
+            logger.info(f"Generated GStreamer command for {camera.name}: {' '.join(command)}")
             return command
         except Exception as e:
             # Log any exceptions that occur during command creation
             logger.error(f"Error creating GStreamer command for camera {camera.name}: {str(e)}", exc_info=True)
             raise
 
+    def create_shard_command(self):
+        """Command for a shard worker process; cameras are sent to it on stdin"""
+        return [sys.executable, '-m', 'app.shard_worker']
+
+    async def _spawn(self, key, command, stdin=asyncio.subprocess.DEVNULL):
+        """Start a process, register it under `key` and start monitoring it"""
+        process = await asyncio.create_subprocess_exec(
+            *command,
+            stdin=stdin,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        self.processes[key] = process
+        self.process_started_at[key] = time.monotonic()
+        logger.info(f"Process {process.pid} started for {key}")
+        self.monitors[key] = asyncio.create_task(self._monitor_process(key, process))
+        return process
+
+    def _begin_pipeline(self, camera_name):
+        """Reset a camera's readiness tracking as its pipeline (re)starts"""
+        self.started_at[camera_name] = time.monotonic()
+        if camera_name not in self.ready or self.ready[camera_name].is_set():
+            self.ready[camera_name] = asyncio.Event()
+        flow = self.flow.setdefault(camera_name, {
+            'frames': 0, 'bytes': 0, 'fps': 0.0, 'bitrate': 0,
+            'last_frame': None, 'pipeline_frames': 0, 'bytes_sample': None,
+            'stall_restart_at': None
+        })
+        # Counters reported by the pipeline restart from zero with it
+        flow['pipeline_frames'] = 0
+        flow['last_frame'] = None
+        flow['fps'] = 0.0
+        self._status_changed()
+
     async def start_stream(self, camera):
         logger.info(f"Start stream called for camera: {camera.name}")
-        
+
         if camera.name in self.processes:
             logger.warning(f"Stream {camera.name} is already running")
             return
@@ -45,80 +436,735 @@ class StreamManager:
         try:
             logger.info(f"Generating command for camera: {camera.name}")
             command = self.create_gst_command(camera)
-            logger.info(f"Command generated for {camera.name}: {command}")
-            
-            process = Popen(
-                command,
-                stdout=PIPE,
-                stderr=PIPE,
-                shell=True,
-                text=True,
-                bufsize=1
-            )
-            self.processes[camera.name] = process
-            
-            logger.info(f"Process started for camera: {camera.name}")
-            asyncio.create_task(self._monitor_process(camera.name, process))
+
+            self.cameras[camera.name] = camera
+            self._begin_pipeline(camera.name)
+            self.recover_staged_segments(camera.name)
+            await self._spawn(camera.name, command)
         except Exception as e:
             logger.error(f"Failed to start stream for camera {camera.name}: {e}", exc_info=True)
             if camera.name in self.processes:
                 del self.processes[camera.name]
+            # Treat a failed spawn like an immediate exit so it is retried with backoff
+            self.exited_at.setdefault(camera.name, time.monotonic())
+            self._schedule_restart(camera.name)
 
+    async def start_shard(self, key, cameras):
+        """Start one shard worker process running a branch for each camera"""
+        logger.info(f"Starting {key} with cameras: {[camera.name for camera in cameras]}")
 
+        if key in self.processes:
+            logger.warning(f"Shard {key} is already running")
+            return
 
-    async def _monitor_process(self, camera_name, process):
-        """Simplified process monitoring for a camera."""
-        logger.info(f"Monitoring process for camera: {camera_name}")
+        self.shards[key] = [camera.name for camera in cameras]
+        for camera in cameras:
+            self.cameras[camera.name] = camera
+            self.camera_shard[camera.name] = key
 
         try:
-            while True:
-                line = process.stdout.readline()
-                if line:
-                    # Only log important messages, filter out stats and routine pipeline info
-                    if "ERROR" in line or "WARNING" in line or "Could not" in line:
-                        logger.warning(f"{camera_name}: {line.strip()}")
-                    # Uncomment the line below if you want to see all GStreamer output for debugging
-                    # logger.debug(f"{camera_name} OUT: {line.strip()}")
-
-                # Exit the loop if the process has ended
-                if process.poll() is not None:
-                    break
-
-                await asyncio.sleep(0.1)
+            await self._spawn(key, self.create_shard_command(), stdin=asyncio.subprocess.PIPE)
+            for camera in cameras:
+                self.add_to_shard(key, camera)
         except Exception as e:
-            logger.error(f"Error monitoring camera {camera_name}: {e}", exc_info=True)
+            logger.error(f"Failed to start shard {key}: {e}", exc_info=True)
+            if key in self.processes:
+                del self.processes[key]
+            for camera in cameras:
+                self.exited_at.setdefault(camera.name, time.monotonic())
+            self._schedule_restart(key)
+
+    def add_to_shard(self, key, camera):
+        """Ask a running shard worker to start a branch for a camera"""
+        if camera.name not in self.shards[key]:
+            self.shards[key].append(camera.name)
+        self.cameras[camera.name] = camera
+        self.camera_shard[camera.name] = key
+        self._begin_pipeline(camera.name)
+        self.recover_staged_segments(camera.name)
+        self._send_shard_command(key, {
+            'op': 'add',
+            'name': camera.name,
+            'pipeline': self.create_pipeline_description(camera)
+        })
+
+    def _send_shard_command(self, key, command):
+        process = self.processes.get(key)
+        if process is None or process.stdin is None or process.returncode is not None:
+            return False
+        process.stdin.write((json.dumps(command) + "\n").encode('utf-8'))
+        return True
+
+    async def start_all_streams(self, cameras, concurrency=None):
+        """Start many cameras in parallel, with at most `concurrency` starting at once.
+
+        Each start holds its slot until the pipeline is recording or START_TIMEOUT
+        passes, so a slow camera never blocks the rest for long. In sharded mode a
+        slot covers a whole shard.
+        """
+        concurrency = concurrency or START_CONCURRENCY
+        semaphore = asyncio.Semaphore(concurrency)
+        startup_began = time.monotonic()
+        # Main and sub streams are separate pipelines from here on
+        cameras = [pipeline for camera in cameras for pipeline in camera_pipelines(camera)]
+        logger.info(f"Starting {len(cameras)} pipelines with concurrency {concurrency}")
+
+        async def start_one(camera):
+            async with semaphore:
+                try:
+                    await self.start_stream(camera)
+                    return [await self.wait_until_ready(camera.name, START_TIMEOUT)]
+                except Exception as e:
+                    logger.error(f"Error starting camera {camera.name}: {e}", exc_info=True)
+                    return [False]
+
+        async def start_one_shard(key, shard_cameras):
+            async with semaphore:
+                try:
+                    await self.start_shard(key, shard_cameras)
+                    return await asyncio.gather(*(
+                        self.wait_until_ready(camera.name, START_TIMEOUT) for camera in shard_cameras
+                    ))
+                except Exception as e:
+                    logger.error(f"Error starting {key}: {e}", exc_info=True)
+                    return [False] * len(shard_cameras)
+
+        if self.shard_size > 1:
+            logger.info(f"Sharded mode: {self.shard_size} cameras per process")
+            chunks = [cameras[i:i + self.shard_size] for i in range(0, len(cameras), self.shard_size)]
+            batches = await asyncio.gather(*(
+                start_one_shard(f"shard:{index}", chunk) for index, chunk in enumerate(chunks)
+            ))
+        else:
+            batches = await asyncio.gather(*(start_one(camera) for camera in cameras))
+
+        results = [ok for batch in batches for ok in batch]
+        elapsed = time.monotonic() - startup_began
+        recording = sum(1 for ok in results if ok)
+        logger.info(f"METRIC startup_time_to_all_recording={elapsed:.2f}s recording={recording}/{len(cameras)}")
+        return results
+
+    async def start_pipeline(self, pipeline):
+        """Start one more pipeline next to the running ones (in a shard with room, if sharded)"""
+        if self.shard_size <= 1:
+            await self.start_stream(pipeline)
+            return
+        for key, members in self.shards.items():
+            if len(members) < self.shard_size:
+                # A shard that is down picks the new member up when it restarts
+                self.add_to_shard(key, pipeline)
+                return
+        index = 0
+        while f"shard:{index}" in self.shards:
+            index += 1
+        await self.start_shard(f"shard:{index}", [pipeline])
+
+    async def apply_cameras(self, cameras):
+        """Bring the running pipelines in line with the camera table.
+
+        Only pipelines that were added, removed or whose settings changed are
+        touched; everything else keeps recording. Editing just a camera's sub
+        stream only restarts its sub stream pipeline.
+        """
+        wanted = {pipeline.name: pipeline for camera in cameras for pipeline in camera_pipelines(camera)}
+        removed = [name for name in self.cameras if name not in wanted]
+        changed = [
+            name for name, pipeline in wanted.items()
+            if name in self.cameras and pipeline_signature(self.cameras[name]) != pipeline_signature(pipeline)
+        ]
+        added = [name for name in wanted if name not in self.cameras]
+        if not (removed or changed or added):
+            return
+
+        logger.info(f"Camera changes: added={added} removed={removed} changed={changed}")
+        for name in removed + changed:
+            await self.stop_pipeline(name)
+        for name in changed + added:
+            await self.start_pipeline(wanted[name])
+        # Unchanged pipelines keep running, but pick up other edits (e.g. the camera id)
+        for name, pipeline in wanted.items():
+            if name in self.cameras:
+                self.cameras[name] = pipeline
+
+    async def wait_until_ready(self, camera_name, timeout):
+        """Wait until a camera's pipeline is recording; returns False on timeout or exit"""
+        event = self.ready.get(camera_name)
+        process = self.processes.get(self.camera_shard.get(camera_name, camera_name))
+        if event is None or process is None:
+            return False
+        ready_task = asyncio.create_task(event.wait())
+        exit_task = asyncio.create_task(process.wait())
+        try:
+            await asyncio.wait({ready_task, exit_task}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
         finally:
-            return_code = process.poll()
-            logger.info(f"Process for {camera_name} exited with code {return_code}")
-            if camera_name in self.processes:
-                del self.processes[camera_name]
-        def check_streams(self):
-            """Check the status of all streams"""
-            status = {}
-            for name, process in self.processes.items():
-                if process.poll() is None:
-                    status[name] = "running"
-                else:
-                    status[name] = f"stopped (exit code: {process.returncode})"
-            return status
+            ready_task.cancel()
+            exit_task.cancel()
+        return event.is_set()
 
-    async def stop_stream(self, camera_name):
-        if camera_name in self.processes:
-            process = self.processes[camera_name]
-            logger.info(f"Stopping stream: {camera_name}")
+    def _mark_ready(self, camera_name):
+        """Record that a camera's pipeline is recording and log how long it took"""
+        event = self.ready.get(camera_name)
+        if event is None or event.is_set():
+            return
+        event.set()
+        self._status_changed()
+        now = time.monotonic()
+        logger.info(f"METRIC time_to_recording camera={camera_name} seconds={now - self.started_at[camera_name]:.2f}")
+        exited_at = self.exited_at.pop(camera_name, None)
+        if exited_at is not None:
+            logger.info(f"METRIC time_to_restart camera={camera_name} seconds={now - exited_at:.2f} "
+                        f"restarts={self.restart_counts.get(camera_name, 0)}")
+
+    def _is_supervised(self, key):
+        return key in self.shards or key in self.cameras
+
+    def _schedule_restart(self, key):
+        """Restart a supervised process after its exponential backoff delay"""
+        if not self._is_supervised(key) or key in self.restart_tasks:
+            return
+        attempt = self.restart_attempts.get(key, 0)
+        delay = restart_delay(attempt)
+        self.restart_attempts[key] = attempt + 1
+        logger.info(f"Restarting {key} in {delay:.1f}s (attempt {attempt + 1})")
+        self.restart_tasks[key] = asyncio.create_task(self._restart_later(key, delay))
+
+    async def _restart_later(self, key, delay):
+        try:
+            await asyncio.sleep(delay)
+        finally:
+            self.restart_tasks.pop(key, None)
+        if key in self.processes or not self._is_supervised(key):
+            return
+        if key in self.shards:
+            members = [self.cameras[name] for name in self.shards[key] if name in self.cameras]
+            for name in self.shards[key]:
+                self.restart_counts[name] = self.restart_counts.get(name, 0) + 1
+            await self.start_shard(key, members)
+        else:
+            self.restart_counts[key] = self.restart_counts.get(key, 0) + 1
+            await self.start_stream(self.cameras[key])
+
+    def _handle_branch_event(self, key, event):
+        """Apply a state report from a shard worker to the camera it concerns"""
+        name = event.get('branch')
+        state = event.get('state')
+        if state == 'REMOVED':
+            # The branch was torn down without closing its open segment
+            self.recover_staged_segments(name, include_open=True)
+            return
+        if name not in self.cameras:
+            return
+        if state == 'STARTING':
+            self._begin_pipeline(name)
+        elif state == 'READY':
+            self._mark_ready(name)
+        elif state == 'FAILED':
+            # Only this branch is down; the worker restarts it with its own backoff
+            logger.warning(f"{name} branch failed in {key}: {event.get('detail', '')}")
+            self.exited_at.setdefault(name, time.monotonic())
+            self._status_changed()
+        elif state == 'RESTARTING':
+            self.restart_counts[name] = self.restart_counts.get(name, 0) + 1
+            # The failed branch can't close its open segment any more
+            self.recover_staged_segments(name, include_open=True)
+        elif state == 'STATS':
+            self._record_frames(name, event.get('frames', 0), event.get('fps', 0.0))
+            self._record_bytes(name, event.get('bytes'))
+        elif state == 'SEGMENT_OPENED':
+            self._on_segment_event(name, 'opened', event.get('detail'))
+        elif state == 'SEGMENT_CLOSED':
+            self._on_segment_event(name, 'closed', event.get('detail'))
+
+    def _record_frames(self, camera_name, pipeline_frames, fps):
+        """Apply a frame count reported by a camera's pipeline (cumulative since it started)"""
+        flow = self.flow.get(camera_name)
+        if flow is None:
+            return
+        new_frames = pipeline_frames - flow['pipeline_frames']
+        if new_frames < 0:
+            # The pipeline restarted without us seeing it start
+            new_frames = pipeline_frames
+        flow['pipeline_frames'] = pipeline_frames
+        flow['fps'] = fps
+        if new_frames <= 0:
+            return
+        now = time.monotonic()
+        flow['frames'] += new_frames
+        flow['last_frame'] = now
+        flow['stall_restart_at'] = None
+        self._mark_ready(camera_name)
+
+        stall = self.stalls.get(camera_name)
+        if stall and stall.get('since') is not None:
+            duration = now - stall['since']
+            stall['since'] = None
+            stall['last_seconds'] = round(duration, 1)
+            stall['total_seconds'] = round(stall['total_seconds'] + duration, 1)
+            logger.info(f"METRIC stall_duration camera={camera_name} seconds={duration:.1f}")
+
+    def _record_bytes(self, camera_name, total_bytes):
+        """Apply a cumulative byte counter sample and update the camera's bitrate"""
+        flow = self.flow.get(camera_name)
+        if flow is None or total_bytes is None:
+            return
+        now = time.monotonic()
+        previous = flow['bytes_sample']
+        flow['bytes_sample'] = (now, total_bytes)
+        if previous is None:
+            return
+        delta = total_bytes - previous[1]
+        if delta < 0:
+            # Counter reset (new segment, pipeline or nginx stream)
+            delta = total_bytes
+        flow['bytes'] += delta
+        elapsed = now - previous[0]
+        if elapsed > 0:
+            flow['bitrate'] = int(delta * 8 / elapsed)
+
+    def _on_segment_event(self, camera_name, kind, location):
+        """Track when staged segments open, and publish them when they close"""
+        if not location:
+            return
+        if kind == 'opened':
+            self.segment_opened[location] = time.time()
+        else:
+            start_ts = self.segment_opened.pop(location, None)
+            self.finalize_segment(camera_name, location, start_ts)
+
+    def finalize_segment(self, camera_name, location, start_ts=None):
+        """Move a closed segment from staging into the recordings folder.
+
+        The new name is CameraName-<start timestamp>.flv, the same naming nginx-rtmp
+        recordings use, so organize_video_files and the web UI handle both alike.
+        """
+        if start_ts is None:
+            start_ts = estimate_segment_start(location)
+        start_ts = int(start_ts)
+        dest_path = os.path.join(RECORDINGS_FOLDER, segment_filename(camera_name, start_ts))
+        # Two segments starting in the same second (e.g. after a quick restart) must not collide
+        while os.path.exists(dest_path):
+            start_ts += 1
+            dest_path = os.path.join(RECORDINGS_FOLDER, segment_filename(camera_name, start_ts))
+        try:
+            os.rename(location, dest_path)
+            logger.info(f"Segment closed for {camera_name}: {dest_path}")
+            self.index_segment(camera_name, dest_path)
+            return dest_path
+        except FileNotFoundError:
+            logger.warning(f"Closed segment for {camera_name} not found: {location}")
+        except OSError as e:
+            logger.error(f"Error finalizing segment {location}: {e}", exc_info=True)
+        return None
+
+    def index_segment(self, camera_name, path):
+        """Add a closed segment to the recordings index, off the event loop"""
+        if self.session_factory is None:
+            return
+        rel_path = os.path.relpath(path, RECORDINGS_FOLDER)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._index_segment(camera_name, rel_path)
+            return
+        # A locked database may take a while; recorders must not wait on it
+        loop.run_in_executor(None, self._index_segment, camera_name, rel_path)
+
+    def _index_segment(self, camera_name, rel_path):
+        session = self.session_factory()
+        try:
+            recordings_index.add_recording(session, RECORDINGS_FOLDER, rel_path, camera_name)
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            logger.error(f"Error indexing segment {rel_path}: {e}", exc_info=True)
+        finally:
+            session.close()
+
+    def recover_staged_segments(self, camera_name, include_open=False):
+        """Publish segments left in staging by a pipeline that died before closing them.
+
+        Segments we saw open are skipped unless include_open is set, which callers
+        use once the pipeline writing them is known to be gone.
+        """
+        staging = os.path.join(STAGING_FOLDER, camera_name)
+        try:
+            filenames = os.listdir(staging)
+        except FileNotFoundError:
+            return
+        for filename in filenames:
+            location = os.path.join(staging, filename)
+            if location in self.segment_opened and not include_open:
+                # Still being written by a running pipeline
+                continue
+            start_ts = self.segment_opened.pop(location, None)
+            if os.path.getsize(location) == 0:
+                os.remove(location)
+                continue
+            logger.info(f"Recovering unclosed segment for {camera_name}: {filename}")
+            self.finalize_segment(camera_name, location, start_ts)
+
+    async def _drain(self, key, stream, label):
+        """Read one of the process pipes until EOF so the process never blocks on a full pipe"""
+        while True:
+            try:
+                line = await stream.readline()
+            except ValueError:
+                # Line longer than the StreamReader limit; the buffer has been discarded, keep going
+                continue
+            if not line:
+                break
+            text = line.decode('utf-8', errors='replace').strip()
+            segment_match = SEGMENT_MESSAGE.search(text)
+            if segment_match:
+                self._on_segment_event(key, *segment_match.groups())
+                continue
+            if key in self.shards and text.startswith('{'):
+                try:
+                    self._handle_branch_event(key, json.loads(text))
+                except ValueError:
+                    logger.warning(f"{key}: unparseable branch event: {text}")
+                continue
+            meter_match = METER_MESSAGE.search(text)
+            if meter_match:
+                self._record_frames(key, int(meter_match.group(1)), float(meter_match.group(2)))
+                continue
+            # Only log important messages, filter out stats and routine pipeline info
+            if any(marker in text for marker in IMPORTANT_MARKERS):
+                logger.warning(f"{key}: {text}")
+            # Uncomment the line below if you want to see all GStreamer output for debugging
+            # logger.debug(f"{key} {label}: {text}")
+
+    async def _monitor_process(self, key, process):
+        """Drain stdout and stderr concurrently and wait for the process to exit"""
+        logger.info(f"Monitoring process for: {key}")
+
+        try:
+            await asyncio.gather(
+                self._drain(key, process.stdout, 'OUT'),
+                self._drain(key, process.stderr, 'ERR'),
+            )
+            await process.wait()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error monitoring {key}: {e}", exc_info=True)
+        finally:
+            logger.info(f"Process for {key} exited with code {process.returncode}")
+            if self.processes.get(key) is process:
+                ran_for = time.monotonic() - self.process_started_at.get(key, time.monotonic())
+                del self.processes[key]
+                self.process_started_at.pop(key, None)
+                self._cpu_samples.pop(key, None)
+                self.monitors.pop(key, None)
+                if ran_for >= RESTART_STABLE_SECONDS:
+                    self.restart_attempts[key] = 0
+                # Whatever the process was writing can no longer be closed cleanly
+                for name in self.shards.get(key, [key]):
+                    self.recover_staged_segments(name, include_open=True)
+                # Restart on exit, unless it was stopped on purpose
+                if self._is_supervised(key):
+                    for name in self.shards.get(key, [key]):
+                        self.last_exit_code[name] = process.returncode
+                        self.exited_at.setdefault(name, time.monotonic())
+                    self._schedule_restart(key)
+                self._status_changed()
+
+    def start_watchdog(self):
+        """Start the frozen-stream watchdog"""
+        if self.watchdog_task is None:
+            self.watchdog_task = asyncio.create_task(self._watchdog_loop())
+
+    async def _watchdog_loop(self):
+        logger.info(f"Stream watchdog running every {WATCHDOG_INTERVAL}s, stall timeout {STALL_TIMEOUT}s")
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=1)) as http:
+            while True:
+                await asyncio.sleep(WATCHDOG_INTERVAL)
+                try:
+                    await self._sample_byte_counters(http)
+                    self.check_stalls()
+                    self.write_status_file()
+                    # Picks up stalls and new fps/bitrate samples
+                    self._status_changed()
+                except Exception as e:
+                    logger.error(f"Error in stream watchdog: {e}", exc_info=True)
+
+    async def _sample_byte_counters(self, http):
+        """Sample per-camera byte counters from wherever this recording mode writes"""
+        if RECORDING_MODE == 'direct':
+            # Growth of the segment each camera is currently writing
+            for location in list(self.segment_opened):
+                camera_name = os.path.basename(os.path.dirname(location))
+                if camera_name in self.camera_shard:
+                    continue
+                try:
+                    self._record_bytes(camera_name, os.path.getsize(location))
+                except OSError:
+                    pass
+        elif any(name not in self.camera_shard for name in self.cameras):
+            try:
+                async with http.get(RTMP_STAT_URL) as response:
+                    stats = parse_rtmp_stat(await response.text())
+            except (aiohttp.ClientError, asyncio.TimeoutError, ET.ParseError) as e:
+                logger.debug(f"Could not read nginx-rtmp stats: {e}")
+                return
+            for app_name, to_pipeline in (('live', str), ('sub', sub_stream_name)):
+                for name, stream in stats.get(app_name, {}).items():
+                    name = to_pipeline(name)
+                    if name in self.cameras and name not in self.camera_shard:
+                        self._record_bytes(name, stream['bytes_in'])
+
+    def check_stalls(self):
+        """Restart any running pipeline whose frames stopped flowing"""
+        now = time.monotonic()
+        for camera_name in list(self.cameras):
+            process = self.processes.get(self.camera_shard.get(camera_name, camera_name))
+            flow = self.flow.get(camera_name)
+            if process is None or process.returncode is not None or flow is None:
+                continue
+            if flow['stall_restart_at'] is not None and now - flow['stall_restart_at'] < STALL_TIMEOUT:
+                # Already asked for a restart; give it time to come back
+                continue
+            if flow['last_frame'] is not None:
+                silent_for = now - flow['last_frame']
+                timeout = STALL_TIMEOUT
+            else:
+                # Never produced a frame: allow for the normal connect time as well
+                silent_for = now - self.started_at.get(camera_name, now)
+                timeout = STALL_TIMEOUT + START_TIMEOUT
+            if silent_for < timeout:
+                continue
+
+            stall = self.stalls.setdefault(camera_name, {
+                'count': 0, 'since': None, 'last_seconds': 0.0, 'total_seconds': 0.0
+            })
+            if stall['since'] is None:
+                stall['since'] = now - silent_for
+                stall['count'] += 1
+            logger.warning(f"Stream {camera_name} stalled: no frames for {silent_for:.1f}s, restarting pipeline")
+            flow['stall_restart_at'] = now
+            self.restart_pipeline(camera_name)
+
+    def restart_pipeline(self, camera_name):
+        """Restart one camera's pipeline; its exit is handled like any other failure"""
+        shard_key = self.camera_shard.get(camera_name)
+        if shard_key is not None:
+            self._send_shard_command(shard_key, {'op': 'restart', 'name': camera_name})
+            return
+        process = self.processes.get(camera_name)
+        if process is not None and process.returncode is None:
+            process.terminate()
+
+    def get_camera_state(self, camera_name):
+        """One of up, starting, stalled, restarting or down"""
+        if camera_name not in self.cameras:
+            return 'down'
+        process = self.processes.get(self.camera_shard.get(camera_name, camera_name))
+        if process is None or process.returncode is not None:
+            return 'restarting'
+        stall = self.stalls.get(camera_name)
+        if stall and stall.get('since') is not None:
+            return 'stalled'
+        event = self.ready.get(camera_name)
+        if event is not None and event.is_set():
+            return 'up'
+        return 'starting'
+
+    def get_camera_status(self):
+        """Ingest health of each pipeline (camera or sub stream), keyed by stream name"""
+        now = time.monotonic()
+        cameras = {}
+        for camera_name in list(self.cameras):
+            flow = self.flow.get(camera_name, {})
+            stall = self.stalls.get(camera_name, {})
+            state = self.get_camera_state(camera_name)
+            last_frame = flow.get('last_frame')
+            started_at = self.started_at.get(camera_name)
+            camera, stream = split_stream_name(camera_name)
+            cameras[camera_name] = {
+                'camera': camera,
+                'stream': stream,
+                'state': state,
+                'fps': flow.get('fps', 0.0),
+                'bitrate': flow.get('bitrate', 0),
+                'frames': flow.get('frames', 0),
+                'bytes': flow.get('bytes', 0),
+                'restarts': self.restart_counts.get(camera_name, 0),
+                'uptime': round(now - started_at, 1) if started_at is not None and state != 'restarting' else 0,
+                'last_frame_age': round(now - last_frame, 1) if last_frame is not None else None,
+                'stalls': stall.get('count', 0),
+                'stall_seconds': stall.get('total_seconds', 0.0),
+                'last_exit_code': self.last_exit_code.get(camera_name),
+                'live_port': self.live_ports.get(camera_name),
+                'process': self.camera_shard.get(camera_name, camera_name)
+            }
+        return cameras
+
+    def get_status(self):
+        """Per-camera ingest health, as published to the web process"""
+        return {
+            'generated_at': time.time(),
+            'mode': RECORDING_MODE,
+            'cameras': self.get_camera_status(),
+            'processes': self.get_all_stats()
+        }
+
+    def write_status_file(self, path=None):
+        """Atomically replace the status snapshot file"""
+        path = path or STATUS_FILE
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.get_status(), f)
+        os.replace(tmp_path, path)
+
+    def check_streams(self):
+        """Check the status of all streams"""
+        status = {}
+        for name in self.cameras:
+            process = self.processes.get(self.camera_shard.get(name, name))
+            if process is not None and process.returncode is None:
+                status[name] = "running"
+            else:
+                status[name] = f"stopped (exit code: {self.last_exit_code.get(name)})"
+        return status
+
+    def get_process_stats(self, key):
+        """Return pid, RSS, CPU usage and uptime for a process.
+
+        CPU percent is measured since the previous call for the same process
+        (or since process start on the first call).
+        """
+        process = self.processes.get(key)
+        if process is None or process.returncode is not None:
+            return None
+
+        sample = read_proc_stat(process.pid)
+        if sample is None:
+            return None
+        cpu_seconds, rss_bytes = sample
+
+        now = time.monotonic()
+        prev_time, prev_cpu = self._cpu_samples.get(key, (self.process_started_at[key], 0.0))
+        elapsed = now - prev_time
+        cpu_percent = ((cpu_seconds - prev_cpu) / elapsed * 100) if elapsed > 0 else 0.0
+        self._cpu_samples[key] = (now, cpu_seconds)
+
+        return {
+            'pid': process.pid,
+            'cameras': len(self.shards.get(key, [key])),
+            'rss_bytes': rss_bytes,
+            'cpu_seconds': cpu_seconds,
+            'cpu_percent': round(cpu_percent, 1),
+            'uptime': round(now - self.process_started_at[key], 1)
+        }
+
+    def get_all_stats(self):
+        """Return process stats for every running process"""
+        stats = {}
+        for key in list(self.processes.keys()):
+            process_stats = self.get_process_stats(key)
+            if process_stats is not None:
+                stats[key] = process_stats
+        return stats
+
+    def get_footprint(self):
+        """Total and per-camera RSS/CPU across all ingest processes.
+
+        Run once with SHARD_SIZE unset and once with SHARD_SIZE=N on the same
+        cameras to compare the one-process-per-camera and sharded models.
+        """
+        stats = self.get_all_stats()
+        cameras = sum(process_stats['cameras'] for process_stats in stats.values())
+        rss_bytes = sum(process_stats['rss_bytes'] for process_stats in stats.values())
+        cpu_percent = sum(process_stats['cpu_percent'] for process_stats in stats.values())
+        return {
+            'mode': 'sharded' if self.shard_size > 1 else 'process-per-camera',
+            'processes': len(stats),
+            'cameras': cameras,
+            'rss_bytes': rss_bytes,
+            'cpu_percent': round(cpu_percent, 1),
+            'rss_bytes_per_camera': rss_bytes // cameras if cameras else 0,
+            'cpu_percent_per_camera': round(cpu_percent / cameras, 2) if cameras else 0.0
+        }
+
+    def log_footprint(self):
+        footprint = self.get_footprint()
+        logger.info(
+            f"METRIC footprint mode={footprint['mode']} processes={footprint['processes']} "
+            f"cameras={footprint['cameras']} rss_mb={footprint['rss_bytes'] / 1048576:.1f} "
+            f"cpu_percent={footprint['cpu_percent']} "
+            f"rss_mb_per_camera={footprint['rss_bytes_per_camera'] / 1048576:.1f} "
+            f"cpu_percent_per_camera={footprint['cpu_percent_per_camera']}"
+        )
+        return footprint
+
+    async def _stop_process(self, key):
+        """Terminate a process (and wait for its monitor to finish)"""
+        process = self.processes.get(key)
+        if process is None:
+            return
+        monitor = self.monitors.get(key)
+        logger.info(f"Stopping stream: {key}")
+        if process.returncode is None:
             process.terminate()
-            await asyncio.sleep(1)
-            if process.poll() is None:
-                logger.warning(f"Stream {camera_name} did not terminate gracefully, forcing kill")
+            try:
+                await asyncio.wait_for(process.wait(), timeout=5)
+            except asyncio.TimeoutError:
+                logger.warning(f"Stream {key} did not terminate gracefully, forcing kill")
                 process.kill()
-            stdout, stderr = process.communicate()
-            logger.info(f"Stream {camera_name} stopped. Exit code: {process.returncode}")
-            if stderr:
-                logger.info(f"Final output: {stderr}")
-            del self.processes[camera_name]
+                await process.wait()
+        # Let the monitor finish draining the pipes and clean up its bookkeeping
+        if monitor is not None:
+            await monitor
+        logger.info(f"Stream {key} stopped. Exit code: {process.returncode}")
+
+    def _cancel_restart(self, key):
+        self.restart_attempts.pop(key, None)
+        restart_task = self.restart_tasks.pop(key, None)
+        if restart_task is not None:
+            restart_task.cancel()
+
+    async def stop_stream(self, camera_name):
+        """Stop a camera's main and sub stream pipelines"""
+        await self.stop_pipeline(camera_name)
+        await self.stop_pipeline(sub_stream_name(camera_name))
+
+    async def stop_pipeline(self, camera_name):
+        # Stop supervising first so the exit doesn't trigger a restart
+        self.cameras.pop(camera_name, None)
+        self.exited_at.pop(camera_name, None)
+        self.ready.pop(camera_name, None)
+        self.live_ports.pop(camera_name, None)
+        self._status_changed()
+
+        shard_key = self.camera_shard.pop(camera_name, None)
+        if shard_key is not None:
+            # Only remove this camera's branch; the rest of the shard keeps running
+            members = self.shards.get(shard_key, [])
+            if camera_name in members:
+                members.remove(camera_name)
+            if members:
+                self._send_shard_command(shard_key, {'op': 'remove', 'name': camera_name})
+                logger.info(f"Removed {camera_name} from {shard_key}")
+                return
+            self.shards.pop(shard_key, None)
+            self._cancel_restart(shard_key)
+            await self._stop_process(shard_key)
+            return
+
+        self._cancel_restart(camera_name)
+        await self._stop_process(camera_name)
 
     async def stop_all_streams(self):
         logger.info("Stopping all streams...")
-        for camera_name in list(self.processes.keys()):
-            await self.stop_stream(camera_name)
-        logger.info("All streams stopped")
\ No newline at end of file
+        if self.watchdog_task is not None:
+            self.watchdog_task.cancel()
+            self.watchdog_task = None
+        for key in list(self.shards.keys()):
+            self._cancel_restart(key)
+        self.shards.clear()
+        self.camera_shard.clear()
+        self.cameras.clear()
+        for key in list(self.restart_tasks.keys()):
+            self._cancel_restart(key)
+        await asyncio.gather(*(self._stop_process(key) for key in list(self.processes.keys())))
+        logger.info("All streams stopped")
@@ -0,0 +1,285 @@
+# app/thumbnails.py
+"""Recording thumbnails and filmstrips, generated once per segment and kept in a disk cache.
+
+The file mover queues both as soon as it moves a closed segment into place, so
+the recordings pages normally only read small JPEGs from the cache. A filmstrip
+is one keyframe every FILMSTRIP_INTERVAL seconds tiled into a single sprite
+sheet, plus a JSON map of where each tile is, for hover-scrubbing.
+Cache entries are keyed on the segment's path, mtime and size, so a segment
+that changes gets a new thumbnail. The cache is trimmed least recently used
+first once it grows past THUMBNAIL_CACHE_MAX_BYTES.
+"""
+import hashlib
+import json
+import logging
+import math
+import os
+import struct
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app.env import get_env_int, get_env_float
+from app.recordings_index import parse_segment_filename, MAX_SEGMENT_SECONDS
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_FOLDER = os.getenv('THUMBNAIL_FOLDER', '/mnt/data/.thumbnails')
+THUMBNAIL_WIDTH = get_env_int('THUMBNAIL_WIDTH', 320)
+# Background ffmpeg processes in the file mover (and on-demand ones in the web app)
+THUMBNAIL_WORKERS = get_env_int('THUMBNAIL_WORKERS', 2)
+THUMBNAIL_CACHE_MAX_BYTES = get_env_int('THUMBNAIL_CACHE_MAX_BYTES', 256 * 1024 * 1024)
+# How far into a segment the thumbnail is taken (falls back to the first frame)
+THUMBNAIL_OFFSET = get_env_float('THUMBNAIL_OFFSET', 5)
+THUMBNAIL_TIMEOUT = 30
+# Filmstrips: seconds between tiles (0 disables), tile width and tiles per row
+FILMSTRIP_INTERVAL = get_env_int('FILMSTRIP_INTERVAL', 10)
+FILMSTRIP_TILE_WIDTH = get_env_int('FILMSTRIP_TILE_WIDTH', 160)
+FILMSTRIP_COLUMNS = 10
+# Caps the sprite size for unusually long segments
+FILMSTRIP_MAX_TILES = 120
+# Assumed length when a segment's duration can't be worked out
+DEFAULT_SEGMENT_SECONDS = 600
+
+# Reading a thumbnail refreshes its mtime (for LRU) at most this often
+TOUCH_INTERVAL = 3600
+
+def cache_key(rel_path, stat):
+    return hashlib.sha1(f"{rel_path}:{stat.st_mtime_ns}:{stat.st_size}".encode()).hexdigest()
+
+def cache_path(key, folder=None, suffix='.jpg'):
+    return os.path.join(folder or THUMBNAIL_FOLDER, key[:2], f"{key}{suffix}")
+
+def lookup(root, rel_path, folder=None, suffix='.jpg'):
+    """(cache key, cached thumbnail path) for a segment; the file may not exist yet.
+
+    Raises FileNotFoundError if the segment itself is gone.
+    """
+    key = cache_key(rel_path, os.stat(os.path.join(root, rel_path)))
+    return key, cache_path(key, folder, suffix)
+
+def extract_frame(video_path, dest, offset):
+    """Decode one keyframe at `offset` seconds into a JPEG at `dest`"""
+    cmd = ['ffmpeg', '-v', 'error', '-y', '-skip_frame', 'nokey']
+    if offset:
+        cmd += ['-ss', str(offset)]
+    cmd += [
+        '-i', video_path,
+        '-frames:v', '1',
+        '-vf', f'scale={THUMBNAIL_WIDTH}:-2',
+        '-q:v', '5',
+        '-f', 'image2', dest
+    ]
+    subprocess.run(cmd, capture_output=True, check=True, timeout=THUMBNAIL_TIMEOUT)
+    return os.path.exists(dest) and os.path.getsize(dest) > 0
+
+def generate(root, rel_path, folder=None):
+    """Create the cached thumbnail for a segment if needed; returns its path, or None"""
+    try:
+        _, path = lookup(root, rel_path, folder)
+    except FileNotFoundError:
+        return None
+    if os.path.exists(path):
+        return path
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{threading.get_ident()}.tmp.jpg"
+    video_path = os.path.join(root, rel_path)
+    try:
+        # Segments shorter than the offset have no frame there
+        if not (extract_frame(video_path, tmp_path, THUMBNAIL_OFFSET) or
+                extract_frame(video_path, tmp_path, 0)):
+            logger.warning(f"No frame for thumbnail of {rel_path}")
+            return None
+        os.replace(tmp_path, path)
+        return path
+    except (subprocess.SubprocessError, OSError) as e:
+        stderr = getattr(e, 'stderr', None) or b''
+        logger.warning(f"Could not create thumbnail for {rel_path}: {e} {stderr.decode(errors='replace').strip()}")
+        return None
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def jpeg_size(path):
+    """(width, height) of a baseline or progressive JPEG, read from its SOF marker"""
+    with open(path, 'rb') as f:
+        if f.read(2) != b'\xff\xd8':
+            raise ValueError("not a JPEG")
+        while True:
+            marker, length = struct.unpack('>2sH', f.read(4))
+            if marker[0] != 0xff:
+                raise ValueError("corrupt JPEG")
+            if marker[1] in (0xc0, 0xc1, 0xc2):
+                height, width = struct.unpack('>xHH', f.read(5))
+                return width, height
+            f.seek(length - 2, os.SEEK_CUR)
+
+def segment_duration(root, rel_path):
+    """Segment length from its name and mtime, as the recordings index works it out"""
+    parsed = parse_segment_filename(os.path.basename(rel_path))
+    if parsed:
+        duration = os.path.getmtime(os.path.join(root, rel_path)) - parsed[1]
+        if 0 < duration <= MAX_SEGMENT_SECONDS:
+            return duration
+    return DEFAULT_SEGMENT_SECONDS
+
+def generate_filmstrip(root, rel_path, folder=None):
+    """Create the cached sprite sheet and tile map for a segment; returns the map path, or None.
+
+    Only keyframes are decoded, and the first one at or after each interval
+    becomes a tile, so a whole segment costs about as much as a few thumbnails.
+    """
+    try:
+        key, map_path = lookup(root, rel_path, folder, '.sprite.json')
+    except FileNotFoundError:
+        return None
+    if os.path.exists(map_path):
+        return map_path
+    sprite_path = cache_path(key, folder, '.sprite.jpg')
+    tiles = max(1, min(math.ceil(segment_duration(root, rel_path) / FILMSTRIP_INTERVAL), FILMSTRIP_MAX_TILES))
+    columns = min(tiles, FILMSTRIP_COLUMNS)
+    rows = math.ceil(tiles / columns)
+    os.makedirs(os.path.dirname(sprite_path), exist_ok=True)
+    tmp_path = f"{sprite_path}.{threading.get_ident()}.tmp.jpg"
+    cmd = [
+        'ffmpeg', '-v', 'error', '-y', '-skip_frame', 'nokey',
+        '-i', os.path.join(root, rel_path),
+        '-vf', (f"select='isnan(prev_selected_t)+gte(t-prev_selected_t,{FILMSTRIP_INTERVAL})',"
+                f"scale={FILMSTRIP_TILE_WIDTH}:-2,tile={columns}x{rows}"),
+        '-vsync', 'vfr', '-frames:v', '1', '-q:v', '6',
+        '-f', 'image2', tmp_path
+    ]
+    try:
+        subprocess.run(cmd, capture_output=True, check=True, timeout=THUMBNAIL_TIMEOUT * 4)
+        width, height = jpeg_size(tmp_path)
+        os.replace(tmp_path, sprite_path)
+    except (subprocess.SubprocessError, OSError, ValueError, struct.error) as e:
+        stderr = getattr(e, 'stderr', None) or b''
+        logger.warning(f"Could not create filmstrip for {rel_path}: {e} {stderr.decode(errors='replace').strip()}")
+        return None
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    tile_width, tile_height = width // columns, height // rows
+    tile_map = {
+        'interval': FILMSTRIP_INTERVAL,
+        'tile_width': tile_width,
+        'tile_height': tile_height,
+        'columns': columns,
+        'tiles': [
+            {'time': i * FILMSTRIP_INTERVAL, 'x': (i % columns) * tile_width, 'y': (i // columns) * tile_height}
+            for i in range(tiles)
+        ]
+    }
+    tmp_map_path = f"{map_path}.{threading.get_ident()}.tmp"
+    with open(tmp_map_path, 'w') as f:
+        json.dump(tile_map, f)
+    # Written last: a map on disk means its sprite sheet is complete
+    os.replace(tmp_map_path, map_path)
+    return map_path
+
+def read_filmstrip(root, rel_path, folder=None):
+    """(cache key, tile map, sprite path) for a segment, or None if there is no filmstrip yet"""
+    key, map_path = lookup(root, rel_path, folder, '.sprite.json')
+    sprite_path = cache_path(key, folder, '.sprite.jpg')
+    try:
+        with open(map_path) as f:
+            tile_map = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not os.path.exists(sprite_path):
+        # Trimmed from the cache separately; make both again
+        os.remove(map_path)
+        return None
+    return key, tile_map, sprite_path
+
+def filmstrip_vtt(tile_map, sprite_url, duration=None):
+    """WebVTT thumbnail track for a tile map (the #xywh= convention used by web players)"""
+    def timestamp(seconds):
+        hours, rest = divmod(seconds, 3600)
+        return f"{int(hours):02d}:{int(rest // 60):02d}:{rest % 60:06.3f}"
+
+    lines = ['WEBVTT', '']
+    tiles = tile_map['tiles']
+    for i, tile in enumerate(tiles):
+        end = tiles[i + 1]['time'] if i + 1 < len(tiles) else max(duration or 0, tile['time'] + tile_map['interval'])
+        lines.append(f"{timestamp(tile['time'])} --> {timestamp(end)}")
+        lines.append(f"{sprite_url}#xywh={tile['x']},{tile['y']},{tile_map['tile_width']},{tile_map['tile_height']}")
+        lines.append('')
+    return '\n'.join(lines)
+
+def touch(path):
+    """Mark a thumbnail as recently used"""
+    try:
+        if time.time() - os.path.getmtime(path) > TOUCH_INTERVAL:
+            os.utime(path)
+    except OSError:
+        pass
+
+def trim_cache(max_bytes=None, folder=None):
+    """Delete least recently used files from a cache folder until it fits; returns files deleted"""
+    max_bytes = THUMBNAIL_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    folder = folder or THUMBNAIL_FOLDER
+    entries = []
+    total = 0
+    for dirpath, _, filenames in os.walk(folder):
+        for filename in filenames:
+            if '.tmp' in filename:
+                # Still being written
+                continue
+            path = os.path.join(dirpath, filename)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+    if total <= max_bytes:
+        return 0
+    deleted = 0
+    # Trim a little below the limit so this doesn't run on every pass
+    target = max_bytes * 0.9
+    for _, size, path in sorted(entries):
+        if total <= target:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        deleted += 1
+    logger.info(f"Cache {folder} trimmed: deleted={deleted} size={int(total)}")
+    return deleted
+
+class ThumbnailWorker:
+    """Background pool that generates thumbnails and filmstrips for newly closed segments"""
+    def __init__(self, root, workers=None, folder=None):
+        self.root = root
+        self.folder = folder
+        self.executor = ThreadPoolExecutor(max_workers=workers or THUMBNAIL_WORKERS,
+                                           thread_name_prefix='thumbnail')
+        self.pending = set()
+        self.lock = threading.Lock()
+
+    def submit(self, rel_path):
+        with self.lock:
+            if rel_path in self.pending:
+                return
+            self.pending.add(rel_path)
+        self.executor.submit(self._generate, rel_path)
+
+    def _generate(self, rel_path):
+        try:
+            generate(self.root, rel_path, self.folder)
+            if FILMSTRIP_INTERVAL > 0:
+                generate_filmstrip(self.root, rel_path, self.folder)
+        except Exception as e:
+            logger.error(f"Error creating thumbnail for {rel_path}: {e}", exc_info=True)
+        finally:
+            with self.lock:
+                self.pending.discard(rel_path)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,112 @@
+# app/vod.py
+"""HLS VOD playlists that join a camera's recordings into one timeline.
+
+Each recording segment becomes one media segment, served as MPEG-TS by a
+stream-copy remux (see app.remux). Timestamps are shifted to the segment's
+offset into its UTC day, so back-to-back segments play as one continuous
+stream. EXT-X-DISCONTINUITY is only needed where recording stopped or a new
+day starts. Playlists come from the recordings index alone and are cached
+until the segments in their range change.
+"""
+import math
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from urllib.parse import quote
+
+from sqlalchemy import func
+
+from app.database import Recording
+
+# Gaps shorter than this between segments are treated as continuous recording
+VOD_GAP_TOLERANCE = 2
+# Used for segments whose end time isn't known
+DEFAULT_SEGMENT_SECONDS = 600
+PLAYLIST_CACHE_SIZE = 64
+
+def timeline_offset(start_ts):
+    """Where a segment starts on its day's timeline, in seconds (MPEG-TS wraps after 26.5h)"""
+    return start_ts % 86400
+
+def segment_durations(rows):
+    """Duration of each (start_ts, end_ts, duration, path) row, estimating unknown ones"""
+    durations = []
+    for i, (start_ts, end_ts, duration, _) in enumerate(rows):
+        if duration is None:
+            following = rows[i + 1][0] - start_ts if i + 1 < len(rows) else None
+            duration = following if following and following <= DEFAULT_SEGMENT_SECONDS else DEFAULT_SEGMENT_SECONDS
+        durations.append(max(duration, 1))
+    return durations
+
+def program_date_time(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat(timespec='milliseconds')
+
+def render_playlist(rows, start_ts=None):
+    """M3U8 text for segment rows sorted by start time"""
+    durations = segment_durations(rows)
+    lines = [
+        '#EXTM3U',
+        '#EXT-X-VERSION:3',
+        '#EXT-X-PLAYLIST-TYPE:VOD',
+        f"#EXT-X-TARGETDURATION:{math.ceil(max(durations, default=1))}",
+        '#EXT-X-MEDIA-SEQUENCE:0'
+    ]
+    if rows and start_ts is not None and start_ts > rows[0][0]:
+        # Open the player at the requested time rather than the start of its segment
+        lines.append(f"#EXT-X-START:TIME-OFFSET={start_ts - rows[0][0]},PRECISE=YES")
+    previous_end = None
+    previous_day = None
+    for (segment_start, _, _, path), duration in zip(rows, durations):
+        day = segment_start // 86400
+        if previous_end is not None and (segment_start - previous_end > VOD_GAP_TOLERANCE or day != previous_day):
+            lines.append('#EXT-X-DISCONTINUITY')
+        if previous_end is None or lines[-1] == '#EXT-X-DISCONTINUITY':
+            lines.append(f"#EXT-X-PROGRAM-DATE-TIME:{program_date_time(segment_start)}")
+        lines.append(f"#EXTINF:{duration:.3f},")
+        lines.append(f"/play/{quote(path)}?format=ts&offset={timeline_offset(segment_start)}")
+        previous_end = segment_start + duration
+        previous_day = day
+    lines.append('#EXT-X-ENDLIST')
+    return '\n'.join(lines) + '\n'
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+def get_playlist(session, camera, start_ts, end_ts):
+    """(playlist text, fingerprint) for a camera's segments overlapping [start_ts, end_ts)
+
+    A cached playlist is revalidated with one aggregate query over the range
+    (count, newest id, total size, latest end) instead of loading the rows.
+    """
+    # Segments are at most a day long, so this bounds the index range scan
+    in_range = (
+        (Recording.camera == camera) &
+        (Recording.start_ts >= start_ts - 86400) &
+        (Recording.start_ts < end_ts) &
+        # Only segments the file mover has filed away, i.e. closed ones
+        Recording.path.contains('/')
+    )
+    fingerprint = '-'.join(str(value or 0) for value in session.query(
+        func.count(Recording.id), func.max(Recording.id), func.sum(Recording.size), func.max(Recording.end_ts)
+    ).filter(in_range).one())
+    cache_key = (camera, start_ts, end_ts)
+    with _cache_lock:
+        cached = _cache.get(cache_key)
+        if cached and cached[1] == fingerprint:
+            _cache.move_to_end(cache_key)
+            return cached
+
+    rows = session.query(
+        Recording.start_ts, Recording.end_ts, Recording.duration, Recording.path
+    ).filter(in_range).order_by(Recording.start_ts).all()
+    rows = [
+        row for row in rows
+        if (row.end_ts or row.start_ts + DEFAULT_SEGMENT_SECONDS) > start_ts
+    ]
+    result = (render_playlist(rows, start_ts), fingerprint)
+    with _cache_lock:
+        _cache[cache_key] = result
+        _cache.move_to_end(cache_key)
+        while len(_cache) > PLAYLIST_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return result
@@ -6,13 +6,28 @@ import logging
 import glob
 import re
 from datetime import datetime, date, timedelta
-import subprocess
-import base64
 from pathlib import Path
 import threading
 import time
+import queue
+import json
+import hashlib
+from urllib.parse import quote
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user 
-from .database import init_db, Camera
+from sqlalchemy.orm import scoped_session
+from .database import get_session_factory, Camera, Recording, RecordingDay
+from .camera_registry import registry as camera_registry
+from . import recordings_index
+from .file_mover import read_stats as read_file_mover_stats
+from .metrics import Histogram, render_metric, parse_rtmp_stat
+from .stream_manager import read_status_file, sub_stream_name, snapshot_path, RTMP_STAT_URL, SNAPSHOT_INTERVAL, HLS_FOLDER, SUB_HLS_FOLDER, get_env_float
+from . import live_relay
+from . import thumbnails
+from . import remux
+from . import vod
+from . import exports
+from . import archives
+from . import status_events
 from werkzeug.security import generate_password_hash, check_password_hash
 
 # User class for Flask-Login
@@ -25,6 +40,24 @@ app.secret_key = os.getenv('SECRET_KEY', 'your-default-secret-key')
 app.config['WEBSITE_TITLE'] = os.getenv('WEBSITE_TITLE', 'Default Title')
 app.config['PASSWORD_HASH'] = generate_password_hash(os.getenv('WEBSITE_PASSWORD', 'defaultpassword'))
 
+# How long a fetched copy of nginx-rtmp's /stat is reused for /metrics
+RTMP_STAT_TTL = get_env_float('RTMP_STAT_TTL', 5)
+
+# nginx's internal location for the recordings folder (see nginx.conf)
+RECORDINGS_ACCEL_PREFIX = os.getenv('RECORDINGS_ACCEL_PREFIX', '/internal/recordings/')
+
+# Largest page of recordings /api/recordings returns per camera
+RECORDINGS_PAGE_MAX = 1000
+
+REQUEST_LATENCY = Histogram('nvr_http_request_duration_seconds', 'Flask request latency by endpoint')
+
+# One session per request thread on the shared, pooled engine; removed at teardown
+db_session = scoped_session(get_session_factory())
+
+@app.teardown_appcontext
+def remove_db_session(exception=None):
+    db_session.remove()
+
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
@@ -79,9 +112,7 @@ def restart_app():
 @app.context_processor
 def inject_cameras():
     """Make cameras list available to all templates"""
-    session = init_db()
-    cameras = session.query(Camera).all()
-    return dict(cameras=cameras)
+    return dict(cameras=camera_registry.all())
 
 @app.route('/')
 @login_required
@@ -97,14 +128,16 @@ def add_camera():
         stream_url = request.form['stream_url']
         username = request.form['username'] if request.form['username'] else None
         password = request.form['password'] if request.form['password'] else None
+        sub_stream_url = request.form.get('sub_stream_url') or None
 
         try:
-            session = init_db()
+            session = db_session()
             camera = Camera(
                 name=name,
                 stream_url=stream_url,
                 username=username,
-                password=password
+                password=password,
+                sub_stream_url=sub_stream_url
             )
             session.add(camera)
             session.commit()
@@ -119,7 +152,7 @@ def add_camera():
 @app.route('/edit_camera/<int:camera_id>', methods=['GET', 'POST'])
 @login_required
 def edit_camera(camera_id):
-    session = init_db()
+    session = db_session()
     camera = session.query(Camera).filter_by(id=camera_id).first()
 
     if not camera:
@@ -132,6 +165,7 @@ def edit_camera(camera_id):
         camera.stream_url = request.form['stream_url']
         camera.username = request.form.get('username', None)
         camera.password = request.form.get('password', None)
+        camera.sub_stream_url = request.form.get('sub_stream_url') or None
 
         try:
             session.commit()
@@ -148,7 +182,7 @@ def edit_camera(camera_id):
 @login_required
 def delete_camera(camera_id):
     try:
-        session = init_db()
+        session = db_session()
         camera = session.query(Camera).filter_by(id=camera_id).first()
         if camera:
             session.delete(camera)
@@ -164,18 +198,117 @@ def delete_camera(camera_id):
 @app.route('/view_camera/<int:camera_id>')
 @login_required
 def view_camera(camera_id):
-    session = init_db()
-    camera = session.query(Camera).filter_by(id=camera_id).first()
+    camera = camera_registry.get(camera_id)
     if not camera:
         flash('Camera not found.', 'error')
         return redirect(url_for('index'))
+    status = read_status_file() or {}
+    live_port = status.get('cameras', {}).get(camera.name, {}).get('live_port')
     return render_template(
         'view_camera.html', 
         camera=camera, 
+        low_latency=bool(live_port), 
         site_title=app.config['WEBSITE_TITLE'], 
         page_title=f"Viewing {camera.name}"
     )
 
+@app.route('/live/<camera_name>.mp4')
+@login_required
+def live_stream(camera_name):
+    """Low-latency live video as a never-ending fragmented MP4 response, played via MSE"""
+    name = sub_stream_name(camera_name) if request.args.get('stream') == 'sub' else camera_name
+    status = read_status_file() or {}
+    port = status.get('cameras', {}).get(name, {}).get('live_port')
+    if not port:
+        return jsonify({'error': 'Low-latency live view is not enabled for this camera'}), 404
+
+    feed = live_relay.get_feed(name, port)
+    subscriber = feed.subscribe()
+    init_segment = feed.wait_for_init()
+    if init_segment is None:
+        feed.unsubscribe(subscriber)
+        return jsonify({'error': 'Live feed is not available yet'}), 503
+
+    def generate():
+        try:
+            yield init_segment
+            while True:
+                try:
+                    fragment = subscriber.get(timeout=live_relay.LIVE_INIT_TIMEOUT)
+                except queue.Empty:
+                    break
+                if fragment is None:
+                    break
+                yield fragment
+        finally:
+            feed.unsubscribe(subscriber)
+
+    return app.response_class(generate(), mimetype='video/mp4', headers={
+        'Cache-Control': 'no-store',
+        # Don't let a reverse proxy hold fragments back
+        'X-Accel-Buffering': 'no',
+        'X-Live-Mime-Type': feed.mime_type,
+        'X-Live-Server-Time': f"{time.time():.3f}"
+    })
+
+_snapshot_cache = {}
+_snapshot_lock = threading.Lock()
+
+def get_snapshot(camera_name):
+    """Latest JPEG snapshot for a camera as (bytes, etag), or None.
+
+    The pipeline rewrites the file in place, so a copy is only taken once it
+    holds a complete JPEG; until then the previous one keeps being served.
+    """
+    path = snapshot_path(camera_name)
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    with _snapshot_lock:
+        cached = _snapshot_cache.get(camera_name)
+        if cached and cached['mtime'] == stat.st_mtime_ns and cached['size'] == stat.st_size:
+            return cached['data'], cached['etag']
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except OSError:
+        data = b''
+    # A complete JPEG ends with the EOI marker, which can't occur inside the image data
+    if data.startswith(b'\xff\xd8') and data.endswith(b'\xff\xd9'):
+        with _snapshot_lock:
+            _snapshot_cache[camera_name] = cached = {
+                'mtime': stat.st_mtime_ns,
+                'size': stat.st_size,
+                'data': data,
+                'etag': f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+            }
+    if not cached:
+        return None
+    return cached['data'], cached['etag']
+
+@app.route('/api/camera/<int:camera_id>/snapshot')
+@login_required
+def api_camera_snapshot(camera_id):
+    """The camera's most recent keyframe as a small JPEG, cheap enough to poll"""
+    camera = camera_registry.get(camera_id)
+    if not camera:
+        return jsonify({'error': 'Camera not found'}), 404
+
+    snapshot = get_snapshot(camera.name)
+    if snapshot is None:
+        return jsonify({'error': 'No snapshot available yet'}), 404
+    data, etag = snapshot
+
+    headers = {
+        'ETag': etag,
+        # Nothing newer can exist until the pipeline writes the next one
+        'Cache-Control': f'private, max-age={max(SNAPSHOT_INTERVAL - 1, 0)}'
+    }
+    if etag in request.headers.get('If-None-Match', ''):
+        return app.response_class(status=304, headers=headers)
+    return app.response_class(data, mimetype='image/jpeg', headers=headers)
+
 @app.route('/debug')
 def debug():
     debug_info = {
@@ -207,28 +340,37 @@ def debug():
 
     return jsonify(debug_info)
 
-@app.route('/stream_status')
-def stream_status():
-    session = init_db()
-    cameras = session.query(Camera).all()
-    
+def get_stream_status(cameras, ingest=None):
+    """Which cameras have a live HLS playlist, from one listing of the HLS folder.
+
+    `ingest` is the stream manager's per-pipeline health (see
+    StreamManager.get_camera_status); each camera's entry is added under 'ingest'.
+    """
+    ingest = ingest or {}
+    try:
+        hls_files = os.listdir(HLS_FOLDER)
+    except OSError:
+        hls_files = []
     status = {}
     for camera in cameras:
         # Check HLS file existence
-        m3u8_path = f'/var/www/hls/{camera.name}.m3u8'
-        ts_files = []
-        
+        m3u8_path = os.path.join(HLS_FOLDER, f'{camera.name}.m3u8')
         try:
             if os.path.exists(m3u8_path):
                 status[camera.name] = {
                     'hls_playlist': True,
-                    'last_modified': os.path.getmtime(m3u8_path)
+                    'last_modified': os.path.getmtime(m3u8_path),
+                    # TS segments
+                    'ts_segments': [
+                        file for file in hls_files
+                        if file.startswith(camera.name) and file.endswith('.ts')
+                    ]
                 }
-                # Look for TS segments
-                for file in os.listdir('/var/www/hls'):
-                    if file.startswith(camera.name) and file.endswith('.ts'):
-                        ts_files.append(file)
-                status[camera.name]['ts_segments'] = ts_files
+                if camera.sub_stream_url:
+                    sub_m3u8_path = os.path.join(SUB_HLS_FOLDER, f'{camera.name}.m3u8')
+                    status[camera.name]['sub_hls_playlist'] = os.path.exists(sub_m3u8_path)
+                    if os.path.exists(sub_m3u8_path):
+                        status[camera.name]['sub_last_modified'] = os.path.getmtime(sub_m3u8_path)
             else:
                 status[camera.name] = {
                     'hls_playlist': False,
@@ -238,49 +380,152 @@ def stream_status():
             status[camera.name] = {
                 'error': f'Error checking stream: {str(e)}'
             }
-    
-    return jsonify(status)
-
-# Log environment variables at startup
-print("\n----- ENVIRONMENT VARIABLES -----")
-print(f"RECORDINGS_PATH: {os.getenv('RECORDINGS_PATH', '(not set)')}")
-print(f"PWD: {os.getcwd()}")
-print(f"PYTHONPATH: {os.getenv('PYTHONPATH', '(not set)')}")
-print(f"User: {os.getenv('USER', '(not set)')}")
-print("--------------------------------\n")
-
-# Check recordings directory on startup
-recordings_path = os.getenv('RECORDINGS_PATH', '/mnt/data')
-if not os.path.isabs(recordings_path):
-    recordings_path = os.path.join(os.getcwd(), recordings_path)
-
-print(f"\n----- CHECKING RECORDINGS DIRECTORY: {recordings_path} -----")
-if os.path.exists(recordings_path):
-    print(f"Directory exists, listing content:")
-    for item in os.listdir(recordings_path):
-        item_path = os.path.join(recordings_path, item)
-        item_type = "directory" if os.path.isdir(item_path) else "file"
-        item_size = os.path.getsize(item_path) if os.path.isfile(item_path) else "-"
-        print(f"  - {item} ({item_type}, {item_size} bytes)")
-    
-    # Check for .flv files
-    flv_files = [f for f in os.listdir(recordings_path) if f.endswith('.flv')]
-    print(f"\nFound {len(flv_files)} .flv files:")
-    for flv in flv_files[:5]:  # Show only first 5
-        print(f"  - {flv}")
-    if len(flv_files) > 5:
-        print(f"  ... and {len(flv_files) - 5} more")
-else:
-    print(f"Directory does not exist!")
-print("--------------------------------\n")
+        status[camera.name]['ingest'] = ingest.get(camera.name)
+        if sub_stream_name(camera.name) in ingest:
+            status[camera.name]['sub_ingest'] = ingest[sub_stream_name(camera.name)]
+    return status
+
+@app.route('/stream_status')
+def stream_status():
+    status = read_status_file() or {}
+    return jsonify(get_stream_status(camera_registry.all(), status.get('cameras')))
+
+@app.route('/stream_status/events')
+@login_required
+def stream_status_events():
+    """Per-camera state changes as Server-Sent Events, followed from the status file"""
+    feed = status_events.get_file_feed()
+    subscriber = feed.subscribe(queue.Queue(maxsize=status_events.STATUS_EVENTS_MAX_QUEUED))
+
+    def generate():
+        try:
+            yield status_events.RETRY
+            while True:
+                try:
+                    event = subscriber.get(timeout=status_events.STATUS_EVENTS_KEEPALIVE)
+                except queue.Empty:
+                    event = status_events.KEEPALIVE
+                if event is None:
+                    break
+                yield event
+        finally:
+            feed.unsubscribe(subscriber)
+
+    return app.response_class(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-store',
+        # Don't let a reverse proxy hold events back
+        'X-Accel-Buffering': 'no'
+    })
+
+@app.before_request
+def start_request_timer():
+    request.environ['nvr.request_started'] = time.perf_counter()
+
+@app.after_request
+def record_request_latency(response):
+    started = request.environ.get('nvr.request_started')
+    if started is not None:
+        REQUEST_LATENCY.observe(
+            time.perf_counter() - started,
+            endpoint=request.endpoint or 'unmatched',
+            method=request.method,
+            status=response.status_code
+        )
+    return response
+
+_rtmp_stat_cache = {'fetched_at': 0.0, 'data': None}
+_rtmp_stat_lock = threading.Lock()
+
+def get_rtmp_stats():
+    """nginx-rtmp stream stats, fetched at most once per RTMP_STAT_TTL seconds"""
+    with _rtmp_stat_lock:
+        now = time.monotonic()
+        if _rtmp_stat_cache['data'] is None or now - _rtmp_stat_cache['fetched_at'] >= RTMP_STAT_TTL:
+            try:
+                response = requests.get(RTMP_STAT_URL, timeout=1)
+                response.raise_for_status()
+                _rtmp_stat_cache['data'] = parse_rtmp_stat(response.text)
+            except Exception as e:
+                logging.warning(f"Could not fetch RTMP stats: {e}")
+                _rtmp_stat_cache['data'] = _rtmp_stat_cache['data'] or {}
+            # Cache failures too so a down nginx doesn't add a timeout to every scrape
+            _rtmp_stat_cache['fetched_at'] = now
+        return _rtmp_stat_cache['data']
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus metrics for the ingest pipelines, nginx-rtmp, file_mover and this web app"""
+    lines = []
+
+    status = read_status_file() or {}
+    cameras = status.get('cameras', {})
+    if status.get('generated_at'):
+        lines += render_metric('nvr_status_age_seconds', 'gauge', 'Age of the stream manager status snapshot',
+                               [({}, round(time.time() - status['generated_at'], 3))])
+
+    def camera_samples(key, transform=None):
+        samples = []
+        for pipeline_name, camera in cameras.items():
+            value = camera.get(key)
+            if transform is not None:
+                value = transform(value)
+            labels = {'camera': camera.get('camera', pipeline_name), 'stream': camera.get('stream', 'main')}
+            samples.append((labels, value))
+        return samples
+
+    lines += render_metric('nvr_camera_up', 'gauge', 'Whether the camera is delivering frames',
+                           camera_samples('state', lambda state: 1 if state == 'up' else 0))
+    lines += render_metric('nvr_camera_bitrate_bits', 'gauge', 'Ingest bitrate in bits per second',
+                           camera_samples('bitrate'))
+    lines += render_metric('nvr_camera_fps', 'gauge', 'Ingest frames per second', camera_samples('fps'))
+    lines += render_metric('nvr_camera_restarts_total', 'counter', 'Pipeline restarts',
+                           camera_samples('restarts'))
+    lines += render_metric('nvr_camera_uptime_seconds', 'gauge', 'Seconds since the pipeline last started',
+                           camera_samples('uptime'))
+    lines += render_metric('nvr_camera_last_frame_age_seconds', 'gauge', 'Seconds since the last frame',
+                           camera_samples('last_frame_age'))
+    lines += render_metric('nvr_camera_stalls_total', 'counter', 'Times the stream stopped delivering frames',
+                           camera_samples('stalls'))
+    lines += render_metric('nvr_camera_stall_seconds_total', 'counter', 'Seconds spent stalled',
+                           camera_samples('stall_seconds'))
+
+    rtmp_streams = []
+    for app_name, streams in get_rtmp_stats().items():
+        for stream_name, stream in streams.items():
+            rtmp_streams.append(({'application': app_name, 'stream': stream_name}, stream))
+    lines += render_metric('nvr_rtmp_bytes_in_total', 'counter', 'Bytes received by nginx-rtmp',
+                           [(labels, stream['bytes_in']) for labels, stream in rtmp_streams])
+    lines += render_metric('nvr_rtmp_bandwidth_in_bits', 'gauge', 'nginx-rtmp input bandwidth in bits per second',
+                           [(labels, stream['bw_in']) for labels, stream in rtmp_streams])
+    lines += render_metric('nvr_rtmp_clients', 'gauge', 'Clients connected to the nginx-rtmp stream',
+                           [(labels, stream['clients']) for labels, stream in rtmp_streams])
+
+    mover = read_file_mover_stats()
+    lines += render_metric('nvr_file_mover_runs_total', 'counter', 'file_mover runs', [({}, mover['runs'])])
+    lines += render_metric('nvr_file_mover_files_moved_total', 'counter', 'Recordings moved into date folders',
+                           [({}, mover['files_moved'])])
+    lines += render_metric('nvr_file_mover_bytes_moved_total', 'counter', 'Bytes moved into date folders',
+                           [({}, mover['bytes_moved'])])
+    lines += render_metric('nvr_file_mover_files_deleted_total', 'counter', 'Recordings deleted by retention',
+                           [({}, mover['files_deleted'])])
+    lines += render_metric('nvr_file_mover_bytes_deleted_total', 'counter', 'Bytes deleted by retention',
+                           [({}, mover['bytes_deleted'])])
+    last_run = mover.get('last_run') or {}
+    lines += render_metric('nvr_file_mover_last_run_timestamp_seconds', 'gauge', 'When file_mover last finished',
+                           [({}, last_run.get('timestamp'))])
+    lines += render_metric('nvr_file_mover_last_run_duration_seconds', 'gauge', 'How long the last file_mover run took',
+                           [({}, last_run.get('duration'))])
+
+    lines += REQUEST_LATENCY.render()
+
+    return app.response_class("\n".join(lines) + "\n", content_type='text/plain; version=0.0.4; charset=utf-8')
 
 # Recording browser functionality
 @app.route('/recordings')
 @login_required
 def recordings_browser():
     """Main recordings browser page with calendar view"""
-    session = init_db()
-    cameras = session.query(Camera).all()
+    cameras = camera_registry.all()
     
     # Get available dates with recordings
     recording_dates = get_available_dates()
@@ -312,8 +557,7 @@ def recordings_browser():
 @login_required
 def camera_recordings(camera_name):
     """View recordings for a specific camera"""
-    session = init_db()
-    camera = session.query(Camera).filter_by(name=camera_name).first()
+    camera = camera_registry.by_name(camera_name)
     
     if not camera:
         flash('Camera not found.', 'error')
@@ -349,469 +593,638 @@ def camera_recordings(camera_name):
         page_title=f"Recordings - {camera.name}"
     )
 
+def recordings_list_query(args):
+    """(etag, build) for /api/recordings; build() returns the response data.
+
+    The ETag comes from the day's summary rows (see RecordingDay), so a client's
+    copy is validated without listing any recordings. limit and offset page
+    through long days. Raises ValueError with the reason for bad arguments.
+    """
+    camera_name = args.get('camera')
+    date_str = args.get('date')
+    try:
+        selected_date = datetime.strptime(date_str, '%Y-%m-%d').date() if date_str else date.today()
+    except ValueError:
+        raise ValueError('Invalid date format')
+    try:
+        limit = int(args['limit']) if args.get('limit') else None
+        offset = int(args.get('offset') or 0)
+    except ValueError:
+        raise ValueError('Invalid limit or offset')
+    if (limit is not None and not 0 < limit <= RECORDINGS_PAGE_MAX) or offset < 0:
+        raise ValueError(f'limit must be between 1 and {RECORDINGS_PAGE_MAX}, offset at least 0')
+
+    camera_names = [camera_name] if camera_name else [camera.name for camera in camera_registry.all()]
+    summary = get_day_summary(selected_date, camera_name)
+    etag = summary_etag(selected_date, camera_names, sorted(summary.items()))
+
+    def build():
+        if camera_name or limit is not None:
+            result = {name: get_recordings_by_date(name, selected_date, limit, offset) for name in camera_names}
+        else:
+            # Every camera's day in one query
+            by_camera = get_recordings_by_date(None, selected_date)
+            result = {name: by_camera.get(name, []) for name in camera_names}
+        if camera_name:
+            data = {'camera': camera_name, 'date': date_str, 'recordings': result[camera_name]}
+        else:
+            data = {'date': date_str, 'cameras': result}
+        if limit is not None:
+            totals = {name: summary.get(name, (0, 0))[0] for name in camera_names}
+            more = any(total > offset + limit for total in totals.values())
+            data.update({'offset': offset, 'limit': limit, 'next_offset': offset + limit if more else None})
+            if camera_name:
+                data['total'] = totals[camera_name]
+            else:
+                data['totals'] = totals
+        return data
+
+    return etag, build
+
+def summary_etag(*parts):
+    return f'"{hashlib.sha1(repr(parts).encode()).hexdigest()[:20]}"'
+
+def conditional_json(query):
+    """Respond to an (etag, build) query with JSON, or 304 if the client's copy is current"""
+    etag, build = query
+    headers = {'ETag': etag, 'Cache-Control': 'private, no-cache'}
+    if etag in request.headers.get('If-None-Match', ''):
+        return app.response_class(status=304, headers=headers)
+    response = jsonify(build())
+    response.headers.update(headers)
+    return response
+
 @app.route('/api/recordings')
 @login_required
 def api_recordings_list():
-    """API endpoint to get recordings data"""
-    camera_name = request.args.get('camera')
-    date_str = request.args.get('date')
-    
+    """API endpoint to get recordings data; limit and offset page through a day"""
     try:
-        if date_str:
-            selected_date = datetime.strptime(date_str, '%Y-%m-%d').date()
-        else:
-            selected_date = date.today()
+        return conditional_json(recordings_list_query(request.args))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+def recordings_summary_query(args):
+    """(etag, build) for /api/recordings/summary: segments and bytes per camera per day of a month"""
+    camera_name = args.get('camera')
+    try:
+        first_day = datetime.strptime(args['month'], '%Y-%m').date() if args.get('month') else date.today().replace(day=1)
     except ValueError:
-        return jsonify({'error': 'Invalid date format'}), 400
-    
-    if camera_name:
-        # Get recordings for specific camera
-        recordings = get_recordings_by_date(camera_name, selected_date)
-        return jsonify({
-            'camera': camera_name,
-            'date': date_str,
-            'recordings': recordings
-        })
-    else:
-        # Get recordings for all cameras
-        result = {}
-        session = init_db()
-        cameras = session.query(Camera).all()
-        
-        for camera in cameras:
-            result[camera.name] = get_recordings_by_date(camera.name, selected_date)
-        
-        return jsonify({
-            'date': date_str,
-            'cameras': result
-        })
+        raise ValueError('Invalid month, expected YYYY-MM')
+    rows = get_month_summary(first_day, camera_name)
+    etag = summary_etag(first_day, camera_name, [(row.camera, row.day, row.generation) for row in rows])
+
+    def build():
+        cameras = {}
+        for row in rows:
+            if row.segments > 0:
+                cameras.setdefault(row.camera, {})[row.day] = {'segments': row.segments, 'bytes': row.bytes}
+        return {'month': first_day.strftime('%Y-%m'), 'cameras': cameras}
+
+    return etag, build
+
+@app.route('/api/recordings/summary')
+@login_required
+def api_recordings_summary():
+    """Per-camera, per-day recording counts and sizes for a month (month=YYYY-MM, optional camera)"""
+    try:
+        return conditional_json(recordings_summary_query(request.args))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
 @app.route('/recording/<path:file_path>')
 @login_required
 def serve_recording(file_path):
-    """Serve a recording file"""
-    recordings_dir = os.getenv('RECORDINGS_PATH', '/mnt/data')
-    # Handle relative paths (default to current directory)
-    if not os.path.isabs(recordings_dir):
-        recordings_dir = os.path.join(os.getcwd(), recordings_dir)
-    full_path = os.path.join(recordings_dir, file_path)
-    
-    # Security check to prevent directory traversal
-    if not os.path.exists(full_path) or not os.path.isfile(full_path):
+    """Serve a recording file.
+
+    Behind the bundled nginx the transfer is handed to nginx with
+    X-Accel-Redirect once the login and path are checked, so a long download
+    doesn't hold a Python worker; accessed directly, Flask sends the file.
+    """
+    rel_path = get_recording_rel_path(file_path)
+    if rel_path is None:
+        return "Access denied", 403
+    full_path = os.path.join(get_recordings_root(), rel_path)
+    if not os.path.isfile(full_path):
         flash('Recording not found', 'error')
         return redirect(url_for('recordings_browser'))
-    
-    if not full_path.startswith(os.path.abspath(recordings_dir)):
-        return "Access denied", 403
-    
+
     # Determine the content type based on file extension
     content_type = "video/x-flv"  # Default for .flv files
-    
-    # Serve the file using Flask's send_file
+
+    if request.headers.get('X-Sendfile-Type') == 'X-Accel-Redirect':
+        response = app.response_class(content_type=content_type)
+        response.headers['X-Accel-Redirect'] = RECORDINGS_ACCEL_PREFIX + quote(rel_path)
+        return response
     return send_file(full_path, mimetype=content_type)
 
+def get_timeline_offset(rel_path):
+    """A segment's VOD timeline offset, from the index or else its file name; None if unknown"""
+    session = db_session()
+    try:
+        start_ts = session.query(Recording.start_ts).filter(Recording.path == rel_path).scalar()
+    finally:
+        session.close()
+    if start_ts is None:
+        parsed = recordings_index.parse_segment_filename(os.path.basename(rel_path))
+        if parsed is None:
+            return None
+        start_ts = parsed[1]
+    return vod.timeline_offset(start_ts)
+
+@app.route('/play/<path:file_path>')
+@login_required
+def play_recording(file_path):
+    """A recording remuxed to fragmented MP4, playable in the browser.
+
+    The first request for a segment starts (or joins) a remux and streams its
+    output as it is written; later ones are served from the remux cache with
+    full Range support. While a remux is running, Range requests are answered
+    from the part already written. format=ts (with an optional timestamp
+    offset) gives the MPEG-TS used by the VOD playlists. The offset is always
+    the segment's place on its day's timeline (see app.vod), whatever value
+    was asked for.
+    """
+    rel_path = get_recording_rel_path(file_path)
+    if rel_path is None:
+        return "Access denied", 403
+    format = request.args.get('format', 'mp4')
+    if format not in remux.FORMATS:
+        return jsonify({'error': 'Unsupported format'}), 400
+    ts_offset = None
+    if format == 'ts' and 'offset' in request.args:
+        # Each offset is its own cache entry and remux, so only the segment's own one is used
+        ts_offset = get_timeline_offset(rel_path)
+    mimetype = remux.MIME_TYPES[format]
+    try:
+        key, path, job = remux.get_remux(get_recordings_root(), rel_path, format=format, ts_offset=ts_offset)
+    except FileNotFoundError:
+        return jsonify({'error': 'Recording not found'}), 404
+
+    etag = f'"{key}"'
+    if job is None:
+        cached_rel_path = os.path.relpath(path, os.path.realpath(get_recordings_root()))
+        if (request.headers.get('X-Sendfile-Type') == 'X-Accel-Redirect' and
+                not cached_rel_path.startswith('..')):
+            response = app.response_class(content_type=mimetype)
+            response.headers['X-Accel-Redirect'] = RECORDINGS_ACCEL_PREFIX + quote(cached_rel_path)
+            return response
+        return send_file(path, mimetype=mimetype, etag=key, conditional=True, max_age=3600)
+
+    headers = {'Accept-Ranges': 'bytes', 'Cache-Control': 'no-cache'}
+    byte_range = request.range
+    if byte_range is not None and len(byte_range.ranges) == 1:
+        start, stop = byte_range.ranges[0]
+        try:
+            written = os.path.getsize(job.tmp_path)
+        except OSError:
+            written = 0
+        if start is not None and start < written:
+            # The total length isn't known until the remux finishes
+            end = min(stop if stop is not None else written, written) - 1
+            headers['Content-Range'] = f"bytes {start}-{end}/*"
+            return app.response_class(job.follow(start, end), status=206,
+                                      mimetype=mimetype, headers=headers)
+    headers['ETag'] = etag
+    return app.response_class(job.follow(), mimetype=mimetype, headers=headers)
+
+def parse_time_arg(value):
+    """A unix timestamp or local ISO date/time (e.g. 2024-05-01T14:32) from a query string"""
+    if value is None:
+        return None
+    if value.isdigit():
+        return int(value)
+    return int(datetime.fromisoformat(value).timestamp())
+
+def parse_playlist_range(args):
+    """[start, end) of a playlist request's query string; raises ValueError with the reason"""
+    try:
+        day = datetime.strptime(args['date'], '%Y-%m-%d').date() if 'date' in args else date.today()
+        start_ts, end_ts = day_bounds(day)
+        if 'start' in args:
+            start_ts = parse_time_arg(args['start'])
+            end_ts = start_ts + 86400
+        end_ts = parse_time_arg(args.get('end')) or end_ts
+    except ValueError:
+        raise ValueError('Invalid date or time')
+    if end_ts <= start_ts:
+        raise ValueError('end must be after start')
+    return start_ts, end_ts
+
+def get_camera_playlist(camera_name, start_ts, end_ts):
+    session = db_session()
+    try:
+        return vod.get_playlist(session, camera_name, start_ts, end_ts)
+    finally:
+        session.close()
+
+@app.route('/api/camera/<camera_name>/playlist.m3u8')
+@login_required
+def api_camera_playlist(camera_name):
+    """HLS VOD playlist over a camera's recordings between start and end (default: today).
+
+    start and end take unix timestamps or ISO times (end defaults to a day after
+    start); date=YYYY-MM-DD picks a whole day.
+    """
+    try:
+        start_ts, end_ts = parse_playlist_range(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    playlist, fingerprint = get_camera_playlist(camera_name, start_ts, end_ts)
+    etag = f'"{fingerprint}"'
+    headers = {'ETag': etag, 'Cache-Control': 'private, no-cache'}
+    if etag in request.headers.get('If-None-Match', ''):
+        return app.response_class(status=304, headers=headers)
+    return app.response_class(playlist, mimetype='application/vnd.apple.mpegurl', headers=headers)
+
+@app.route('/download/<camera_name>/<date_str>.<format>')
+@login_required
+def download_camera_day(camera_name, date_str, format):
+    """A camera's recordings for one day as a single streamed TAR or (stored) ZIP.
+
+    TAR downloads have a known length and can be resumed with Range requests.
+    """
+    if format not in ('tar', 'zip') or not recordings_index.DATE_DIR.match(date_str):
+        return jsonify({'error': 'Not found'}), 404
+    rel_dir = get_recording_rel_path(f"{date_str}/{camera_name}")
+    if rel_dir != f"{date_str}/{camera_name}":
+        return "Access denied", 403
+    try:
+        entries = archives.list_day(get_recordings_root(), date_str, camera_name)
+    except FileNotFoundError:
+        return jsonify({'error': 'No recordings for that day'}), 404
+
+    filename = f"{camera_name}_{date_str}.{format}"
+    headers = {'Content-Disposition': f'attachment; filename="{filename}"'}
+    if format == 'zip':
+        return app.response_class(archives.iter_zip(entries), mimetype='application/zip', headers=headers)
+
+    tar = archives.TarStream(entries)
+    # Changes whenever a segment is added, removed or resized, so stale ranges aren't mixed in
+    etag = f'"{hashlib.sha1(repr(entries).encode()).hexdigest()}"'
+    headers.update({'Accept-Ranges': 'bytes', 'ETag': etag})
+    byte_range = request.range
+    if_range = request.headers.get('If-Range')
+    if byte_range is not None and len(byte_range.ranges) == 1 and (if_range is None or if_range == etag):
+        content_range = byte_range.range_for_length(tar.size)
+        if content_range is None:
+            headers['Content-Range'] = f"bytes */{tar.size}"
+            return app.response_class(status=416, headers=headers)
+        start, stop = content_range
+        headers['Content-Range'] = f"bytes {start}-{stop - 1}/{tar.size}"
+        headers['Content-Length'] = str(stop - start)
+        return app.response_class(tar.iter_range(start, stop - 1), status=206,
+                                  mimetype='application/x-tar', headers=headers)
+    headers['Content-Length'] = str(tar.size)
+    return app.response_class(tar.iter_range(), mimetype='application/x-tar', headers=headers)
+
+# On-demand thumbnails for segments the file mover hasn't done (yet), capped like its pool
+_thumbnail_slots = threading.BoundedSemaphore(thumbnails.THUMBNAIL_WORKERS)
+
+def get_recording_rel_path(recording_path):
+    """Normalise a recording path from a request; None if it points outside the recordings folder"""
+    root = os.path.realpath(get_recordings_root())
+    full_path = os.path.realpath(os.path.join(root, (recording_path or '').lstrip('/')))
+    if os.path.commonpath([root, full_path]) != root or full_path == root:
+        return None
+    return os.path.relpath(full_path, root)
+
+@app.route('/thumbnail/<path:file_path>')
+@login_required
+def serve_thumbnail(file_path):
+    """A recording's cached JPEG thumbnail, generated here only if it is missing"""
+    rel_path = get_recording_rel_path(file_path)
+    if rel_path is None:
+        return "Access denied", 403
+    try:
+        key, path = thumbnails.lookup(get_recordings_root(), rel_path)
+    except FileNotFoundError:
+        return jsonify({'error': 'Recording not found'}), 404
+
+    etag = f'"{key}"'
+    headers = {
+        'ETag': etag,
+        # A changed segment gets a new ETag, so browsers only need to revalidate now and then
+        'Cache-Control': 'private, max-age=3600'
+    }
+    if etag in request.headers.get('If-None-Match', ''):
+        return app.response_class(status=304, headers=headers)
+
+    if not os.path.exists(path):
+        if not _thumbnail_slots.acquire(timeout=thumbnails.THUMBNAIL_TIMEOUT):
+            return jsonify({'error': 'Thumbnail generation busy'}), 503, {'Retry-After': '5'}
+        try:
+            path = thumbnails.generate(get_recordings_root(), rel_path)
+        finally:
+            _thumbnail_slots.release()
+        if path is None:
+            return jsonify({'error': 'Failed to generate thumbnail'}), 500
+    thumbnails.touch(path)
+    response = send_file(path, mimetype='image/jpeg', etag=False, conditional=False)
+    response.headers.update(headers)
+    return response
+
+@app.route('/api/exports', methods=['POST'])
+@login_required
+def api_create_export():
+    """Queue a clip export; takes camera, start and end (unix or ISO times) as JSON or form data"""
+    data = request.get_json(silent=True) or request.form
+    camera_name = data.get('camera')
+    try:
+        start_ts = parse_time_arg(str(data.get('start')))
+        end_ts = parse_time_arg(str(data.get('end')))
+    except ValueError:
+        return jsonify({'error': 'Invalid start or end time'}), 400
+    if not camera_name:
+        return jsonify({'error': 'No camera provided'}), 400
+
+    session = db_session()
+    try:
+        job = exports.submit(session, get_recordings_root(), camera_name, start_ts, end_ts)
+    except exports.ExportError as e:
+        return jsonify({'error': str(e)}), 400
+    finally:
+        session.close()
+    return jsonify(export_info(job)), 202, {'Location': url_for('api_export_status', job_id=job.id)}
+
+def export_info(job):
+    info = job.to_dict()
+    info['status_url'] = url_for('api_export_status', job_id=job.id)
+    info['download_url'] = url_for('download_export', job_id=job.id) if job.status == 'done' else None
+    return info
+
+@app.route('/api/exports/<job_id>')
+@login_required
+def api_export_status(job_id):
+    """Progress of a clip export"""
+    job = exports.get_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Export not found'}), 404
+    return jsonify(export_info(job))
+
+@app.route('/api/exports/<job_id>/download')
+@login_required
+def download_export(job_id):
+    """A finished clip export"""
+    job = exports.get_job(job_id)
+    if job is None or job.status != 'done':
+        return jsonify({'error': 'Export not found or not finished'}), 404
+    export_rel_path = os.path.relpath(job.path, os.path.realpath(get_recordings_root()))
+    if request.headers.get('X-Sendfile-Type') == 'X-Accel-Redirect' and not export_rel_path.startswith('..'):
+        response = app.response_class(content_type='video/mp4')
+        response.headers['X-Accel-Redirect'] = RECORDINGS_ACCEL_PREFIX + quote(export_rel_path)
+        response.headers['Content-Disposition'] = f'attachment; filename="{job.filename}"'
+        return response
+    return send_file(job.path, mimetype='video/mp4', as_attachment=True, download_name=job.filename)
+
+def get_filmstrip(file_path):
+    """(cache key, tile map, sprite path) for a recording, or an error response"""
+    rel_path = get_recording_rel_path(file_path)
+    if rel_path is None:
+        return None, ("Access denied", 403)
+    try:
+        filmstrip = thumbnails.read_filmstrip(get_recordings_root(), rel_path)
+    except FileNotFoundError:
+        return None, (jsonify({'error': 'Recording not found'}), 404)
+    if filmstrip is None:
+        # Made in the background as segments close; never worth a request's wait
+        return None, (jsonify({'error': 'No filmstrip available yet'}), 404)
+    return filmstrip, None
+
+def filmstrip_response(key, body, mimetype):
+    etag = f'"{key}"'
+    headers = {'ETag': etag, 'Cache-Control': 'private, max-age=3600'}
+    if etag in request.headers.get('If-None-Match', ''):
+        return app.response_class(status=304, headers=headers)
+    return app.response_class(body, mimetype=mimetype, headers=headers)
+
+@app.route('/filmstrip/<path:file_path>')
+@login_required
+def serve_filmstrip(file_path):
+    """A recording's filmstrip sprite sheet"""
+    filmstrip, error = get_filmstrip(file_path)
+    if error:
+        return error
+    key, _, sprite_path = filmstrip
+    thumbnails.touch(sprite_path)
+    with open(sprite_path, 'rb') as f:
+        return filmstrip_response(key, f.read(), 'image/jpeg')
+
+@app.route('/api/recording/filmstrip')
+@login_required
+def api_recording_filmstrip():
+    """Tile map for a recording's filmstrip, as JSON or (format=vtt) a WebVTT thumbnail track"""
+    filmstrip, error = get_filmstrip(request.args.get('path'))
+    if error:
+        return error
+    key, tile_map, _ = filmstrip
+    sprite_url = url_for('serve_filmstrip', file_path=get_recording_rel_path(request.args.get('path')))
+    if request.args.get('format') == 'vtt':
+        return filmstrip_response(key, thumbnails.filmstrip_vtt(tile_map, sprite_url), 'text/vtt')
+    return filmstrip_response(key, json.dumps(dict(tile_map, sprite=sprite_url)), 'application/json')
+
 @app.route('/api/recording/thumbnail')
 @login_required
 def api_recording_thumbnail():
-    """Generate and serve a thumbnail for a recording"""
+    """URL of a recording's thumbnail image"""
     recording_path = request.args.get('path')
-    
     if not recording_path:
         return jsonify({'error': 'No recording path provided'}), 400
-    
-    # For security, make sure we're only accessing files in the recordings directory
-    recordings_dir = os.getenv('RECORDINGS_PATH', '/mnt/data')
-    # Handle relative paths (default to current directory)
-    if not os.path.isabs(recordings_dir):
-        recordings_dir = os.path.join(os.getcwd(), recordings_dir)
-    full_path = os.path.join(recordings_dir, recording_path.lstrip('/'))
-    
-    if not os.path.exists(full_path) or not full_path.startswith(recordings_dir):
+    rel_path = get_recording_rel_path(recording_path)
+    if rel_path is None or not os.path.isfile(os.path.join(get_recordings_root(), rel_path)):
         return jsonify({'error': 'Recording not found or access denied'}), 404
-    
-    try:
-        # Generate thumbnail using ffmpeg
-        thumbnail = generate_thumbnail(full_path)
-        return jsonify({'thumbnail': thumbnail})
-    except Exception as e:
-        return jsonify({'error': f'Failed to generate thumbnail: {str(e)}'}), 500
+    return jsonify({'thumbnail': url_for('serve_thumbnail', file_path=rel_path)})
 
-@app.route('/api/calendar')
-@login_required
-def api_calendar_data():
-    """API endpoint to get calendar data with recording availability"""
-    month = request.args.get('month')
-    year = request.args.get('year')
-    camera_name = request.args.get('camera')
-    
+def calendar_query(args):
+    """(etag, build) for /api/calendar.
+
+    The ETag covers which days of the month have recordings and what today is,
+    so going back to a month costs a 304 until a day gains or loses recordings.
+    """
+    month = args.get('month')
+    year = args.get('year')
+    camera_name = args.get('camera')
     try:
         if month and year:
-            month = int(month)
-            year = int(year)
-            first_day = date(year, month, 1)
+            first_day = date(int(year), int(month), 1)
         else:
             first_day = date.today().replace(day=1)
     except (ValueError, TypeError):
-        return jsonify({'error': 'Invalid month or year'}), 400
-    
+        raise ValueError('Invalid month or year')
+
     # Get available dates with recordings
-    available_dates = get_available_dates(camera_name)
-    
-    # Generate calendar data
-    calendar_data = generate_calendar_data(first_day, available_dates)
-    
-    return jsonify({
-        'year': first_day.year,
-        'month': first_day.month,
-        'calendar': calendar_data
-    })
+    available_dates = get_available_dates(camera_name, first_day)
+    etag = summary_etag(first_day, camera_name, available_dates, date.today())
 
-def get_available_dates(camera_name=None):
-    """Get list of dates with recordings available"""
-    recordings_dir = os.getenv('RECORDINGS_PATH', '/mnt/data')
-    print(f"DEBUG: Using recordings directory: {recordings_dir}")
-    
-    # Handle relative paths (default to current directory)
-    if not os.path.isabs(recordings_dir):
-        recordings_dir = os.path.join(os.getcwd(), recordings_dir)
-        print(f"DEBUG: Updated to absolute path: {recordings_dir}")
-    
-    available_dates = set()
-    
-    # First check if recordings_dir exists
-    if not os.path.exists(recordings_dir):
-        print(f"Warning: Recordings directory {recordings_dir} does not exist")
-        return []
-    
-    print(f"DEBUG: Listing contents of recordings directory {recordings_dir}:")
-    for item in os.listdir(recordings_dir):
-        item_path = os.path.join(recordings_dir, item)
-        if os.path.isdir(item_path):
-            print(f"  - Directory: {item}")
-        else:
-            print(f"  - File: {item} ({os.path.getsize(item_path)} bytes)")
-            
-    if camera_name:
-        print(f"DEBUG: Filtering for camera: {camera_name}")
-    
-    # Check date directories directly in recordings folder (if we're using organized structure)
+    def build():
+        return {
+            'year': first_day.year,
+            'month': first_day.month,
+            'calendar': generate_calendar_data(first_day, available_dates)
+        }
+
+    return etag, build
+
+@app.route('/api/calendar')
+@login_required
+def api_calendar_data():
+    """API endpoint to get calendar data with recording availability"""
     try:
-        for item in os.listdir(recordings_dir):
-            item_path = os.path.join(recordings_dir, item)
-            
-            # If it's a date-formatted directory (try multiple formats)
-            if os.path.isdir(item_path):
-                # Try different date formats
-                recording_date = None
-                date_formats = ['%Y-%m-%d', '%Y%m%d', '%m-%d-%Y', '%d-%m-%Y']
-                
-                for date_format in date_formats:
-                    try:
-                        recording_date = datetime.strptime(item, date_format).date()
-                        print(f"DEBUG: Found date directory with format {date_format}: {item}")
-                        break  # Stop trying formats if we find a match
-                    except ValueError:
-                        continue
-                        
-                if recording_date:
-                    # If camera name specified, check if that camera has recordings on this date
-                    if camera_name:
-                        camera_dir = os.path.join(item_path, camera_name)
-                        if os.path.isdir(camera_dir) and any(f.endswith('.flv') for f in os.listdir(camera_dir)):
-                            available_dates.add(recording_date)
-                            print(f"DEBUG: Added date {recording_date} for camera {camera_name}")
-                    else:
-                        available_dates.add(recording_date)
-                        print(f"DEBUG: Added date {recording_date} (all cameras)")
-        
-        # Check for recordings directly in the root directory
-        for file in os.listdir(recordings_dir):
-            if file.endswith('.flv'):
-                file_path = os.path.join(recordings_dir, file)
-                
-                # Skip directories
-                if os.path.isdir(file_path):
-                    continue
-                
-                # If filtering by camera, skip files that don't match
-                if camera_name and not file.startswith(camera_name):
-                    continue
-                
-                try:
-                    # If it has a timestamp in the filename (CameraName-timestamp.flv)
-                    if '-' in file:
-                        parts = file.split('-', 1)
-                        if len(parts) == 2:
-                            # Try to extract date from timestamp
-                            timestamp_str = parts[1].replace('.flv', '')
-                            timestamp = int(timestamp_str)
-                            file_date = datetime.fromtimestamp(timestamp).date()
-                            available_dates.add(file_date)
-                    else:
-                        # If we can't parse the filename, use file modification time
-                        mtime = os.path.getmtime(file_path)
-                        file_date = datetime.fromtimestamp(mtime).date()
-                        available_dates.add(file_date)
-                except (ValueError, IndexError) as e:
-                    print(f"Error parsing date for {file}: {e}")
-                    continue
-    except Exception as e:
-        print(f"Error scanning recordings directory: {e}")
-    
-    return sorted(list(available_dates))
+        return conditional_json(calendar_query(request.args))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+def log_startup_environment():
+    """Log environment variables and the recordings directory when the web app starts"""
+    print("\n----- ENVIRONMENT VARIABLES -----")
+    print(f"RECORDINGS_PATH: {os.getenv('RECORDINGS_PATH', '(not set)')}")
+    print(f"PWD: {os.getcwd()}")
+    print(f"PYTHONPATH: {os.getenv('PYTHONPATH', '(not set)')}")
+    print(f"User: {os.getenv('USER', '(not set)')}")
+    print("--------------------------------\n")
 
-def get_recordings_by_date(camera_name, selected_date):
-    """Get list of recordings for a specific camera and date"""
+    # Check recordings directory on startup
+    recordings_path = os.getenv('RECORDINGS_PATH', '/mnt/data')
+    if not os.path.isabs(recordings_path):
+        recordings_path = os.path.join(os.getcwd(), recordings_path)
+
+    print(f"\n----- CHECKING RECORDINGS DIRECTORY: {recordings_path} -----")
+    if os.path.exists(recordings_path):
+        print(f"Directory exists, listing content:")
+        for item in os.listdir(recordings_path):
+            item_path = os.path.join(recordings_path, item)
+            item_type = "directory" if os.path.isdir(item_path) else "file"
+            item_size = os.path.getsize(item_path) if os.path.isfile(item_path) else "-"
+            print(f"  - {item} ({item_type}, {item_size} bytes)")
+
+        # Check for .flv files
+        flv_files = [f for f in os.listdir(recordings_path) if f.endswith('.flv')]
+        print(f"\nFound {len(flv_files)} .flv files:")
+        for flv in flv_files[:5]:  # Show only first 5
+            print(f"  - {flv}")
+        if len(flv_files) > 5:
+            print(f"  ... and {len(flv_files) - 5} more")
+    else:
+        print(f"Directory does not exist!")
+    print("--------------------------------\n")
+
+def get_recordings_root():
     recordings_dir = os.getenv('RECORDINGS_PATH', '/mnt/data')
-    print(f"DEBUG: Finding recordings for camera '{camera_name}' on date {selected_date}")
-    
     # Handle relative paths (default to current directory)
     if not os.path.isabs(recordings_dir):
         recordings_dir = os.path.join(os.getcwd(), recordings_dir)
-        print(f"DEBUG: Updated to absolute path: {recordings_dir}")
-    
-    recordings = []
-    
-    # Check if directory exists
-    if not os.path.exists(recordings_dir):
-        print(f"Warning: Recordings directory {recordings_dir} does not exist")
-        return []
-        
-    print(f"DEBUG: Checking for recordings in {recordings_dir}")
-    
-    # Try different date formats for directories
-    date_formats = ['%Y-%m-%d', '%Y%m%d', '%m-%d-%Y', '%d-%m-%Y']
-    potential_date_dirs = []
-    
-    for date_format in date_formats:
-        date_str = selected_date.strftime(date_format)
-        date_dir = os.path.join(recordings_dir, date_str)
-        if os.path.isdir(date_dir):
-            print(f"DEBUG: Found matching date directory: {date_dir}")
-            potential_date_dirs.append(date_dir)
-    
-    # Check all potential date directories
-    for date_dir in potential_date_dirs:
-        camera_dir = os.path.join(date_dir, camera_name)
-        
-        # Check organized recordings in date/camera directory (if they exist)
-        if os.path.isdir(camera_dir):
-            print(f"DEBUG: Found camera sub-directory: {camera_dir}")
-            for file in os.listdir(camera_dir):
-                if file.endswith('.flv'):
-                    file_path = os.path.join(camera_dir, file)
-                    recordings.append(get_recording_info(file, file_path, camera_name, recordings_dir))
-                    print(f"DEBUG: Added organized recording: {file}")
-    
-    if not potential_date_dirs:
-        print(f"DEBUG: No matching date directories found for date: {selected_date}")
-    
-    # Check for files directly in the recordings directory
+    return recordings_dir
+
+def reconcile_recordings_index():
+    """Sync the recordings index with the filesystem (cheap when little has changed)"""
+    session = db_session()
     try:
-        file_count = 0
-        flv_count = 0
-        matching_camera_count = 0
-        matching_date_count = 0
-        
-        print(f"DEBUG: Scanning files in {recordings_dir}")
-        
-        for file in os.listdir(recordings_dir):
-            file_count += 1
-            if file.endswith('.flv'):
-                flv_count += 1
-                file_path = os.path.join(recordings_dir, file)
-                print(f"DEBUG: Found FLV file: {file}")
-                
-                # Skip directories
-                if os.path.isdir(file_path):
-                    print(f"DEBUG: Skipping directory: {file}")
-                    continue
-                
-                # Check if this file belongs to this camera
-                if not file.startswith(camera_name):
-                    print(f"DEBUG: File {file} doesn't match camera {camera_name}")
-                    continue
-                
-                matching_camera_count += 1
-                print(f"DEBUG: File {file} matches camera {camera_name}")
-                
-                # Try to determine if this recording is from the selected date
-                try:
-                    # If the file follows the naming pattern with timestamp
-                    if '-' in file:
-                        parts = file.split('-', 1)
-                        if len(parts) == 2:
-                            timestamp_str = parts[1].replace('.flv', '')
-                            print(f"DEBUG: Extracted timestamp: {timestamp_str}")
-                            try:
-                                timestamp = int(timestamp_str)
-                                # Try to handle both seconds and milliseconds timestamps
-                                if timestamp > 253402300799:  # Year 9999 in seconds
-                                    timestamp = timestamp / 1000  # Convert from milliseconds to seconds
-                                file_date = datetime.fromtimestamp(timestamp).date()
-                                print(f"DEBUG: File date: {file_date}, Selected date: {selected_date}")
-                            except (ValueError, OverflowError) as e:
-                                print(f"DEBUG: Error parsing timestamp {timestamp_str}: {e}")
-                                # Fallback to file modification time
-                                mtime = os.path.getmtime(file_path)
-                                file_date = datetime.fromtimestamp(mtime).date()
-                                print(f"DEBUG: Using mtime date fallback: {file_date}")
-                            
-                            # Only include if date matches the selected date
-                            if file_date == selected_date:
-                                print(f"DEBUG: Date match! Adding recording {file}")
-                                recordings.append(get_recording_info(file, file_path, camera_name, recordings_dir))
-                                matching_date_count += 1
-                            else:
-                                print(f"DEBUG: Date mismatch. File date: {file_date}, Selected date: {selected_date}")
-                    else:
-                        # If we can't determine date from filename, use modification time
-                        mtime = os.path.getmtime(file_path)
-                        file_date = datetime.fromtimestamp(mtime).date()
-                        print(f"DEBUG: Using mtime date: {file_date}")
-                        if file_date == selected_date:
-                            print(f"DEBUG: Date match (mtime)! Adding recording {file}")
-                            recordings.append(get_recording_info(file, file_path, camera_name, recordings_dir))
-                            matching_date_count += 1
-                except (ValueError, IndexError) as e:
-                    # If we couldn't parse the date, log it and continue
-                    print(f"Error parsing date for {file}: {e}")
-                    continue
-                    
-        print(f"DEBUG: Found {file_count} total files, {flv_count} FLV files, {matching_camera_count} matching camera, {matching_date_count} matching date")
-        print(f"DEBUG: Final recordings count: {len(recordings)}")
-    except Exception as e:
-        print(f"Error scanning recordings directory: {e}")
-        # Continue with any recordings we've found so far
-    
-    # If no recordings found via timestamp matching, try a more lenient approach with file mtime
-    if not recordings and flv_count > 0:
-        print(f"DEBUG: No recordings matched by date, trying to match ANY FLV file by camera name")
-        for file in os.listdir(recordings_dir):
-            if file.endswith('.flv') and (not camera_name or file.startswith(camera_name)):
-                file_path = os.path.join(recordings_dir, file)
-                if os.path.isfile(file_path):
-                    print(f"DEBUG: Adding any matching recording (fallback): {file}")
-                    recordings.append(get_recording_info(file, file_path, camera_name, recordings_dir))
-    
-    # Sort recordings by timestamp
-    return sorted(recordings, key=lambda x: x['timestamp'])
-
-def get_recording_info(filename, file_path, camera_name, recordings_dir=None):
-    """Extract information about a recording file"""
-    if recordings_dir is None:
-        recordings_dir = os.getenv('RECORDINGS_PATH', '/mnt/data')
-        # Handle relative paths
-        if not os.path.isabs(recordings_dir):
-            recordings_dir = os.path.join(os.getcwd(), recordings_dir)
-        
+        return recordings_index.reconcile(session, get_recordings_root())
+    finally:
+        session.close()
+
+def day_bounds(selected_date):
+    """Local-time [start, end) timestamps of a day"""
+    start = datetime.combine(selected_date, datetime.min.time())
+    return int(start.timestamp()), int((start + timedelta(days=1)).timestamp())
+
+def month_range(month):
+    """First and last possible YYYY-MM-DD of a month, for range queries on RecordingDay.day"""
+    return month.strftime('%Y-%m-01'), month.strftime('%Y-%m-31')
+
+def get_available_dates(camera_name=None, month=None):
+    """Dates with recordings (optionally only in `month`), from the per-day summary"""
+    session = db_session()
     try:
-        # Get file stats
-        stat = os.stat(file_path)
-        
-        # Try to extract timestamp from filename
-        timestamp = None
-        if '-' in filename:
-            parts = filename.split('-', 1)
-            if len(parts) == 2:
-                timestamp_str = parts[1].replace('.flv', '')
-                try:
-                    timestamp = int(timestamp_str)
-                    # Try to handle both seconds and milliseconds timestamps
-                    if timestamp > 253402300799:  # Year 9999 in seconds
-                        timestamp = timestamp / 1000  # Convert from milliseconds to seconds
-                except (ValueError, OverflowError):
-                    timestamp = int(stat.st_mtime)
-        
-        if timestamp is None:
-            timestamp = int(stat.st_mtime)
-        
-        # Get file size
-        size_bytes = stat.st_size
-        if size_bytes < 1024:
-            size_str = f"{size_bytes} B"
-        elif size_bytes < 1024 * 1024:
-            size_str = f"{size_bytes / 1024:.1f} KB"
-        elif size_bytes < 1024 * 1024 * 1024:
-            size_str = f"{size_bytes / (1024 * 1024):.1f} MB"
-        else:
-            size_str = f"{size_bytes / (1024 * 1024 * 1024):.1f} GB"
-        
-        # Calculate relative path for URL
-        rel_path = os.path.relpath(file_path, recordings_dir)
-        
-        return {
-            'filename': filename,
-            'camera': camera_name,
-            'timestamp': timestamp,
-            'datetime': datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S'),
-            'time': datetime.fromtimestamp(timestamp).strftime('%H:%M:%S'),
-            'size': size_bytes,
-            'size_str': size_str,
-            'path': rel_path,
-            'url': f"/recording/{rel_path}"
-        }
-    except Exception as e:
-        # Return a basic info object if we can't extract details
-        try:
-            # Try to get relative path even if other processing failed
-            rel_path = os.path.relpath(file_path, recordings_dir)
-        except:
-            # If all else fails, just use the filename
-            rel_path = filename
-            
-        return {
-            'filename': filename,
-            'camera': camera_name,
-            'timestamp': 0,
-            'datetime': 'Unknown',
-            'time': 'Unknown',
-            'size': 0,
-            'size_str': 'Unknown',
-            'path': rel_path,
-            'url': f"/recording/{rel_path}",
-            'error': str(e)
-        }
+        query = session.query(RecordingDay.day).filter(RecordingDay.segments > 0).distinct()
+        if camera_name:
+            query = query.filter(RecordingDay.camera == camera_name)
+        if month:
+            first, last = month_range(month)
+            query = query.filter(RecordingDay.day >= first, RecordingDay.day <= last)
+        return sorted(datetime.strptime(value, '%Y-%m-%d').date() for (value,) in query)
+    finally:
+        session.close()
 
-def generate_thumbnail(video_path, time_offset='00:00:05'):
-    """Generate a thumbnail from a video file"""
+def get_day_summary(selected_date, camera_name=None):
+    """{camera: (segments, generation)} for a day"""
+    session = db_session()
     try:
-        # Use ffmpeg to extract a frame from the video
-        cmd = [
-            'ffmpeg',
-            '-i', video_path,
-            '-ss', time_offset,  # Seek to 5 seconds
-            '-vframes', '1',     # Extract one frame
-            '-vf', 'scale=320:-1',  # Scale to 320px width
-            '-f', 'image2pipe',  # Output to pipe
-            '-c:v', 'png',       # Output format
-            '-'                  # Output to stdout
-        ]
-        
-        result = subprocess.run(cmd, capture_output=True, check=True)
-        
-        # Convert the binary image data to base64
-        image_b64 = base64.b64encode(result.stdout).decode('utf-8')
-        
-        # Return data URL
-        return f"data:image/png;base64,{image_b64}"
-    except subprocess.CalledProcessError as e:
-        # If error, try another method (extract first frame)
-        try:
-            cmd = [
-                'ffmpeg',
-                '-i', video_path,
-                '-vframes', '1',
-                '-vf', 'scale=320:-1',
-                '-f', 'image2pipe',
-                '-c:v', 'png',
-                '-'
-            ]
-            result = subprocess.run(cmd, capture_output=True, check=True)
-            image_b64 = base64.b64encode(result.stdout).decode('utf-8')
-            return f"data:image/png;base64,{image_b64}"
-        except:
-            raise Exception(f"Failed to generate thumbnail: {e.stderr.decode('utf-8')}")
+        query = session.query(RecordingDay.camera, RecordingDay.segments, RecordingDay.generation).filter(
+            RecordingDay.day == selected_date.isoformat()
+        )
+        if camera_name:
+            query = query.filter(RecordingDay.camera == camera_name)
+        return {camera: (segments, generation) for camera, segments, generation in query}
+    finally:
+        session.close()
+
+def get_month_summary(month, camera_name=None):
+    session = db_session()
+    try:
+        first, last = month_range(month)
+        query = session.query(RecordingDay).filter(RecordingDay.day >= first, RecordingDay.day <= last)
+        if camera_name:
+            query = query.filter(RecordingDay.camera == camera_name)
+        rows = query.order_by(RecordingDay.camera, RecordingDay.day).all()
+        # Detached copies stay readable after the session closes
+        session.expunge_all()
+        return rows
+    finally:
+        session.close()
+
+def get_recordings_by_date(camera_name, selected_date, limit=None, offset=0):
+    """Recordings for a camera and date from the recordings index.
+
+    Without a camera, returns {camera: recordings} for every camera's day.
+    """
+    start_ts, end_ts = day_bounds(selected_date)
+    session = db_session()
+    try:
+        recordings = session.query(Recording).filter(
+            Recording.start_ts >= start_ts,
+            Recording.start_ts < end_ts
+        )
+        if camera_name is None:
+            by_camera = {}
+            for recording in recordings.order_by(Recording.camera, Recording.start_ts):
+                by_camera.setdefault(recording.camera, []).append(get_recording_info(recording))
+            return by_camera
+        recordings = recordings.filter(Recording.camera == camera_name).order_by(Recording.start_ts, Recording.id)
+        if limit is not None:
+            recordings = recordings.offset(offset).limit(limit)
+        return [get_recording_info(recording) for recording in recordings]
+    finally:
+        session.close()
+
+def format_size(size_bytes):
+    if size_bytes < 1024:
+        return f"{size_bytes} B"
+    elif size_bytes < 1024 * 1024:
+        return f"{size_bytes / 1024:.1f} KB"
+    elif size_bytes < 1024 * 1024 * 1024:
+        return f"{size_bytes / (1024 * 1024):.1f} MB"
+    return f"{size_bytes / (1024 * 1024 * 1024):.1f} GB"
+
+def get_recording_info(recording):
+    """Describe an indexed recording for templates and the JSON API"""
+    started = datetime.fromtimestamp(recording.start_ts)
+    return {
+        'filename': os.path.basename(recording.path),
+        'camera': recording.camera,
+        'timestamp': recording.start_ts,
+        'end_timestamp': recording.end_ts,
+        'duration': recording.duration,
+        'datetime': started.strftime('%Y-%m-%d %H:%M:%S'),
+        'time': started.strftime('%H:%M:%S'),
+        'size': recording.size,
+        'size_str': format_size(recording.size),
+        'path': recording.path,
+        'url': f"/recording/{recording.path}",
+        'play_url': f"/play/{recording.path}",
+        'thumbnail_url': f"/thumbnail/{recording.path}",
+        'filmstrip_url': f"/api/recording/filmstrip?path={quote(recording.path)}"
+    }
 
 def generate_calendar_data(selected_date, available_dates):
     """Generate calendar data for a month containing the selected date"""
@@ -878,4 +1291,7 @@ def generate_calendar_data(selected_date, available_dates):
     }
 
 if __name__ == '__main__':
+    log_startup_environment()
+    # Index whatever was recorded while the web app was down, without delaying startup
+    threading.Thread(target=reconcile_recordings_index, daemon=True).start()
     app.run(host='0.0.0.0', port=int(os.environ.get('FLASK_PORT', 5001)), debug=False)
\ No newline at end of file
@@ -0,0 +1,99 @@
+"""Compare the Flask server and the async API server under concurrent dashboard polling.
+
+Logs in through Flask, then runs C simulated dashboards against each base URL
+for a fixed time. Each dashboard keeps polling what the UI polls: stream
+status, a snapshot of every camera, and the day's recordings and calendar.
+Reports requests/s, latency percentiles and errors. By default the two
+servers are Flask on port 5001 and the async tier (app/async_web.py) on 5002.
+The login cookie is shared, since both check the same Flask session.
+
+    python3 benchmarks/dashboard_load.py --password secret --cameras 1,2,3,4 \
+        --dashboards 50 --seconds 20
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from datetime import date
+
+import aiohttp
+
+async def login(http, base_url, password):
+    async with http.post(f"{base_url}/login", data={'password': password}, allow_redirects=False) as response:
+        if response.status != 302:
+            raise SystemExit(f"Login to {base_url} failed ({response.status})")
+
+def dashboard_urls(base_url, camera_ids, day):
+    return [f"{base_url}/stream_status"] + [
+        f"{base_url}/api/camera/{camera_id}/snapshot" for camera_id in camera_ids
+    ] + [
+        f"{base_url}/api/recordings?date={day}",
+        f"{base_url}/api/calendar?year={day[:4]}&month={int(day[5:7])}"
+    ]
+
+async def dashboard(http, urls, deadline, latencies, errors):
+    while time.perf_counter() < deadline:
+        for url in urls:
+            started = time.perf_counter()
+            try:
+                async with http.get(url, allow_redirects=False) as response:
+                    await response.read()
+                    # A camera without a snapshot yet answers 404, which is still a served request
+                    if response.status >= 500 or response.status == 302:
+                        errors.append(response.status)
+                        continue
+            except aiohttp.ClientError as e:
+                errors.append(type(e).__name__)
+                continue
+            latencies.append(time.perf_counter() - started)
+
+async def run(http, base_url, camera_ids, day, dashboards, seconds):
+    urls = dashboard_urls(base_url, camera_ids, day)
+    # Warm caches (camera registry, page cache, SQLite) on both servers alike
+    for url in urls:
+        async with http.get(url) as response:
+            await response.read()
+    latencies = []
+    errors = []
+    started = time.perf_counter()
+    deadline = started + seconds
+    await asyncio.gather(*(dashboard(http, urls, deadline, latencies, errors) for _ in range(dashboards)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    def percentile(p):
+        return latencies[min(int(len(latencies) * p), len(latencies) - 1)] * 1000 if latencies else float('nan')
+    return {
+        'requests_s': len(latencies) / elapsed,
+        'p50_ms': percentile(0.5),
+        'p95_ms': percentile(0.95),
+        'p99_ms': percentile(0.99),
+        'mean_ms': statistics.mean(latencies) * 1000 if latencies else float('nan'),
+        'errors': len(errors)
+    }
+
+async def main_async(args):
+    camera_ids = [camera_id for camera_id in args.cameras.split(',') if camera_id]
+    connector = aiohttp.TCPConnector(limit=0)
+    # unsafe=True keeps cookies for IP-address hosts like 127.0.0.1
+    async with aiohttp.ClientSession(connector=connector, cookie_jar=aiohttp.CookieJar(unsafe=True)) as http:
+        await login(http, args.flask_url, args.password)
+        for name, base_url in (('flask', args.flask_url), ('aiohttp', args.async_url)):
+            result = await run(http, base_url, camera_ids, args.date, args.dashboards, args.seconds)
+            print(f"{name:8} {result['requests_s']:8.1f} req/s  p50 {result['p50_ms']:7.1f}ms  "
+                  f"p95 {result['p95_ms']:7.1f}ms  p99 {result['p99_ms']:7.1f}ms  "
+                  f"mean {result['mean_ms']:7.1f}ms  errors {result['errors']}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--password', required=True, help="WEBSITE_PASSWORD")
+    parser.add_argument('--cameras', default='1', help="comma-separated camera ids to fetch snapshots of")
+    parser.add_argument('--date', default=date.today().isoformat(), help="day whose recordings are listed")
+    parser.add_argument('--flask-url', default='http://127.0.0.1:5001')
+    parser.add_argument('--async-url', default='http://127.0.0.1:5002')
+    parser.add_argument('--dashboards', type=int, default=50, help="concurrent dashboards")
+    parser.add_argument('--seconds', type=float, default=20)
+    args = parser.parse_args()
+    asyncio.run(main_async(args))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""Compare recording download throughput through Flask and through nginx.
+
+Logs in, then downloads the same recording N times with C concurrent clients
+from each base URL and reports MB/s and per-download latency. By default the
+two paths are the web app on port 5001 (Flask's send_file) and the same app
+behind nginx on port 8080 (X-Accel-Redirect).
+
+    python3 benchmarks/download_throughput.py --password secret \
+        --recording 2024-05-01/front/front-1714550400.flv --downloads 20 --concurrency 4
+"""
+import argparse
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+CHUNK_SIZE = 1024 * 1024
+
+def login(base_url, password):
+    session = requests.Session()
+    response = session.post(f"{base_url}/login", data={'password': password}, allow_redirects=False)
+    if response.status_code != 302:
+        raise SystemExit(f"Login to {base_url} failed ({response.status_code})")
+    return session
+
+def download(session, url):
+    started = time.perf_counter()
+    size = 0
+    with session.get(url, stream=True) as response:
+        response.raise_for_status()
+        for chunk in response.iter_content(CHUNK_SIZE):
+            size += len(chunk)
+    return size, time.perf_counter() - started
+
+def run(base_url, password, recording, downloads, concurrency):
+    session = login(base_url, password)
+    url = f"{base_url}/recording/{recording}"
+    # Warm the page cache so both paths read from memory
+    download(session, url)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(lambda _: download(session, url), range(downloads)))
+    elapsed = time.perf_counter() - started
+    total = sum(size for size, _ in results)
+    latencies = sorted(seconds for _, seconds in results)
+    return {
+        'throughput_mb_s': total / elapsed / 1024 / 1024,
+        'median_s': statistics.median(latencies),
+        'max_s': latencies[-1],
+        'bytes': total
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--password', required=True, help="WEBSITE_PASSWORD")
+    parser.add_argument('--recording', required=True, help="path relative to the recordings folder")
+    parser.add_argument('--flask-url', default='http://127.0.0.1:5001')
+    parser.add_argument('--nginx-url', default='http://127.0.0.1:8080')
+    parser.add_argument('--downloads', type=int, default=20)
+    parser.add_argument('--concurrency', type=int, default=4)
+    args = parser.parse_args()
+
+    for name, base_url in (('flask send_file', args.flask_url), ('nginx X-Accel-Redirect', args.nginx_url)):
+        result = run(base_url, args.password, args.recording, args.downloads, args.concurrency)
+        print(f"{name:24} {result['throughput_mb_s']:8.1f} MB/s  "
+              f"median {result['median_s']:.2f}s  max {result['max_s']:.2f}s  ({result['bytes']} bytes)")
+
+if __name__ == '__main__':
+    main()
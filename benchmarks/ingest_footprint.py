@@ -0,0 +1,98 @@
+"""Compare the RSS/CPU of per-camera and sharded ingest on the same cameras.
+
+Runs a StreamManager for each --shard-sizes value in turn (0 is one
+gst-launch-1.0 process per camera, N > 1 is app.shard_worker processes of N
+cameras each). After --warmup seconds it samples get_footprint() every
+--interval seconds for --seconds, then stops every pipeline before the next
+mode. CPU is measured between samples, so startup isn't counted. Reports mean
+and peak RSS and mean CPU, in total and per camera.
+
+The cameras are the ones in the camera table (DATABASE_URL), or --count
+synthetic cameras that all pull --url, e.g. an RTSP test server. Ingest runs
+as it would in app.main, so RECORDING_MODE and the other stream settings
+apply, and rtmp mode needs nginx-rtmp running. Don't run it next to a live
+app.main on the same cameras.
+
+    python3 benchmarks/ingest_footprint.py --shard-sizes 0,8 --seconds 120
+    python3 benchmarks/ingest_footprint.py --url rtsp://127.0.0.1:8554/test --count 32 --shard-sizes 0,4,16
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.stream_manager import StreamManager, install_child_watcher
+
+def load_cameras(args):
+    if args.url:
+        return [
+            SimpleNamespace(id=index + 1, name=f"bench{index:02d}", stream_url=args.url,
+                            username=None, password=None, sub_stream_url=None)
+            for index in range(args.count)
+        ]
+    from app.database import Camera, init_db
+    session = init_db()
+    try:
+        return session.query(Camera).order_by(Camera.id).all()
+    finally:
+        session.close()
+
+async def measure(cameras, shard_size, warmup, seconds, interval):
+    stream_manager = StreamManager(shard_size=shard_size)
+    await stream_manager.start_all_streams(cameras)
+    try:
+        await asyncio.sleep(warmup)
+        # CPU percent is measured since the previous sample; this one only sets the start
+        stream_manager.get_footprint()
+        samples = []
+        for _ in range(max(int(seconds / interval), 1)):
+            await asyncio.sleep(interval)
+            samples.append(stream_manager.get_footprint())
+    finally:
+        await stream_manager.stop_all_streams()
+    return samples
+
+def summarize(samples):
+    cameras = max(sample['cameras'] for sample in samples)
+    rss_mb = [sample['rss_bytes'] / 1048576 for sample in samples]
+    cpu = [sample['cpu_percent'] for sample in samples]
+    return {
+        'mode': samples[-1]['mode'],
+        'processes': samples[-1]['processes'],
+        'cameras': cameras,
+        'rss_mb': statistics.mean(rss_mb),
+        'rss_mb_peak': max(rss_mb),
+        'cpu_percent': statistics.mean(cpu),
+        'rss_mb_per_camera': statistics.mean(rss_mb) / cameras if cameras else 0.0,
+        'cpu_percent_per_camera': statistics.mean(cpu) / cameras if cameras else 0.0
+    }
+
+async def main_async(args):
+    install_child_watcher()
+    cameras = load_cameras(args)
+    if not cameras:
+        raise SystemExit("No cameras; add some or pass --url and --count")
+    for shard_size in (int(value) for value in args.shard_sizes.split(',') if value):
+        result = summarize(await measure(cameras, shard_size, args.warmup, args.seconds, args.interval))
+        print(f"shard_size={shard_size:<3} {result['mode']:18} processes {result['processes']:4}  "
+              f"cameras {result['cameras']:4}  rss {result['rss_mb']:8.1f}MB (peak {result['rss_mb_peak']:.1f})  "
+              f"cpu {result['cpu_percent']:6.1f}%  per camera {result['rss_mb_per_camera']:6.1f}MB "
+              f"{result['cpu_percent_per_camera']:5.2f}%")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--shard-sizes', default='0,8', help="comma-separated SHARD_SIZE values to compare")
+    parser.add_argument('--url', help="stream URL for synthetic cameras instead of the camera table")
+    parser.add_argument('--count', type=int, default=16, help="synthetic cameras with --url")
+    parser.add_argument('--warmup', type=float, default=30, help="seconds to let pipelines settle")
+    parser.add_argument('--seconds', type=float, default=120)
+    parser.add_argument('--interval', type=float, default=10, help="seconds between samples")
+    args = parser.parse_args()
+    asyncio.run(main_async(args))
+
+if __name__ == '__main__':
+    main()
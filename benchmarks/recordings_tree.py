@@ -0,0 +1,361 @@
+"""Time the web app's and file_mover's recordings-tree hot paths on a synthetic tree.
+
+Generates a fake recordings folder (normally /mnt/data) in a temporary
+directory: C cameras x D days x S segments per day. The newest --unfiled
+segments of each camera are left in the root, where recording writes them.
+Everything older is filed under YYYY-MM-DD/<camera>/, as file_mover leaves
+it. Segment files are sparse, so the tree costs inodes but almost no disk
+space. The segments are indexed into a fresh SQLite database, as in a
+running install.
+
+Each hot path is timed as the best of --repeat runs. The tree and index are
+restored between runs of the ones that move or delete segments. One more run
+counts the calls that reach the filesystem:
+- the os functions behind os.path and os.scandir (stat, listdir, rename,
+  remove, mkdir, rmdir, ...), counted by wrapping them;
+- the process's read and write syscalls from /proc/self/io, which are mostly
+  SQLite's I/O. These are only counted on Linux.
+
+--save-baseline stores the results. Later runs with the same tree size
+compare against them. A run exits with status 1 when a path got slower than
+--time-tolerance or makes more calls than --call-tolerance allows. Timings
+depend on the machine, so baselines are local and not committed.
+
+    python3 benchmarks/recordings_tree.py --save-baseline
+    python3 benchmarks/recordings_tree.py
+    python3 benchmarks/recordings_tree.py --cameras 8 --days 7 --repeat 5
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BASELINE = os.path.join(REPO_ROOT, 'benchmarks', 'recordings_tree.baseline.json')
+
+# Newest segment ends this long before the run starts, so every segment counts as closed
+SETTLED_MARGIN = 3600
+
+# os functions whose calls are counted; os.path.exists/isdir/getsize/... all go through os.stat
+COUNTED_OS_CALLS = (
+    'stat', 'lstat', 'listdir', 'scandir', 'rename', 'replace', 'remove', 'unlink',
+    'mkdir', 'rmdir', 'open', 'utime', 'truncate', 'statvfs'
+)
+
+# Differences smaller than these are noise, whatever the tolerance
+MIN_TIME_REGRESSION = 0.005
+MIN_CALL_REGRESSION = 5
+
+def build_segments(cameras, days, segments_per_day, unfiled):
+    """[(rel_path, start, mtime)] of the synthetic tree, newest segments in the root"""
+    segment_seconds = 86400 // segments_per_day
+    newest = (int(time.time()) - SETTLED_MARGIN) // segment_seconds * segment_seconds - segment_seconds
+    segments = []
+    for index in range(cameras):
+        camera = f"cam{index:02d}"
+        for age in range(days * segments_per_day):
+            start = newest - age * segment_seconds
+            filename = f"{camera}-{start}.flv"
+            if age < unfiled:
+                rel_path = filename
+            else:
+                # The same folder file_mover would pick
+                rel_path = f"{datetime.fromtimestamp(start).strftime('%Y-%m-%d')}/{camera}/{filename}"
+            segments.append((rel_path, start, start + segment_seconds))
+    return segments
+
+def create_segments(root, segments, size, existing_dirs):
+    """Create any missing segment files; returns how many were created"""
+    created = 0
+    for rel_path, _, mtime in segments:
+        path = os.path.join(root, rel_path)
+        if os.path.exists(path):
+            continue
+        folder = os.path.dirname(path)
+        if folder not in existing_dirs or not os.path.isdir(folder):
+            os.makedirs(folder, exist_ok=True)
+            existing_dirs.add(folder)
+        with open(path, 'wb') as f:
+            f.truncate(size)
+        os.utime(path, (mtime, mtime))
+        created += 1
+    return created
+
+def index_segments(session, root, segments, size):
+    """Index the tree in bulk, then reconcile once so directory mtimes are recorded"""
+    from app import recordings_index
+    from app.database import Recording
+
+    session.bulk_insert_mappings(Recording, [
+        {
+            'camera': os.path.basename(rel_path).rsplit('-', 1)[0],
+            'start_ts': start,
+            'end_ts': mtime,
+            'duration': mtime - start,
+            'size': size,
+            'path': rel_path
+        }
+        for rel_path, start, mtime in segments
+    ])
+    session.commit()
+    recordings_index.reconcile(session, root)
+
+def restore_tree(root, segments, unfiled, size, session, existing_dirs):
+    """Undo organize_video_files and cleanup_old_recordings, then bring the index back in line"""
+    from app import file_mover, recordings_index
+
+    for rel_path in unfiled:
+        filed = os.path.join(root, file_mover_folder(rel_path), rel_path)
+        if os.path.exists(filed):
+            os.rename(filed, os.path.join(root, rel_path))
+    create_segments(root, segments, size, existing_dirs)
+    # The mover starts out not knowing which folders exist
+    file_mover._created_folders.clear()
+    recordings_index.reconcile(session, root)
+
+def file_mover_folder(filename):
+    from app import recordings_index
+
+    camera, start = recordings_index.parse_segment_filename(filename)
+    return os.path.join(datetime.fromtimestamp(start).strftime('%Y-%m-%d'), camera)
+
+class CountedDirEntry:
+    """An os.DirEntry whose stat() calls are counted (is_file() and is_dir() use d_type)"""
+    def __init__(self, entry, counts):
+        self._entry = entry
+        self._counts = counts
+
+    def __getattr__(self, name):
+        return getattr(self._entry, name)
+
+    def stat(self, **kwargs):
+        self._counts['stat'] += 1
+        return self._entry.stat(**kwargs)
+
+class CountedScandir:
+    def __init__(self, iterator, counts):
+        self._iterator = iterator
+        self._counts = counts
+
+    def __iter__(self):
+        return (CountedDirEntry(entry, self._counts) for entry in self._iterator)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self._iterator.close()
+
+def scandir_counter(original, counts):
+    def scandir(*args):
+        counts['scandir'] += 1
+        return CountedScandir(original(*args), counts)
+    return scandir
+
+def read_proc_io():
+    try:
+        with open('/proc/self/io') as f:
+            fields = dict(line.split(': ') for line in f.read().splitlines())
+    except OSError:
+        return None
+    return {'read': int(fields['syscr']), 'write': int(fields['syscw'])}
+
+def proc_io_overhead():
+    """Syscalls read_proc_io() itself adds between two readings"""
+    first = read_proc_io()
+    second = read_proc_io()
+    if first is None or second is None:
+        return None
+    return {name: second[name] - first[name] for name in first}
+
+@contextmanager
+def count_calls():
+    """Count filesystem calls made inside the block; yields the Counter, filled in on exit"""
+    counts = Counter()
+    originals = {name: getattr(os, name) for name in COUNTED_OS_CALLS if hasattr(os, name)}
+
+    def counted(name, func):
+        def wrapper(*args, **kwargs):
+            counts[name] += 1
+            return func(*args, **kwargs)
+        return wrapper
+
+    for name, func in originals.items():
+        setattr(os, name, counted(name, func))
+    os.scandir = scandir_counter(originals['scandir'], counts)
+    overhead = proc_io_overhead()
+    io_before = read_proc_io()
+    try:
+        yield counts
+    finally:
+        io_after = read_proc_io()
+        for name, func in originals.items():
+            setattr(os, name, func)
+        if io_before and io_after:
+            for name in io_before:
+                counts[f"sys_{name}"] = io_after[name] - io_before[name] - overhead[name]
+
+def measure(setup, run, repeat):
+    """Best of `repeat` timed runs, plus the calls made by one more run"""
+    timings = []
+    for _ in range(repeat):
+        setup()
+        started = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - started)
+    setup()
+    with count_calls() as counts:
+        run()
+    return {'seconds': min(timings), 'calls': dict(sorted(counts.items()))}
+
+def run_benchmarks(root, args):
+    """Generate and index the tree, then measure every hot path"""
+    from app import file_mover, web
+    from app.database import Recording, get_session_factory
+
+    size = args.segment_mb * 1024 * 1024
+    segments = build_segments(args.cameras, args.days, args.segments, args.unfiled)
+    unfiled = [rel_path for rel_path, _, _ in segments if '/' not in rel_path]
+    existing_dirs = set()
+
+    started = time.perf_counter()
+    create_segments(root, segments, size, existing_dirs)
+    session = get_session_factory()()
+    index_segments(session, root, segments, size)
+    print(f"Generated and indexed {len(segments)} segments ({len(unfiled)} unfiled) "
+          f"in {time.perf_counter() - started:.1f}s")
+
+    def restore():
+        restore_tree(root, segments, unfiled, size, session, existing_dirs)
+
+    def nothing():
+        pass
+
+    # A full day in the middle of the tree, and its rows for get_recording_info
+    camera = 'cam00'
+    day = datetime.fromtimestamp(segments[len(segments) // args.cameras // 2][1]).date()
+    start_ts, end_ts = web.day_bounds(day)
+    rows = session.query(Recording).filter(Recording.start_ts >= start_ts, Recording.start_ts < end_ts).all()
+    session.expunge_all()
+
+    benchmarks = [
+        ('reconcile', nothing, lambda: file_mover.recordings_index.reconcile(session, root)),
+        ('get_available_dates', nothing, lambda: web.get_available_dates()),
+        ('get_available_dates_camera', nothing, lambda: web.get_available_dates(camera)),
+        ('get_recordings_by_date', nothing, lambda: web.get_recordings_by_date(camera, day)),
+        ('get_recordings_by_date_all', nothing, lambda: web.get_recordings_by_date(None, day)),
+        ('get_recording_info', nothing, lambda: [web.get_recording_info(row) for row in rows]),
+        ('organize_video_files', restore, lambda: file_mover.organize_video_files(session)),
+        ('cleanup_old_recordings', restore, lambda: file_mover.cleanup_old_recordings(session)),
+    ]
+    results = {}
+    for name, setup, run in benchmarks:
+        if args.only and name not in args.only:
+            continue
+        results[name] = measure(setup, run, args.repeat)
+        print_result(name, results[name])
+    session.close()
+    return results
+
+def print_result(name, result):
+    calls = ' '.join(f"{call}={count}" for call, count in result['calls'].items())
+    print(f"{name:28} {result['seconds'] * 1000:10.2f} ms  {calls}")
+
+def find_regressions(results, baseline, time_tolerance, call_tolerance):
+    problems = []
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        seconds, before = result['seconds'], previous['seconds']
+        if seconds > before * (1 + time_tolerance) and seconds - before > MIN_TIME_REGRESSION:
+            problems.append(f"{name}: {seconds * 1000:.2f} ms, baseline {before * 1000:.2f} ms")
+        for call, count in result['calls'].items():
+            before = previous['calls'].get(call, 0)
+            if count > before * (1 + call_tolerance) and count - before > MIN_CALL_REGRESSION:
+                problems.append(f"{name}: {count} {call} calls, baseline {before}")
+    return problems
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--cameras', type=int, default=64)
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--segments', type=int, default=144, help="segments per camera per day")
+    parser.add_argument('--unfiled', type=int, default=None,
+                        help="newest segments per camera left in the root (default: one day's worth)")
+    parser.add_argument('--segment-mb', type=int, default=30, help="apparent size of each (sparse) segment")
+    parser.add_argument('--retention-days', type=int, default=None,
+                        help="RETENTION_DAYS for cleanup_old_recordings (default: --days minus 2)")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--only', nargs='+', help="benchmark names to run")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true', help="store this run's results as the baseline")
+    parser.add_argument('--time-tolerance', type=float, default=0.5, help="allowed slowdown (0.5 = 50%%)")
+    parser.add_argument('--call-tolerance', type=float, default=0.05, help="allowed growth in call counts")
+    parser.add_argument('--keep', action='store_true', help="leave the generated tree in place")
+    args = parser.parse_args()
+    if args.unfiled is None:
+        args.unfiled = args.segments
+    if args.retention_days is None:
+        args.retention_days = max(args.days - 2, 1)
+
+    workdir = tempfile.mkdtemp(prefix='nvr-bench-')
+    root = os.path.join(workdir, 'data')
+    os.makedirs(root)
+    # Configure the app for the temporary tree before any of it is imported
+    os.environ.update({
+        'DATABASE_URL': f"sqlite:///{os.path.join(workdir, 'cameras.db')}",
+        'RECORDINGS_PATH': root,
+        'FILE_MOVER_STATS_FILE': os.path.join(workdir, 'file_mover_stats.json'),
+        'RETENTION_DAYS': str(args.retention_days),
+        # Only the age rule: the temporary directory's disk says nothing about a real install
+        'RETENTION_FREE_LOW': '',
+    })
+    for name in ('RETENTION_MAX_BYTES', 'RETENTION_CAMERA_MAX_BYTES', 'RETENTION_CAMERA_QUOTAS'):
+        os.environ.pop(name, None)
+    sys.path.insert(0, REPO_ROOT)
+    from app import file_mover
+    file_mover.RECORDINGS_FOLDER = root
+    file_mover.STAGING_FOLDER = os.path.join(root, '.staging')
+    # Per-file INFO logging would time the terminal, not the code
+    logging.getLogger().setLevel(logging.WARNING)
+
+    key = f"cameras={args.cameras} days={args.days} segments={args.segments} unfiled={args.unfiled}"
+    print(f"Tree: {key}, retention {args.retention_days} days, in {workdir}")
+    try:
+        results = run_benchmarks(root, args)
+    finally:
+        if args.keep:
+            print(f"Kept {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baselines = json.load(f)
+    if args.save_baseline:
+        baselines[key] = {**baselines.get(key, {}), **results}
+        with open(args.baseline, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+        print(f"Saved baseline to {args.baseline}")
+        return
+    if key not in baselines:
+        print(f"No baseline for this tree size in {args.baseline}; run with --save-baseline first")
+        return
+    problems = find_regressions(results, baselines[key], args.time_tolerance, args.call_tolerance)
+    for problem in problems:
+        print(f"REGRESSION {problem}")
+    if problems:
+        sys.exit(1)
+    print("No regressions against the baseline")
+
+if __name__ == '__main__':
+    main()
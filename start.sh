@@ -47,18 +47,9 @@ if [ $? -ne 0 ]; then
     exit 1
 fi
 
-# Start cron service for file mover and cleanup
-echo "Setting up cron jobs for file mover and cleanup..."
-# Run file mover every minute for organizing
-echo "*/1 * * * * cd /app/app && python3 file_mover.py >> /var/log/cron.log 2>&1" > /etc/cron.d/move_files
-# Also run a dedicated cleanup job at 1am
-echo "0 1 * * * cd /app/app && python3 -c 'from file_mover import cleanup_old_recordings; cleanup_old_recordings()' >> /var/log/cron.log 2>&1" > /etc/cron.d/cleanup_files
-chmod 0644 /etc/cron.d/move_files
-chmod 0644 /etc/cron.d/cleanup_files
-crontab /etc/cron.d/move_files
-crontab -l | cat - /etc/cron.d/cleanup_files | crontab -
-service cron start
-echo "Cron service started."
+# Start the file mover, which organizes segments as they close and applies retention
+echo "Starting file mover..."
+python3 -m app.file_mover --daemon >> /var/log/file_mover.log 2>&1 &
 
 # Start the Python NVR application in the background
 echo "Starting NVR application..."